@@ -2,63 +2,2776 @@ import subprocess
 import os
 import signal
 import asyncio
+import base64
+import time
+import json
+import hashlib
+import hmac
+import fcntl
+import http.cookiejar
+import zlib
+import bisect
+import logging
+import logging.handlers
+import queue
+import sys
+import random
+import uuid
+import stat
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import anyio
 import httpx
+import jwt
+from dotenv import dotenv_values
+import websockets
+from websockets.asyncio.client import connect as websockets_connect
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse, Response
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
+from starlette.websockets import WebSocketState
 from contextlib import asynccontextmanager
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NODE_BACKEND_DIR = "/app/foratask-backend"
 NODE_BACKEND_PORT = 3333
-NODE_BACKEND_URL = f"http://127.0.0.1:{NODE_BACKEND_PORT}"
-node_process = None
 
-def start_node_backend():
-    global node_process
+# "production" execs node directly; "dev" keeps the nodemon file watcher
+NODE_LAUNCH_MODE = os.environ.get(
+    "NODE_LAUNCH_MODE", "production" if os.environ.get("NODE_ENV") == "production" else "dev"
+)
+NODE_READY_TIMEOUT = float(os.environ.get("NODE_READY_TIMEOUT", "60"))
+
+# "uds": Node listens on NODE_SOCKET_DIR/node-<port>.sock instead of the TCP port; worker URLs keep the
+# 127.0.0.1:<port> form and the upstream client routes each one to its socket. "tcp" listens on the port
+NODE_TRANSPORT = os.environ.get("NODE_TRANSPORT", "uds")
+NODE_SOCKET_DIR = os.environ.get("NODE_SOCKET_DIR", "/tmp/foratask-node")
+
+# Node worker pool: worker i listens on NODE_BACKEND_PORT + i ("auto" = one per CPU)
+NODE_WORKERS = os.environ.get("NODE_WORKERS", "1")
+NODE_HEALTH_INTERVAL = float(os.environ.get("NODE_HEALTH_INTERVAL", "5"))
+NODE_HEALTH_TIMEOUT = float(os.environ.get("NODE_HEALTH_TIMEOUT", "2"))
+NODE_HEALTH_FAILURES = int(os.environ.get("NODE_HEALTH_FAILURES", "3"))
+NODE_STARTUP_GRACE = float(os.environ.get("NODE_STARTUP_GRACE", "30"))
+SOCKETIO_SESSION_TTL = float(os.environ.get("SOCKETIO_SESSION_TTL", "3600"))
+node_workers = []
+socketio_sessions = {}
+supervisor_task = None
+
+# Rolling restarts (SIGHUP or POST /proxy/rolling-restart): generations alternate between two port ranges
+NODE_PORT_STRIDE = int(os.environ.get("NODE_PORT_STRIDE", "100"))
+NODE_DRAIN_TIMEOUT = float(os.environ.get("NODE_DRAIN_TIMEOUT", "30"))
+# The crons in foratask-backend/server.js aren't idempotent, so a new generation starts without them and
+# is told to start them once the old cron worker has exited (killed outright after this many seconds)
+NODE_CRON_HANDOVER_TIMEOUT = float(os.environ.get("NODE_CRON_HANDOVER_TIMEOUT", "10"))
+PROXY_ADMIN_TOKEN = os.environ.get("PROXY_ADMIN_TOKEN", "")
+node_generation = 0
+# Workers started or drained by a rolling restart that are not (or no longer) in node_workers
+transitional_workers = []
+rolling_restart_lock = asyncio.Lock()
+rolling_restart_task = None
+restart_stats = {"rolling_restarts": 0, "aborted": 0, "last_drain_seconds": 0.0, "dropped_requests": 0}
+
+# Multi-process proxy (uvicorn --workers N / gunicorn --reuse-port): the process holding NODE_SUPERVISOR_LOCK
+# owns the Node children and publishes them in NODE_STATE_FILE; the others follow that file and take over
+# (adopting the running children) when the owner exits
+NODE_SUPERVISOR_LOCK = os.environ.get("NODE_SUPERVISOR_LOCK", os.path.join(NODE_SOCKET_DIR, "supervisor.lock"))
+NODE_STATE_FILE = os.environ.get("NODE_STATE_FILE", os.path.join(NODE_SOCKET_DIR, "workers.json"))
+NODE_STATE_INTERVAL = float(os.environ.get("NODE_STATE_INTERVAL", "1"))
+supervisor_lock_fd = None
+follower_task = None
+supervisor_stats = {"leader": 0, "takeovers": 0, "adopted_workers": 0, "state_syncs": 0}
+
+# Node stdout/stderr is drained continuously so a full pipe can never block console.log in Node;
+# lines go to a size-rotated file (or the proxy's stdout) through a queue drained by a logging thread
+NODE_LOG_FILE = os.environ.get("NODE_LOG_FILE", "")
+NODE_LOG_MAX_BYTES = int(os.environ.get("NODE_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+NODE_LOG_BACKUPS = int(os.environ.get("NODE_LOG_BACKUPS", "5"))
+NODE_LOG_RATE = float(os.environ.get("NODE_LOG_RATE", "200"))
+NODE_LOG_BURST = float(os.environ.get("NODE_LOG_BURST", "1000"))
+NODE_LOG_LINE_LIMIT = int(os.environ.get("NODE_LOG_LINE_LIMIT", str(16 * 1024)))
+node_logger = logging.getLogger("foratask.node")
+node_log_listener = None
+log_stats = {"lines": 0, "bytes": 0, "suppressed": 0, "truncated": 0}
+
+# Upstream connection pool (shared by every proxied request)
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get("UPSTREAM_POOL_TIMEOUT", "10"))
+upstream_client = None
+
+# Timeout classes, picked per route (first matching prefix wins)
+TIMEOUT_CLASSES = {
+    "default": httpx.Timeout(30.0, connect=5.0, pool=UPSTREAM_POOL_TIMEOUT),
+    "upload": httpx.Timeout(120.0, connect=5.0, pool=UPSTREAM_POOL_TIMEOUT),
+    "report": httpx.Timeout(120.0, connect=5.0, pool=UPSTREAM_POOL_TIMEOUT),
+    # socket.io polling GETs are held open by Node for up to pingInterval (25s)
+    "longpoll": httpx.Timeout(60.0, connect=5.0, pool=UPSTREAM_POOL_TIMEOUT),
+}
+ROUTE_TIMEOUT_CLASSES = [
+    ("socket.io", "longpoll"),
+    ("task/add-task", "upload"),
+    ("task/edit/", "upload"),
+    ("leave/apply", "upload"),
+    ("auth/register", "upload"),
+    ("reports/", "report"),
+    ("salary/generate/", "report"),
+    ("salary/payroll", "report"),
+    ("master-admin/analytics/", "report"),
+]
+
+# Bodies up to this size are buffered; larger (or unsized) ones are streamed in chunks
+PROXY_BUFFER_THRESHOLD = int(os.environ.get("PROXY_BUFFER_THRESHOLD", str(256 * 1024)))
+PROXY_STREAM_CHUNK_SIZE = int(os.environ.get("PROXY_STREAM_CHUNK_SIZE", str(64 * 1024)))
+BODYLESS_METHODS = {"GET", "HEAD", "OPTIONS"}
+EXCLUDED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+# Headers travel as raw (bytes, bytes) lists so repeated ones (Set-Cookie, repeated query params) survive;
+# these request headers are replaced by the proxy's own values
+UPSTREAM_DROPPED_HEADERS = frozenset({
+    b"host", b"x-forwarded-claims", b"x-proxy-identity", b"x-proxy-internal", b"traceparent", b"x-request-id",
+})
+RAW_EXCLUDED_RESPONSE_HEADERS = frozenset(h.encode() for h in EXCLUDED_RESPONSE_HEADERS)
+# Serve /api requests straight from the ASGI layer instead of through FastAPI's router
+PROXY_FAST_PATH = os.environ.get("PROXY_FAST_PATH", "true") != "false"
+
+upstream_stats = {
+    "requests": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "pool_timeouts": 0,
+    "streamed_requests": 0,
+    "streamed_responses": 0,
+}
+
+# Per-worker circuit breaker: consecutive failures open it, one probe request is let through after the cooldown
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "5"))
+BREAKER_STATUSES = {502, 503, 504}
+# Idempotent requests that fail at the connection level are retried on another worker, but retries
+# (and hedges) are capped at RETRY_BUDGET_RATIO of recent traffic so a sick backend isn't hit twice as hard
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "1"))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MAX = float(os.environ.get("RETRY_BUDGET_MAX", "10"))
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)
+# engine.io sessions live on the worker that issued the sid; anywhere else answers "Session ID unknown"
+RETRY_EXCLUDED = ("socket.io",)
+# Latency-sensitive GETs get a backup request on another worker once they outlive the route's p95
+PROXY_HEDGE_ROUTES = tuple(filter(None, os.environ.get(
+    "PROXY_HEDGE_ROUTES", "me,stats/,task/getTaskList,notifications,attendance/today",
+).split(",")))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+retry_budget = RETRY_BUDGET_MAX
+resilience_stats = {"breaker_opened": 0, "fast_failed": 0, "retries": 0, "budget_exhausted": 0, "hedged": 0, "hedge_wins": 0}
+
+# socket.io WebSocket relay
+WS_MAX_CONNECTIONS = int(os.environ.get("WS_MAX_CONNECTIONS", "1000"))
+WS_MAX_MESSAGE_SIZE = int(os.environ.get("WS_MAX_MESSAGE_SIZE", str(1024 * 1024)))
+WS_MAX_QUEUE = int(os.environ.get("WS_MAX_QUEUE", "16"))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", "120"))
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", "20"))
+WS_FORWARDED_HEADERS = {"authorization", "cookie", "origin", "user-agent", "x-forwarded-for"}
+
+ws_stats = {
+    "active": 0,
+    "peak_active": 0,
+    "total": 0,
+    "rejected": 0,
+    "upstream_failures": 0,
+    "idle_closed": 0,
+    "oversized_closed": 0,
+    "messages_up": 0,
+    "messages_down": 0,
+}
+
+# Response cache for hot dashboard GETs: path prefix -> TTL seconds (PROXY_CACHE_ROUTES JSON overrides)
+PROXY_CACHE_MAX_BYTES = int(os.environ.get("PROXY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+PROXY_CACHE_ROUTES = {
+    "stats/tasks-summary": 15,
+    "stats/todaysTasks": 15,
+    "stats/statisticsGraph": 30,
+    "reports/admin-report-summary": 30,
+    "reports/self-report-summary": 30,
+    "payment/calculate-price": 300,
+    "organization-settings/holidays/upcoming": 300,
+    "organization-settings": 60,
+    "me/usersList": 30,
+    "emp-list": 30,
+    **json.loads(os.environ.get("PROXY_CACHE_ROUTES", "{}")),
+}
+# Past its TTL an entry may still be served: [stale-while-revalidate, stale-if-error] seconds per path prefix
+# (PROXY_STALE_ROUTES JSON overrides). Routes not listed here are never served stale
+PROXY_STALE_ROUTES = {
+    "stats/": [30, 300],
+    "organization-settings": [300, 3600],
+    "me/usersList": [60, 900],
+    "emp-list": [60, 900],
+    **json.loads(os.environ.get("PROXY_STALE_ROUTES", "{}")),
+}
+# A mutation under one resource also invalidates these cached resources
+CACHE_INVALIDATES = {
+    "task": ("stats", "reports"),
+    "task-extended": ("stats", "reports"),
+    "attendance": ("stats", "reports"),
+    "leave": ("attendance", "reports"),
+    "organization-settings": ("attendance",),
+    "me": ("payment", "emp-list", "stats"),
+    "notifications": ("stats", "reports"),
+    "add-employee": ("me", "payment", "stats", "reports"),
+    "assign-employee": ("me", "stats", "reports"),
+    "unassign-employee": ("me", "stats", "reports"),
+}
+# Strong ETags over buffered GET bodies; matching If-None-Match gets a 304 without the body
+etag_stats = {"not_modified": 0, "bytes_saved": 0}
+# Response compression, negotiated from Accept-Encoding (brotli/zstd only when installed)
+PROXY_COMPRESS_MIN_SIZE = int(os.environ.get("PROXY_COMPRESS_MIN_SIZE", "1024"))
+PROXY_COMPRESS_OFFLOAD_SIZE = int(os.environ.get("PROXY_COMPRESS_OFFLOAD_SIZE", str(64 * 1024)))
+PROXY_COMPRESS_THREADS = int(os.environ.get("PROXY_COMPRESS_THREADS", "4"))
+PROXY_GZIP_LEVEL = int(os.environ.get("PROXY_GZIP_LEVEL", "6"))
+PROXY_BROTLI_QUALITY = int(os.environ.get("PROXY_BROTLI_QUALITY", "4"))
+PROXY_ZSTD_LEVEL = int(os.environ.get("PROXY_ZSTD_LEVEL", "3"))
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+NOT_MODIFIED_HEADERS = {"etag", "cache-control", "expires", "vary", "x-proxy-cache"}
+compression_executor = ThreadPoolExecutor(max_workers=PROXY_COMPRESS_THREADS, thread_name_prefix="proxy-compress")
+compression_stats = {"responses": 0, "offloaded": 0, "bytes_in": 0, "bytes_out": 0}
+
+# Single-flight for identical concurrent GETs (socket.io polls are per-connection and never shared)
+COALESCE_EXCLUDED = ("socket.io",)
+# Requests whose upstream answer depends on these (206 / 304) are never shared with plain GETs
+COALESCE_UNSHARED_HEADERS = ("range", "if-range", "if-none-match")
+inflight_requests = {}
+coalesce_stats = {"leaders": 0, "coalesced": 0}
+
+# /api/batch: several GETs in one round trip, each run through the normal proxy path
+PROXY_BATCH_MAX_ITEMS = int(os.environ.get("PROXY_BATCH_MAX_ITEMS", "20"))
+BATCH_EXCLUDED = ("batch", "socket.io", "notifications/stream", "sync/")
+# Taken from the batch request for every item; the combined response is compressed once, not per item
+BATCH_DROPPED_HEADERS = {
+    b"content-length", b"content-type", b"transfer-encoding", b"expect", b"accept-encoding", b"if-none-match",
+}
+BATCH_ITEM_REQUEST_HEADERS = {"if-none-match"}
+BATCH_ITEM_RESPONSE_HEADERS = ("content-type", "etag", "cache-control", "x-proxy-cache", "retry-after")
+batch_stats = {"batches": 0, "items": 0, "rejected": 0}
+
+# /api/notifications/stream: Server-Sent Events instead of every client polling unreadCount. One poll of
+# Node's notification feed per proxy process is fanned out to the connected users' streams.
+NOTIFY_POLL_INTERVAL = float(os.environ.get("NOTIFY_POLL_INTERVAL", "2"))
+# Each poll re-reads this many seconds before the last one: createdAt is set in Node before the insert lands
+NOTIFY_OVERLAP = float(os.environ.get("NOTIFY_OVERLAP", "5"))
+# The poller keeps running this long after the last stream closes so reconnects can still resume
+NOTIFY_IDLE_TIMEOUT = float(os.environ.get("NOTIFY_IDLE_TIMEOUT", "60"))
+NOTIFY_HEARTBEAT = float(os.environ.get("NOTIFY_HEARTBEAT", "15"))
+NOTIFY_RETRY_MS = int(os.environ.get("NOTIFY_RETRY_MS", "3000"))
+# Events kept per user for Last-Event-ID resume, for at most NOTIFY_REPLAY_USERS users
+NOTIFY_REPLAY_SIZE = int(os.environ.get("NOTIFY_REPLAY_SIZE", "50"))
+NOTIFY_REPLAY_USERS = int(os.environ.get("NOTIFY_REPLAY_USERS", "10000"))
+NOTIFY_MAX_STREAMS_PER_USER = int(os.environ.get("NOTIFY_MAX_STREAMS_PER_USER", "5"))
+INTERNAL_SECRET_HEADER = "x-proxy-internal"
+notify_subscribers = {}
+notify_replay = OrderedDict()
+notify_seen = {}
+notify_poller_task = None
+# /api/sync/<route>: the last few JSON responses per user and route are kept so a client sending back
+# X-Sync-Version gets a JSON Patch (RFC 6902) against that version instead of the whole list
+SYNC_ROUTES = tuple(os.environ.get("SYNC_ROUTES", "task/getTaskList,chat/rooms,attendance/history").split(","))
+SYNC_VERSIONS_PER_KEY = int(os.environ.get("SYNC_VERSIONS_PER_KEY", "3"))
+SYNC_MAX_BYTES = int(os.environ.get("SYNC_MAX_BYTES", str(64 * 1024 * 1024)))
+SYNC_VERSION_HEADER = "x-sync-version"
+sync_snapshots = OrderedDict()
+sync_bytes = 0
+sync_stats = {"full": 0, "deltas": 0, "unchanged": 0, "misses": 0, "evictions": 0, "bytes_full": 0, "bytes_sent": 0}
+
+notify_stats = {"streams": 0, "connections": 0, "events": 0, "resumed": 0, "resyncs": 0, "polls": 0, "poll_errors": 0}
+
+# Proxy-side JWT verification; Node trusts the forwarded claims when the per-boot identity secret matches
+# Node gets JWT_SECRET from foratask-backend/.env through dotenv, so the same file is read here
+AUTH_JWT_SECRET = (
+    os.environ.get("JWT_SECRET") or dotenv_values(os.path.join(NODE_BACKEND_DIR, ".env")).get("JWT_SECRET") or ""
+)
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "300"))
+# Routes mounted without authMiddleware in foratask-backend/server.js (or with their own auth)
+AUTH_PUBLIC_PREFIXES = (
+    "auth/", "master-admin", "payment/webhook", "payment/calculate-price", "uploads/", "health", "socket.io",
+)
+IDENTITY_HEADER = "x-forwarded-claims"
+IDENTITY_SECRET_HEADER = "x-proxy-identity"
+PROXY_IDENTITY_SECRET = os.urandom(24).hex()
+auth_cache = OrderedDict()
+auth_stats = {"verified": 0, "cache_hits": 0, "rejected": 0, "evictions": 0}
+
+# Per-company admission control by route class: [rate/s, burst, max in flight] (ADMISSION_LIMITS JSON overrides);
+# a class mapped to null is not limited (socket.io polls are held open by Node on purpose)
+ADMISSION_LIMITS = {
+    "default": [50, 100, 32],
+    "upload": [5, 10, 4],
+    "report": [2, 5, 2],
+    "longpoll": None,
+    **json.loads(os.environ.get("ADMISSION_LIMITS", "{}")),
+}
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "2.0"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_BUCKETS = int(os.environ.get("ADMISSION_MAX_BUCKETS", "10000"))
+admission_buckets = {}
+admission_stats = {"admitted": 0, "queued": 0, "throttled": 0}
+
+response_cache = OrderedDict()
+cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "evictions": 0,
+    "invalidations": 0,
+    "stale_served": 0,
+    "stale_if_error": 0,
+    "revalidations": 0,
+    "bytes": 0,
+}
+revalidation_tasks = set()
+# Bumped per resource on every invalidation; a GET that started before a write must not cache its answer.
+# With several proxy processes each has its own cache, so invalidations of cached resources are also
+# published as the mtime of NODE_SOCKET_DIR/cache-<resource>.epoch, which every process checks
+cache_generations = {}
+cached_resources = {prefix.split("/", 1)[0] for prefix in PROXY_CACHE_ROUTES}
+shared_cache_epochs = False
+
+# /api/uploads is served from disk here instead of going through express.static
+UPLOADS_DIR = os.path.realpath(os.path.join(NODE_BACKEND_DIR, "uploads"))
+# multer names every upload <name>-<timestamp><ext>, so a URL never changes content
+UPLOADS_CACHE_CONTROL = os.environ.get("UPLOADS_CACHE_CONTROL", "public, max-age=31536000, immutable")
+UPLOADS_FD_CACHE_SIZE = int(os.environ.get("UPLOADS_FD_CACHE_SIZE", "256"))
+UPLOADS_CHUNK_SIZE = int(os.environ.get("UPLOADS_CHUNK_SIZE", str(256 * 1024)))
+upload_files = OrderedDict()
+upload_stats = {
+    "served": 0,
+    "partial": 0,
+    "not_modified": 0,
+    "bytes": 0,
+    "zero_copy": 0,
+    "fd_hits": 0,
+    "fd_opens": 0,
+}
+
+# Per-route metrics, rendered in Prometheus text format at /metrics
+ROUTE_TEMPLATES = [
+    "auth/login", "auth/register",
+    "me/userinfo", "me/update-user/:id", "me/delete-user/:id", "me/usersList", "me/save-token",
+    "me/remove-token", "me/reset-password/:id",
+    "task/add-task", "task/add-sub-task", "task/getTaskList", "task/delete-task/:id", "task/markAsCompleted",
+    "task/:id/documents/:docId", "task/edit/:id", "task/search", "task/:id/history", "task/:id",
+    "task-extended/:taskId/discussions", "task-extended/:taskId/discussions/:commentId",
+    "task-extended/:taskId/timeline", "task-extended/:taskId/locations",
+    "task-extended/:taskId/locations/:locationId/progress", "task-extended/:taskId/locations/:locationId/attendance",
+    "task-extended/:taskId/locations/:locationId/approve", "task-extended/:taskId/approve-all",
+    "stats/tasks-summary", "stats/todaysTasks", "stats/statisticsGraph",
+    "notifications/getAllNotifications", "notifications/unreadCount", "notifications/handleTaskApproval/:id",
+    "notifications/stream",
+    "sync/task/getTaskList", "sync/chat/rooms", "sync/chat/rooms/:roomId/messages", "sync/attendance/history",
+    "sync/attendance/history/:userId",
+    "reports/admin-report-summary", "reports/self-report-summary",
+    "payment/webhook", "payment/calculate-price", "payment/create-order", "payment/verify-payment",
+    "payment/create-subscription", "payment/update-subscription", "payment/cancel-subscription",
+    "payment/subscription-status", "payment/invoice-history",
+    "master-admin/login", "master-admin/dashboard", "master-admin/profile", "master-admin/companies",
+    "master-admin/companies/:companyId", "master-admin/companies/:companyId/restrict",
+    "master-admin/companies/:companyId/unrestrict", "master-admin/companies/:companyId/extend-trial",
+    "master-admin/payments", "master-admin/analytics/revenue",
+    "chat/dm", "chat/group", "chat/rooms", "chat/rooms/:roomId/messages", "chat/rooms/:roomId/read",
+    "chat/rooms/:roomId/participants", "chat/rooms/:roomId/leave",
+    "attendance/check-in", "attendance/check-out", "attendance/today", "attendance/history",
+    "attendance/history/:userId", "attendance/daily", "attendance/analytics/:userId",
+    "organization-settings", "organization-settings/locations", "organization-settings/locations/:locationId",
+    "organization-settings/holidays/upcoming", "organization-settings/holidays",
+    "organization-settings/holidays/:holidayId",
+    "salary/config/:userId", "salary/generate/:userId", "salary/records/:userId", "salary/records/:recordId/pay",
+    "salary/payroll",
+    "leave/apply", "leave/requests", "leave/balance", "leave/balance/:userId", "leave/requests/:requestId",
+    "emp-list", "assign-employee/:id", "unassign-employee/:id", "add-employee", "get-employee-tasks",
+    # Served by the proxy itself
+    "batch",
+]
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+METRIC_HELP = {
+    "foratask_proxy_requests_total": ("counter", "Proxied requests by route and status"),
+    "foratask_proxy_request_duration_seconds": ("histogram", "Total time spent in the proxy per request"),
+    "foratask_proxy_upstream_duration_seconds": ("histogram", "Time waiting on Node (send to body read)"),
+    "foratask_proxy_overhead_seconds": ("histogram", "Request time not spent waiting on Node"),
+    "foratask_proxy_request_bytes": ("histogram", "Request body size"),
+    "foratask_proxy_response_bytes": ("histogram", "Response body size as sent to the client"),
+    "foratask_proxy_throttled_total": ("counter", "Requests answered 429 by admission control"),
+}
+# Request IDs / W3C trace context, with optional span export (JSON lines file and/or OTLP/HTTP JSON)
+PROXY_TRACE_FILE = os.environ.get("PROXY_TRACE_FILE", "")
+PROXY_TRACE_FILE_MAX_BYTES = int(os.environ.get("PROXY_TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+PROXY_TRACE_OTLP_URL = os.environ.get("PROXY_TRACE_OTLP_URL", "")
+PROXY_TRACE_SAMPLE_RATE = float(os.environ.get("PROXY_TRACE_SAMPLE_RATE", "1.0"))
+PROXY_TRACE_QUEUE_SIZE = int(os.environ.get("PROXY_TRACE_QUEUE_SIZE", "10000"))
+PROXY_TRACE_BATCH_SIZE = int(os.environ.get("PROXY_TRACE_BATCH_SIZE", "512"))
+trace_queue = None
+trace_exporter_task = None
+trace_stats = {"spans": 0, "dropped": 0, "exported": 0, "export_errors": 0}
+
+route_matchers = {}
+route_prefixes = {"uploads", "socket.io"}
+METRIC_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"}
+metric_counters = {}
+metric_histograms = {}
+
+def node_socket_path(port: int):
+    return os.path.join(NODE_SOCKET_DIR, f"node-{port}.sock")
+
+def node_ports():
+    """Every port a worker can be given, across both rolling-restart generations"""
+    return [NODE_BACKEND_PORT + i + g * NODE_PORT_STRIDE for g in (0, 1) for i in range(worker_count())]
+
+def create_upstream_client():
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    mounts = {}
+    if NODE_TRANSPORT == "uds":
+        mounts = {
+            f"http://127.0.0.1:{port}": httpx.AsyncHTTPTransport(uds=node_socket_path(port), limits=limits)
+            for port in node_ports()
+        }
+    # Cookies are relayed as raw headers; a client-side jar would share one user's Set-Cookie with everyone
+    cookies = http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return httpx.AsyncClient(limits=limits, timeout=TIMEOUT_CLASSES["default"], cookies=cookies, mounts=mounts)
+
+def route_class(path: str, content_type: str):
+    if content_type.startswith("multipart/"):
+        return "upload"
+    for prefix, name in ROUTE_TIMEOUT_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return "default"
+
+def timeout_for(path: str, content_type: str):
+    return TIMEOUT_CLASSES[route_class(path, content_type)]
+
+def content_length(headers):
+    try:
+        return int(headers.get("content-length", ""))
+    except ValueError:
+        return None
+
+async def request_content(request: Request):
+    """Small or empty bodies are read in one go; large uploads are piped upstream as they arrive"""
+    size = content_length(request.headers)
+    chunked = "chunked" in request.headers.get("transfer-encoding", "")
+    if request.method in BODYLESS_METHODS and size is None and not chunked:
+        return b""
+    if size is not None and size <= PROXY_BUFFER_THRESHOLD:
+        return await request.body()
+    upstream_stats["streamed_requests"] += 1
+    return request.stream()
+
+def pool_stats():
+    stats = dict(upstream_stats)
+    stats["max_connections"] = UPSTREAM_MAX_CONNECTIONS
+    stats["max_keepalive_connections"] = UPSTREAM_MAX_KEEPALIVE
+    stats["saturation"] = round(upstream_stats["in_flight"] / UPSTREAM_MAX_CONNECTIONS, 3)
+    stats["transport"] = NODE_TRANSPORT
+    # httpcore keeps the live connections on each transport's pool (one per socket in uds mode)
+    transports = [getattr(upstream_client, "_transport", None), *getattr(upstream_client, "_mounts", {}).values()]
+    connections = [c for t in transports for c in getattr(getattr(t, "_pool", None), "connections", [])]
+    stats["open_connections"] = len(connections)
+    stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+    return stats
+
+def worker_count():
+    if NODE_WORKERS == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(NODE_WORKERS))
+
+def make_node_worker(index: int, generation: int = 0):
+    port = NODE_BACKEND_PORT + index + (generation % 2) * NODE_PORT_STRIDE
+    return {
+        "index": index,
+        "generation": generation,
+        "port": port,
+        "url": f"http://127.0.0.1:{port}",
+        "ws_url": f"ws://127.0.0.1:{port}",
+        "process": None,
+        "started_at": 0.0,
+        "healthy": False,
+        "failures": 0,
+        "outstanding": 0,
+        "streams": 0,
+        "retired": False,
+        "restarts": 0,
+        "startup_seconds": None,
+        "ready_task": None,
+        "log_task": None,
+        "breaker": "closed",
+        "breaker_failures": 0,
+        "breaker_opened_at": 0.0,
+        "breaker_probing": False,
+        "crons": False,
+        "crons_running": None,
+    }
+
+def node_command():
+    if NODE_LAUNCH_MODE == "dev":
+        return ["npx", "nodemon", "--watch", ".", "--ext", "js,json", "server.js"]
+    return ["node", "server.js"]
+
+def spawn_node_worker(worker):
     env = os.environ.copy()
-    env["PORT"] = str(NODE_BACKEND_PORT)
-    node_process = subprocess.Popen(
-        ["npx", "nodemon", "--watch", ".", "--ext", "js,json", "server.js"],
-        cwd="/app/foratask-backend",
+    env["PORT"] = str(worker["port"])
+    if NODE_TRANSPORT == "uds":
+        env["SOCKET_PATH"] = node_socket_path(worker["port"])
+    others = [w for w in node_workers + transitional_workers if w is not worker and w["process"]]
+    worker["crons"] = worker["index"] == 0 and not any(w["crons"] for w in others)
+    env["RUN_CRONS"] = "true" if worker["crons"] else "false"
+    env["PROXY_IDENTITY_SECRET"] = PROXY_IDENTITY_SECRET
+    worker["process"] = subprocess.Popen(
+        node_command(),
+        cwd=NODE_BACKEND_DIR,
         env=env,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
+        start_new_session=True,
     )
-    print(f"Node.js backend started on port {NODE_BACKEND_PORT} (PID: {node_process.pid})")
+    worker["log_task"] = asyncio.get_running_loop().create_task(pump_node_logs(worker, worker["process"].stdout))
+    worker["started_at"] = time.monotonic()
+    worker["healthy"] = False
+    worker["failures"] = 0
+    worker["startup_seconds"] = None
+    print(f"Node.js worker {worker['index']} started on port {worker['port']} (PID: {worker['process'].pid})")
+
+def start_node_logging():
+    """Handlers run on a QueueListener thread, so file writes and rotation stay off the event loop"""
+    global node_log_listener
+    if NODE_LOG_FILE:
+        handler = logging.handlers.RotatingFileHandler(
+            NODE_LOG_FILE, maxBytes=NODE_LOG_MAX_BYTES, backupCount=NODE_LOG_BACKUPS,
+        )
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s node[%(worker)s] %(message)s"))
+    records = queue.Queue()
+    node_logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+    node_logger.setLevel(logging.INFO)
+    node_logger.propagate = False
+    node_log_listener = logging.handlers.QueueListener(records, handler)
+    node_log_listener.start()
+
+def stop_node_logging():
+    global node_log_listener
+    if node_log_listener is not None:
+        node_log_listener.stop()
+        node_log_listener = None
+
+async def pump_node_logs(worker, pipe):
+    """Reads the child's output until EOF; past NODE_LOG_RATE lines/s (after a burst) lines are
+    counted and dropped, but the pipe is always drained"""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=NODE_LOG_LINE_LIMIT)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    label = {"worker": f"{worker['generation']}.{worker['index']}"}
+    tokens, updated, suppressed = NODE_LOG_BURST, time.monotonic(), 0
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # Longer than NODE_LOG_LINE_LIMIT; asyncio has already discarded it
+                log_stats["truncated"] += 1
+                continue
+            if not line:
+                break
+            log_stats["lines"] += 1
+            log_stats["bytes"] += len(line)
+            now = time.monotonic()
+            tokens = min(NODE_LOG_BURST, tokens + (now - updated) * NODE_LOG_RATE)
+            updated = now
+            if tokens < 1:
+                suppressed += 1
+                log_stats["suppressed"] += 1
+                continue
+            tokens -= 1
+            if suppressed:
+                node_logger.warning(f"... {suppressed} lines suppressed by NODE_LOG_RATE", extra=label)
+                suppressed = 0
+            node_logger.info(line.decode("utf-8", "replace").rstrip(), extra=label)
+    finally:
+        transport.close()
+
+def kill_node_worker(worker):
+    if worker["process"]:
+        try:
+            os.killpg(worker["process"].pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        worker["process"] = None
+    worker["healthy"] = False
+
+def start_node_backend():
+    if NODE_TRANSPORT == "uds":
+        os.makedirs(NODE_SOCKET_DIR, mode=0o700, exist_ok=True)
+    node_workers[:] = [make_node_worker(i) for i in range(worker_count())]
+    for worker in node_workers:
+        spawn_node_worker(worker)
 
 def stop_node_backend():
-    global node_process
-    if node_process:
-        os.killpg(os.getpgid(node_process.pid), signal.SIGTERM)
-        node_process = None
+    for worker in node_workers + transitional_workers:
+        kill_node_worker(worker)
+    transitional_workers.clear()
+
+def restart_node_worker(worker):
+    kill_node_worker(worker)
+    worker["restarts"] += 1
+    close_breaker(worker)
+    spawn_node_worker(worker)
+
+async def probe_node_worker(worker):
+    try:
+        resp = await upstream_client.get(f"{worker['url']}/health", timeout=NODE_HEALTH_TIMEOUT)
+    except httpx.HTTPError:
+        return False
+    if resp.status_code != 200:
+        return False
+    try:
+        worker["crons_running"] = resp.json().get("cronsRunning")
+    except (ValueError, AttributeError):
+        worker["crons_running"] = None
+    return True
+
+async def wait_until_ready(worker):
+    """Poll /health with backoff until Node answers (it only listens once Mongo is connected)"""
+    delay = 0.05
+    deadline = worker["started_at"] + NODE_READY_TIMEOUT
+    while time.monotonic() < deadline and worker["process"] and worker["process"].poll() is None:
+        if await probe_node_worker(worker):
+            worker["healthy"] = True
+            worker["startup_seconds"] = round(time.monotonic() - worker["started_at"], 3)
+            print(f"Node.js worker {worker['index']} ready in {worker['startup_seconds']:.2f}s")
+            return True
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+    print(f"Node.js worker {worker['index']} not ready after {NODE_READY_TIMEOUT:.0f}s")
+    return False
+
+async def check_node_worker(worker):
+    if worker["process"] is None:
+        return
+    exited = worker["process"].poll() is not None
+    healthy = not exited and await probe_node_worker(worker)
+    if worker["retired"]:
+        return
+    if healthy:
+        worker["healthy"] = True
+        worker["failures"] = 0
+        # nodemon reloads the app with the RUN_CRONS=false it was spawned with after a handover
+        if worker["crons"] and worker["crons_running"] is False:
+            print(f"Node.js worker {worker['index']} reloaded without its crons, starting them again")
+            await start_node_crons(worker)
+        return
+    worker["healthy"] = False
+    if time.monotonic() - worker["started_at"] < NODE_STARTUP_GRACE and not exited:
+        return
+    worker["failures"] += 1
+    # nodemon stays alive after the app crashes, so repeated failed probes count as a crash too
+    if exited or worker["failures"] >= NODE_HEALTH_FAILURES:
+        print(f"Node.js worker {worker['index']} unhealthy, restarting")
+        restart_node_worker(worker)
+        worker["ready_task"] = asyncio.create_task(wait_until_ready(worker))
+
+async def drain_node_worker(worker, deadline: float):
+    """Waits for in-flight requests and streamed responses; returns how many were still open at the deadline"""
+    while worker["outstanding"] + worker["streams"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return worker["outstanding"] + worker["streams"]
+
+async def drain_followers(old, deadline: float):
+    """Waits until every live follower has switched to the current generation and finished its requests
+    on `old`; returns how many were still open at the deadline"""
+    retired = {(w["generation"], w["index"]) for w in old}
+    while True:
+        switching, open_requests = False, 0
+        for pid in live_followers():
+            beat = read_heartbeat(pid)
+            if beat is None or beat.get("generation", -1) < node_generation:
+                switching = True
+                continue
+            open_requests += sum(n for generation, index, n in beat["inflight"] if (generation, index) in retired)
+        if not (switching or open_requests) or time.monotonic() >= deadline:
+            return open_requests
+        await asyncio.sleep(NODE_STATE_INTERVAL / 4)
+
+async def rolling_restart():
+    """Starts a new generation on the alternate ports and switches traffic to it once every worker is
+    ready; the old generation is then drained (up to NODE_DRAIN_TIMEOUT) and stopped. If the new
+    generation never gets ready it is stopped and the old one keeps serving"""
+    global node_generation
+    async with rolling_restart_lock:
+        generation = node_generation + 1
+        fresh = [make_node_worker(i, generation) for i in range(worker_count())]
+        transitional_workers.extend(fresh)
+        for worker in fresh:
+            spawn_node_worker(worker)
+        ready = await asyncio.gather(*(wait_until_ready(w) for w in fresh))
+        for worker in fresh:
+            transitional_workers.remove(worker)
+        if not all(ready):
+            for worker in fresh:
+                kill_node_worker(worker)
+            restart_stats["aborted"] += 1
+            print(f"Rolling restart to generation {generation} aborted, keeping generation {node_generation}")
+            return False
+
+        # No await between these lines, so every request after this point goes to the new generation
+        old = list(node_workers)
+        node_workers[:] = fresh
+        node_generation = generation
+        socketio_sessions.clear()
+        for worker in old:
+            worker["retired"] = True
+        transitional_workers.extend(old)
+        write_node_state()
+
+        started = time.monotonic()
+        deadline = started + NODE_DRAIN_TIMEOUT
+        # Other proxy processes pick up the switch from the state file and report back in their heartbeats
+        dropped = await asyncio.gather(drain_followers(old, deadline), *(drain_node_worker(w, deadline) for w in old))
+        cron_owners = [w["process"] for w in old if w["crons"] and w["process"]]
+        for worker in old:
+            kill_node_worker(worker)
+            transitional_workers.remove(worker)
+        await hand_over_crons(cron_owners)
+        restart_stats["rolling_restarts"] += 1
+        restart_stats["last_drain_seconds"] = round(time.monotonic() - started, 3)
+        restart_stats["dropped_requests"] += sum(dropped)
+        print(f"Rolling restart to generation {generation} done, drained in {restart_stats['last_drain_seconds']:.2f}s")
+        return True
+
+async def hand_over_crons(previous):
+    """Starts the crons in the current worker 0 once the processes that ran them have exited"""
+    deadline = time.monotonic() + NODE_CRON_HANDOVER_TIMEOUT
+    while any(p.poll() is None for p in previous) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    for process in previous:
+        if process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    for worker in node_workers:
+        if worker["index"] != 0 or worker["crons"] or not worker["process"]:
+            continue
+        if await start_node_crons(worker):
+            worker["crons"] = True
+        else:
+            # Its replacement is spawned with the crons, nobody else holding them now
+            print(f"Node.js worker {worker['index']} didn't take over the crons, restarting")
+            restart_node_worker(worker)
+            worker["ready_task"] = asyncio.create_task(wait_until_ready(worker))
+
+async def start_node_crons(worker):
+    try:
+        resp = await upstream_client.post(
+            f"{worker['url']}/internal/crons/start",
+            headers={INTERNAL_SECRET_HEADER: PROXY_IDENTITY_SECRET},
+            timeout=TIMEOUT_CLASSES["default"],
+        )
+    except httpx.HTTPError:
+        return False
+    if resp.status_code != 200:
+        return False
+    worker["crons_running"] = True
+    return True
+
+def start_rolling_restart():
+    global rolling_restart_task
+    if rolling_restart_lock.locked():
+        return False
+    rolling_restart_task = asyncio.create_task(rolling_restart())
+    return True
+
+class AdoptedProcess:
+    """Popen stand-in for a Node child started by a previous supervisor process"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.stdout = None
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self.returncode = -1
+            except PermissionError:
+                pass
+        return self.returncode
+
+def acquire_supervisor_lock():
+    global supervisor_lock_fd
+    fd = os.open(NODE_SUPERVISOR_LOCK, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    supervisor_lock_fd = fd
+    supervisor_stats["leader"] = 1
+    return True
+
+def release_supervisor_lock():
+    global supervisor_lock_fd
+    if supervisor_lock_fd is not None:
+        # Closing the descriptor drops the flock
+        os.close(supervisor_lock_fd)
+        supervisor_lock_fd = None
+        supervisor_stats["leader"] = 0
+
+def is_supervisor():
+    return supervisor_lock_fd is not None
+
+def write_node_state():
+    if not is_supervisor():
+        return
+    state = {
+        "leader_pid": os.getpid(),
+        "generation": node_generation,
+        "updated": time.time(),
+        # Node children only trust forwarded claims carrying the secret they were spawned with
+        "identity_secret": PROXY_IDENTITY_SECRET,
+        "workers": [
+            {
+                "index": w["index"],
+                "generation": w["generation"],
+                "pid": w["process"].pid if w["process"] else None,
+                "healthy": w["healthy"],
+                "crons": w["crons"],
+            }
+            for w in node_workers
+        ],
+    }
+    tmp = f"{NODE_STATE_FILE}.{os.getpid()}"
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, NODE_STATE_FILE)
+
+def read_node_state():
+    try:
+        with open(NODE_STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def heartbeat_path(pid: int):
+    return os.path.join(NODE_SOCKET_DIR, f"proxy-{pid}.alive")
+
+def live_followers():
+    """Pids of other proxy processes that touched their heartbeat file recently; stale files are removed"""
+    cutoff = time.time() - NODE_STATE_INTERVAL * 5
+    try:
+        names = os.listdir(NODE_SOCKET_DIR)
+    except OSError:
+        return []
+    pids = []
+    for name in names:
+        if not (name.startswith("proxy-") and name.endswith(".alive")):
+            continue
+        path = os.path.join(NODE_SOCKET_DIR, name)
+        try:
+            fresh = os.path.getmtime(path) >= cutoff
+        except OSError:
+            continue
+        pid = int(name[len("proxy-"):-len(".alive")])
+        if not fresh:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        elif pid != os.getpid():
+            pids.append(pid)
+    return pids
+
+def read_heartbeat(pid: int):
+    try:
+        with open(heartbeat_path(pid)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_heartbeat():
+    """Follower: the generation it has switched to and its open requests on retired workers, which the
+    supervisor waits for before stopping them"""
+    transitional_workers[:] = [w for w in transitional_workers if w["outstanding"] + w["streams"]]
+    beat = {
+        "generation": node_generation,
+        "inflight": [[w["generation"], w["index"], w["outstanding"] + w["streams"]] for w in transitional_workers],
+    }
+    path = heartbeat_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(beat, f)
+    os.replace(tmp, path)
+
+def sync_node_workers(state):
+    """Follower: mirror the published worker list, keeping local counters for workers that didn't change;
+    retired workers with requests still open stay in transitional_workers until those finish"""
+    global PROXY_IDENTITY_SECRET, node_generation
+    PROXY_IDENTITY_SECRET = state.get("identity_secret", PROXY_IDENTITY_SECRET)
+    node_generation = state.get("generation", node_generation)
+    current = {(w["generation"], w["index"]): w for w in node_workers}
+    synced = []
+    for info in state["workers"]:
+        worker = current.pop((info["generation"], info["index"]), None)
+        if worker is None:
+            worker = make_node_worker(info["index"], info["generation"])
+        worker["healthy"] = info["healthy"]
+        synced.append(worker)
+    for worker in current.values():
+        worker["retired"] = True
+        transitional_workers.append(worker)
+    node_workers[:] = synced
+    supervisor_stats["state_syncs"] += 1
+
+def adopt_node_workers(state):
+    """New supervisor: take over children of the previous one that are still running; True if any were"""
+    global node_generation, PROXY_IDENTITY_SECRET
+    workers = []
+    for info in state["workers"]:
+        worker = make_node_worker(info["index"], info["generation"])
+        if info["pid"] and AdoptedProcess(info["pid"]).poll() is None:
+            worker["process"] = AdoptedProcess(info["pid"])
+            worker["started_at"] = time.monotonic() - NODE_STARTUP_GRACE
+            worker["healthy"] = info["healthy"]
+            worker["crons"] = info.get("crons", False)
+        workers.append(worker)
+    if not any(w["process"] for w in workers):
+        return False
+    node_workers[:] = workers
+    node_generation = state["generation"]
+    PROXY_IDENTITY_SECRET = state.get("identity_secret", PROXY_IDENTITY_SECRET)
+    supervisor_stats["adopted_workers"] += sum(1 for w in workers if w["process"])
+    return True
+
+async def start_supervising(state):
+    """Runs in the lock holder: adopts a previous supervisor's running children, or starts new ones"""
+    global supervisor_task
+    start_node_logging()
+    adopted = bool(state) and adopt_node_workers(state)
+    if not adopted:
+        start_node_backend()
+        await asyncio.gather(*(wait_until_ready(w) for w in node_workers))
+    write_node_state()
+    supervisor_task = asyncio.create_task(supervise_node_workers())
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, start_rolling_restart)
+    if adopted:
+        # Their output pipe died with the previous supervisor, so replace them with children whose logs we pump
+        print(f"Adopted {len(node_workers)} running Node.js worker(s), replacing them")
+        start_rolling_restart()
+
+async def stop_supervising():
+    """Hands the running children to another proxy process if there is one, otherwise stops them"""
+    if not is_supervisor():
+        return
+    supervisor_task.cancel()
+    asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    if rolling_restart_task is not None:
+        rolling_restart_task.cancel()
+    pumps = [w["log_task"] for w in node_workers + transitional_workers if w["log_task"]]
+    if live_followers():
+        write_node_state()
+        release_supervisor_lock()
+        deadline = time.monotonic() + NODE_STATE_INTERVAL * 3
+        while time.monotonic() < deadline:
+            state = read_node_state()
+            if state and state["leader_pid"] != os.getpid():
+                print(f"Node.js supervisor handed over to proxy process {state['leader_pid']}")
+                for task in pumps:
+                    task.cancel()
+                stop_node_logging()
+                return
+            await asyncio.sleep(NODE_STATE_INTERVAL / 4)
+    stop_node_backend()
+    release_supervisor_lock()
+    # Pumps end at EOF once Node exits; don't let a child that ignores SIGTERM hold up shutdown
+    if pumps:
+        _, pending = await asyncio.wait(pumps, timeout=2)
+        for task in pending:
+            task.cancel()
+    stop_node_logging()
+
+async def follow_node_supervisor():
+    """Non-owner proxy processes: mirror the published workers, heartbeat, and take over when the owner exits"""
+    heartbeat = heartbeat_path(os.getpid())
+    try:
+        while not acquire_supervisor_lock():
+            state = read_node_state()
+            if state:
+                sync_node_workers(state)
+            write_heartbeat()
+            await asyncio.sleep(NODE_STATE_INTERVAL)
+    finally:
+        try:
+            os.unlink(heartbeat)
+        except OSError:
+            pass
+    supervisor_stats["takeovers"] += 1
+    print(f"Proxy process {os.getpid()} took over the Node.js supervisor")
+    await start_supervising(read_node_state())
+
+async def wait_for_node_state():
+    deadline = time.monotonic() + NODE_READY_TIMEOUT
+    while time.monotonic() < deadline:
+        state = read_node_state()
+        if state and any(w["healthy"] for w in state["workers"]):
+            sync_node_workers(state)
+            return True
+        await asyncio.sleep(NODE_STATE_INTERVAL / 4)
+    return False
+
+def prune_socketio_sessions():
+    cutoff = time.monotonic() - SOCKETIO_SESSION_TTL
+    for sid in [sid for sid, (_, seen) in socketio_sessions.items() if seen < cutoff]:
+        del socketio_sessions[sid]
+
+async def supervise_node_workers():
+    while True:
+        await asyncio.sleep(NODE_HEALTH_INTERVAL)
+        await asyncio.gather(*(check_node_worker(w) for w in node_workers))
+        prune_socketio_sessions()
+        write_node_state()
+
+def breaker_available(worker):
+    if worker["breaker"] == "closed":
+        return True
+    if worker["breaker"] == "open":
+        return time.monotonic() - worker["breaker_opened_at"] >= BREAKER_COOLDOWN
+    return not worker["breaker_probing"]
+
+def claim_worker(worker):
+    if worker["breaker"] != "closed":
+        worker["breaker"] = "half_open"
+        worker["breaker_probing"] = True
+    return worker
+
+def close_breaker(worker):
+    worker["breaker"] = "closed"
+    worker["breaker_failures"] = 0
+    worker["breaker_probing"] = False
+
+def record_upstream_failure(worker):
+    worker["breaker_failures"] += 1
+    worker["breaker_probing"] = False
+    if worker["breaker"] == "half_open" or worker["breaker_failures"] >= BREAKER_FAILURES:
+        if worker["breaker"] != "open":
+            resilience_stats["breaker_opened"] += 1
+            print(f"Node.js worker {worker['index']} circuit open")
+        worker["breaker"] = "open"
+        worker["breaker_opened_at"] = time.monotonic()
+
+def pick_worker(sid=None, exclude=None):
+    """socket.io sessions stick to the worker that issued their sid, everything else goes to the least busy
+    worker. None when the circuit is open for every candidate"""
+    if sid in socketio_sessions:
+        index, _ = socketio_sessions[sid]
+        socketio_sessions[sid] = (index, time.monotonic())
+        if index < len(node_workers):
+            worker = node_workers[index]
+            return claim_worker(worker) if breaker_available(worker) else None
+    available = [w for w in node_workers if w is not exclude and breaker_available(w)]
+    candidates = [w for w in available if w["healthy"]] or available
+    if not candidates:
+        return None
+    return claim_worker(min(candidates, key=lambda w: w["outstanding"]))
+
+def breaker_open_response():
+    resilience_stats["fast_failed"] += 1
+    reopen = min((w["breaker_opened_at"] + BREAKER_COOLDOWN for w in node_workers), default=time.monotonic())
+    return JSONResponse(
+        {"message": "Backend unavailable"},
+        status_code=503,
+        headers={"retry-after": str(max(1, int(reopen - time.monotonic() + 0.999)))},
+    )
+
+def remember_socketio_session(worker, body: bytes):
+    # engine.io polling handshake: 0{"sid":"...",...}
+    if not body.startswith(b"0{"):
+        return
+    try:
+        sid = json.loads(body[1:]).get("sid")
+    except ValueError:
+        return
+    if sid:
+        socketio_sessions[sid] = (worker["index"], time.monotonic())
+
+def bearer_token(headers):
+    # Same parsing as Node's authMiddleware: "Bearer <token>"
+    parts = headers.get("authorization", "").split(" ")
+    return parts[1] if len(parts) > 1 else ""
+
+def requires_auth(path: str):
+    return bool(AUTH_JWT_SECRET) and not path.startswith(AUTH_PUBLIC_PREFIXES)
+
+def verify_token(token: str):
+    """Decoded claims for a valid token, or None; results are cached until min(exp, TTL)"""
+    now = time.time()
+    entry = auth_cache.get(token)
+    if entry is not None and entry[1] > now:
+        auth_cache.move_to_end(token)
+        auth_stats["cache_hits"] += 1
+        return entry[0]
+    try:
+        claims = jwt.decode(token, AUTH_JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        auth_cache.pop(token, None)
+        auth_stats["rejected"] += 1
+        return None
+    auth_stats["verified"] += 1
+    auth_cache[token] = (claims, min(claims.get("exp", float("inf")), now + AUTH_CACHE_TTL))
+    while len(auth_cache) > AUTH_CACHE_SIZE:
+        auth_cache.popitem(last=False)
+        auth_stats["evictions"] += 1
+    return claims
+
+def authenticate(request: Request, path: str):
+    """None when the request may go upstream, else the 401 Node's authMiddleware would have sent"""
+    # CORS preflights never carry credentials; Node's cors() answers them ahead of authMiddleware
+    if request.method == "OPTIONS" or not requires_auth(path):
+        return None
+    if not request.headers.get("authorization"):
+        return JSONResponse({"message": "No token, authorization denied"}, status_code=401)
+    token = bearer_token(request.headers)
+    if not token:
+        return JSONResponse({"message": "Token missing in Authorization header"}, status_code=401)
+    claims = verify_token(token)
+    if claims is None:
+        return JSONResponse({"message": "Invalid token"}, status_code=401)
+    request.state.claims = claims
+    return None
+
+def request_tenant(request: Request):
+    """Company from verified claims; tokens without one are limited per client address, which is the real
+    client only when uvicorn trusts the ingress's X-Forwarded-For (--forwarded-allow-ips)"""
+    claims = getattr(request.state, "claims", None)
+    if claims and claims.get("company"):
+        return str(claims["company"])
+    return f"ip:{request.client.host if request.client else ''}"
+
+def admission_bucket(tenant: str, name: str, limits):
+    bucket = admission_buckets.get((tenant, name))
+    if bucket is None:
+        if len(admission_buckets) >= ADMISSION_MAX_BUCKETS:
+            for key in [k for k, b in admission_buckets.items() if not b["in_flight"] and not b["waiting"]]:
+                del admission_buckets[key]
+        bucket = admission_buckets[(tenant, name)] = {
+            "tokens": float(limits[1]), "updated": time.monotonic(), "in_flight": 0, "waiting": 0, "released": None,
+        }
+    return bucket
+
+def refill(bucket, rate: float, burst: float):
+    now = time.monotonic()
+    bucket["tokens"] = min(burst, bucket["tokens"] + (now - bucket["updated"]) * rate)
+    bucket["updated"] = now
+
+def throttled(tenant: str, name: str, reason: str, retry_after: float):
+    admission_stats["throttled"] += 1
+    # Client addresses would make the label set unbounded
+    company = "anonymous" if tenant.startswith("ip:") else tenant
+    count("foratask_proxy_throttled_total", (("company", company), ("class", name), ("reason", reason)))
+    return JSONResponse(
+        {"message": "Too many requests, please retry shortly"},
+        status_code=429,
+        headers={"retry-after": str(max(1, int(retry_after + 0.999)))},
+    )
+
+async def admit(request: Request, path: str):
+    """Token bucket plus in-flight cap per (company, route class). Waits up to ADMISSION_MAX_WAIT,
+    then answers 429. Returns (bucket or None, rejection or None); pass the bucket to release()"""
+    name = route_class(path, request.headers.get("content-type", ""))
+    limits = ADMISSION_LIMITS.get(name)
+    # Without verified companies every tenant behind the ingress would share one bucket; the same goes
+    # for public routes (login, webhooks), which never carry a company
+    if not limits or not requires_auth(path):
+        return None, None
+    rate, burst, max_in_flight = limits
+    tenant = request_tenant(request)
+    bucket = admission_bucket(tenant, name, limits)
+    deadline = time.monotonic() + ADMISSION_MAX_WAIT
+    queued = False
+    while True:
+        refill(bucket, rate, burst)
+        if bucket["tokens"] >= 1 and bucket["in_flight"] < max_in_flight:
+            bucket["tokens"] -= 1
+            bucket["in_flight"] += 1
+            admission_stats["admitted"] += 1
+            return bucket, None
+        remaining = deadline - time.monotonic()
+        token_wait = (1 - bucket["tokens"]) / rate if bucket["tokens"] < 1 else 0.0
+        if token_wait > remaining:
+            return None, throttled(tenant, name, "rate", token_wait)
+        if remaining <= 0:
+            return None, throttled(tenant, name, "concurrency", ADMISSION_MAX_WAIT)
+        if not queued:
+            if bucket["waiting"] >= ADMISSION_MAX_QUEUE:
+                return None, throttled(tenant, name, "queue_full", ADMISSION_MAX_WAIT)
+            queued = True
+            admission_stats["queued"] += 1
+        if bucket["released"] is None:
+            bucket["released"] = asyncio.Event()
+        released = bucket["released"]
+        bucket["waiting"] += 1
+        try:
+            await asyncio.wait_for(released.wait(), token_wait or remaining)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            bucket["waiting"] -= 1
+
+def release(bucket):
+    if bucket is None:
+        return
+    bucket["in_flight"] -= 1
+    if bucket["released"] is not None:
+        bucket["released"].set()
+        bucket["released"] = None
+
+def identity_headers(claims):
+    encoded = base64.urlsafe_b64encode(json.dumps(claims, separators=(",", ":")).encode()).decode()
+    return {IDENTITY_HEADER: encoded, IDENTITY_SECRET_HEADER: PROXY_IDENTITY_SECRET}
+
+def request_identity(headers, claims=None):
+    """(company, user, digest) for cache keys. With verified claims the digest covers everything
+    Node sees in req.user; otherwise it is the token digest, so a forged token never matches
+    someone else's cache entries"""
+    if claims is not None:
+        scope = {k: v for k, v in claims.items() if k not in ("iat", "exp")}
+        digest = hashlib.sha256(json.dumps(scope, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        return (str(claims.get("company", "")), str(claims.get("id", "")), digest)
+    token = bearer_token(headers)
+    if not token:
+        return ("", "", "")
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        claims = {}
+    digest = hashlib.sha256(token.encode()).hexdigest()[:32]
+    return (str(claims.get("company", "")), str(claims.get("id", "")), digest)
+
+def resource_of(path: str):
+    return path.split("/", 1)[0]
+
+def cache_epoch_path(resource: str):
+    return os.path.join(NODE_SOCKET_DIR, f"cache-{resource}.epoch")
+
+def cache_generation(path: str):
+    """(local invalidations, shared epoch) of the resource; entries from an older generation are dropped"""
+    resource = resource_of(path)
+    local = cache_generations.get(resource, 0)
+    if not shared_cache_epochs or resource not in cached_resources:
+        return (local, 0)
+    try:
+        return (local, os.stat(cache_epoch_path(resource)).st_mtime_ns)
+    except OSError:
+        return (local, 0)
+
+def publish_cache_epoch(resource: str):
+    path = cache_epoch_path(resource)
+    now = time.time_ns()
+    try:
+        with open(path, "a"):
+            os.utime(path, ns=(now, now))
+    except OSError:
+        pass
+
+def cache_ttl(path: str):
+    for prefix, ttl in PROXY_CACHE_ROUTES.items():
+        if path.startswith(prefix):
+            return ttl
+    return None
+
+def cache_key(request: Request, path: str):
+    claims = getattr(request.state, "claims", None)
+    return (request.method, path, request.url.query, request_identity(request.headers, claims))
+
+def stale_window(path: str):
+    for prefix, window in PROXY_STALE_ROUTES.items():
+        if path.startswith(prefix):
+            return window
+    return (0, 0)
+
+def cache_get(key):
+    """Entry while it may still be served fresh or stale; the caller checks `expires`"""
+    entry = response_cache.get(key)
+    # A generation mismatch is an invalidation made by another proxy process
+    if entry is not None and (
+        entry["retain_until"] < time.monotonic() or entry["generation"] != cache_generation(entry["resource"])
+    ):
+        cache_drop(key)
+        entry = None
+    if entry is None:
+        cache_stats["misses"] += 1
+        return None
+    response_cache.move_to_end(key)
+    if entry["expires"] >= time.monotonic():
+        cache_stats["hits"] += 1
+    return entry
+
+def cache_drop(key):
+    entry = response_cache.pop(key)
+    cache_stats["bytes"] -= entry["size"]
+
+def cache_put(key, path: str, ttl: float, status_code: int, headers: dict, body: bytes):
+    size = len(body) + sum(len(k) + len(v) for k, v in headers.items())
+    if size > PROXY_CACHE_MAX_BYTES:
+        return
+    if key in response_cache:
+        cache_drop(key)
+    expires = time.monotonic() + ttl
+    while_revalidate, if_error = stale_window(path)
+    response_cache[key] = {
+        "expires": expires,
+        "stale_until": expires + while_revalidate,
+        "error_until": expires + if_error,
+        "retain_until": expires + max(while_revalidate, if_error),
+        "etag": headers.get("etag") or etag_for(body),
+        "resource": resource_of(path),
+        "generation": cache_generation(path),
+        "status_code": status_code,
+        "headers": headers,
+        "body": body,
+        "size": size,
+    }
+    cache_stats["bytes"] += size
+    cache_stats["stores"] += 1
+    while cache_stats["bytes"] > PROXY_CACHE_MAX_BYTES:
+        cache_drop(next(iter(response_cache)))
+        cache_stats["evictions"] += 1
+
+def etag_for(body: bytes):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def representation_etag(etag: str, encoding):
+    # Strong ETags must differ per content-coding
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in identity_etags(if_none_match).split(","):
+        if tag.strip().removeprefix("W/") == etag:
+            return True
+    return False
+
+def identity_etags(if_none_match: str):
+    """If-None-Match without the -<encoding> suffixes added by representation_etag, i.e. as Node sent them"""
+    for encoding in compressors():
+        if_none_match = if_none_match.replace(f'-{encoding}"', '"')
+    return if_none_match
+
+def not_modified(request: Request, headers: dict, body_size: int):
+    etag_stats["not_modified"] += 1
+    etag_stats["bytes_saved"] += body_size
+    out = {k: v for k, v in headers.items() if k in NOT_MODIFIED_HEADERS}
+    encoding = pick_encoding(request, headers.get("content-type", ""), body_size)
+    if encoding:
+        out["etag"] = representation_etag(out["etag"], encoding)
+        out["vary"] = add_vary(out.get("vary", ""), "Accept-Encoding")
+    return Response(status_code=304, headers=out)
+
+def compressors():
+    """Available encodings in server preference order"""
+    available = {}
+    if zstandard:
+        available["zstd"] = lambda: zstandard.ZstdCompressor(level=PROXY_ZSTD_LEVEL).compressobj()
+    if brotli:
+        available["br"] = lambda: brotli.Compressor(quality=PROXY_BROTLI_QUALITY)
+    available["gzip"] = lambda: zlib.compressobj(PROXY_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return available
+
+def accepted_encodings(header: str):
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = q
+    return accepted
+
+def pick_encoding(request: Request, content_type: str, size):
+    """size is None for unsized (streamed) bodies"""
+    if size is not None and size < PROXY_COMPRESS_MIN_SIZE:
+        return None
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return None
+    accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+    for encoding in compressors():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def add_vary(vary: str, field: str):
+    return f"{vary}, {field}" if vary and field.lower() not in vary.lower() else (vary or field)
+
+def compress_chunk(compressor, chunk: bytes, final=False):
+    process = getattr(compressor, "process", None) or compressor.compress
+    out = process(chunk)
+    if final:
+        finish = getattr(compressor, "finish", None) or compressor.flush
+        out += finish()
+    return out
+
+async def run_compression(compressor, chunk: bytes, final=False):
+    compression_stats["bytes_in"] += len(chunk)
+    if len(chunk) >= PROXY_COMPRESS_OFFLOAD_SIZE:
+        # zlib/brotli/zstd release the GIL, so big bodies compress off the event loop
+        compression_stats["offloaded"] += 1
+        loop = asyncio.get_running_loop()
+        out = await loop.run_in_executor(compression_executor, compress_chunk, compressor, chunk, final)
+    else:
+        out = compress_chunk(compressor, chunk, final)
+    compression_stats["bytes_out"] += len(out)
+    return out
+
+async def compress_stream(chunks, encoding):
+    compressor = compressors()[encoding]()
+    async for chunk in chunks:
+        out = await run_compression(compressor, chunk)
+        if out:
+            yield out
+    yield await run_compression(compressor, b"", final=True)
+
+def copy_headers(headers):
+    """Mutable copy of a dict or Headers that keeps repeated fields such as Set-Cookie"""
+    return MutableHeaders(raw=[(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()])
+
+def encode_headers(headers, encoding):
+    headers = copy_headers(headers)
+    headers["content-encoding"] = encoding
+    headers["vary"] = add_vary(headers.get("vary", ""), "Accept-Encoding")
+    if "etag" in headers:
+        headers["etag"] = representation_etag(headers["etag"], encoding)
+    return headers
+
+async def buffered_response(request: Request, status_code: int, headers: dict, body: bytes):
+    encoding = pick_encoding(request, headers.get("content-type", ""), len(body))
+    if encoding and status_code != 206:
+        compression_stats["responses"] += 1
+        body = await run_compression(compressors()[encoding](), body, final=True)
+        headers = encode_headers(headers, encoding)
+    return Response(content=body, status_code=status_code, headers=headers)
+
+def cacheable(status_code: int, headers: dict):
+    cache_control = headers.get("cache-control", "")
+    return status_code == 200 and "set-cookie" not in headers and "no-store" not in cache_control
+
+def invalidate_cache(path: str):
+    resource = resource_of(path)
+    stale = {resource, *CACHE_INVALIDATES.get(resource, ())}
+    for name in stale:
+        cache_generations[name] = cache_generations.get(name, 0) + 1
+        if shared_cache_epochs and name in cached_resources:
+            publish_cache_epoch(name)
+    for key in [k for k, e in response_cache.items() if e["resource"] in stale]:
+        cache_drop(key)
+        cache_stats["invalidations"] += 1
+
+def compile_route_templates():
+    # Static segments win over :params, so "task/search" is tried before "task/:id"
+    for template in sorted(ROUTE_TEMPLATES, key=lambda t: t.count(":")):
+        segments = tuple(template.split("/"))
+        route_matchers.setdefault(len(segments), []).append(("/" + template, segments))
+        route_prefixes.add(segments[0])
+
+def route_template(path: str):
+    """Normalized route label for a proxied path (without the /api prefix); unknown paths under a
+    known first segment collapse to it, anything else to /other, so label cardinality stays bounded"""
+    segments = path.strip("/").split("/")
+    for template, pattern in route_matchers.get(len(segments), ()):
+        if all(p == s or (p.startswith(":") and s) for p, s in zip(pattern, segments)):
+            return template
+    if segments[0] not in route_prefixes:
+        return "/other"
+    return f"/{segments[0]}/*" if len(segments) > 1 else f"/{segments[0]}"
+
+def observe(name: str, labels: tuple, value: float, buckets: tuple):
+    histogram = metric_histograms.get((name, labels))
+    if histogram is None:
+        histogram = metric_histograms[(name, labels)] = [[0] * (len(buckets) + 1), 0.0, 0, buckets]
+    histogram[0][bisect.bisect_left(buckets, value)] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+def count(name: str, labels: tuple, value=1):
+    metric_counters[(name, labels)] = metric_counters.get((name, labels), 0) + value
+
+def record_request(method: str, route: str, status: int, seconds: float, upstream_seconds, bytes_in: int, bytes_out: int):
+    labels = (("method", method if method in METRIC_METHODS else "OTHER"), ("route", route))
+    count("foratask_proxy_requests_total", labels + (("status", str(status)),))
+    observe("foratask_proxy_request_duration_seconds", labels, seconds, SECONDS_BUCKETS)
+    if upstream_seconds is not None:
+        observe("foratask_proxy_upstream_duration_seconds", labels, upstream_seconds, SECONDS_BUCKETS)
+        observe("foratask_proxy_overhead_seconds", labels, max(0.0, seconds - upstream_seconds), SECONDS_BUCKETS)
+    observe("foratask_proxy_request_bytes", labels, bytes_in, BYTES_BUCKETS)
+    observe("foratask_proxy_response_bytes", labels, bytes_out, BYTES_BUCKETS)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metrics():
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind == "counter":
+            lines += [f"{name}{format_labels(labels)} {value}"
+                      for (metric, labels), value in metric_counters.items() if metric == name]
+            continue
+        for (metric, labels), (buckets_counts, total, samples, buckets) in metric_histograms.items():
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(buckets + ("+Inf",), buckets_counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {samples}")
+    # Component counters/gauges that are also reported at /proxy/stats
+    groups = {
+        "upstream": upstream_stats, "websocket": ws_stats, "cache": cache_stats, "etag": etag_stats,
+        "coalesce": coalesce_stats, "compression": compression_stats, "uploads": upload_stats,
+        "trace": trace_stats, "auth": auth_stats, "admission": admission_stats, "resilience": resilience_stats,
+        "restart": restart_stats, "node_log": log_stats, "batch": batch_stats, "notify": notify_stats,
+        "sync": sync_stats,
+        "supervisor": supervisor_stats,
+    }
+    for group, stats in groups.items():
+        for key, value in stats.items():
+            lines.append(f"foratask_proxy_{group}_{key} {value}")
+    for worker in node_workers:
+        labels = format_labels((("worker", str(worker["index"])),))
+        lines.append(f"foratask_node_worker_healthy{labels} {int(worker['healthy'])}")
+        lines.append(f"foratask_node_worker_outstanding{labels} {worker['outstanding']}")
+        lines.append(f"foratask_node_worker_restarts_total{labels} {worker['restarts']}")
+        lines.append(f"foratask_node_worker_circuit_open{labels} {int(worker['breaker'] == 'open')}")
+    return "\n".join(lines) + "\n"
+
+def tracing_enabled():
+    return bool(PROXY_TRACE_FILE or PROXY_TRACE_OTLP_URL)
+
+def parse_traceparent(value: str):
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], parts[3] == "01"
+
+def start_trace(scope):
+    headers = dict(scope["headers"])
+    incoming = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+    trace_id, parent_id, parent_sampled = incoming or (os.urandom(16).hex(), None, False)
+    sampled = tracing_enabled() and (parent_sampled or random.random() < PROXY_TRACE_SAMPLE_RATE)
+    return {
+        "trace_id": trace_id,
+        "span_id": os.urandom(8).hex(),
+        "parent_id": parent_id,
+        "sampled": sampled,
+        "request_id": headers.get(b"x-request-id", b"").decode("latin-1")[:128] or uuid.uuid4().hex,
+        "start_ns": time.time_ns(),
+        "marks": {},
+        "phases": {"client_body_read": 0.0, "client_write": 0.0},
+    }
+
+def upstream_trace_headers(trace):
+    flags = "01" if trace["sampled"] else "00"
+    return {"traceparent": f"00-{trace['trace_id']}-{trace['span_id']}-{flags}", "x-request-id": trace["request_id"]}
+
+def upstream_trace_hook(trace):
+    """httpcore trace callback: timestamps connect / send / headers / body events"""
+    marks = trace["marks"]
+
+    async def hook(event_name, info):
+        marks[event_name] = time.perf_counter()
+    return hook
+
+def mark_span(marks, name):
+    started, done = marks.get(f"{name}.started"), marks.get(f"{name}.complete")
+    return round((done - started) * 1000, 3) if started and done else 0.0
+
+def finish_trace(trace, method: str, route: str, status: int, seconds: float, bytes_in: int, bytes_out: int):
+    trace_stats["spans"] += 1
+    marks = trace["marks"]
+    headers_sent = marks.get("http11.send_request_headers.started")
+    headers_received = marks.get("http11.receive_response_headers.complete")
+    span = {
+        "trace_id": trace["trace_id"],
+        "span_id": trace["span_id"],
+        "parent_span_id": trace["parent_id"],
+        "request_id": trace["request_id"],
+        "name": f"{method} {route}",
+        "method": method,
+        "route": route,
+        "status": status,
+        "start_unix_nano": trace["start_ns"],
+        "duration_ms": round(seconds * 1000, 3),
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "phases_ms": {
+            "client_body_read": round(trace["phases"]["client_body_read"] * 1000, 3),
+            "upstream_connect": mark_span(marks, "connection.connect_unix_socket") or mark_span(marks, "connection.connect_tcp"),
+            "upstream_ttfb": round((headers_received - headers_sent) * 1000, 3) if headers_sent and headers_received else 0.0,
+            "upstream_body": mark_span(marks, "http11.receive_response_body"),
+            "client_write": round(trace["phases"]["client_write"] * 1000, 3),
+        },
+    }
+    try:
+        trace_queue.put_nowait(span)
+    except (AttributeError, asyncio.QueueFull):
+        trace_stats["dropped"] += 1
+
+def otlp_payload(spans):
+    def attribute(key, value):
+        kind = "doubleValue" if isinstance(value, float) else "intValue" if isinstance(value, int) else "stringValue"
+        return {"key": key, "value": {kind: value}}
+
+    otlp_spans = []
+    for span in spans:
+        attributes = [
+            attribute("http.request.method", span["method"]),
+            attribute("http.route", span["route"]),
+            attribute("http.response.status_code", span["status"]),
+            attribute("foratask.request_id", span["request_id"]),
+            attribute("http.request.body.size", span["bytes_in"]),
+            attribute("http.response.body.size", span["bytes_out"]),
+        ] + [attribute(f"foratask.phase.{k}_ms", float(v)) for k, v in span["phases_ms"].items()]
+        otlp_spans.append({
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "parentSpanId": span["parent_span_id"] or "",
+            "name": span["name"],
+            "kind": 2,
+            "startTimeUnixNano": str(span["start_unix_nano"]),
+            "endTimeUnixNano": str(span["start_unix_nano"] + int(span["duration_ms"] * 1e6)),
+            "attributes": attributes,
+            "status": {"code": 2 if span["status"] >= 500 else 0},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [attribute("service.name", "foratask-proxy")]},
+        "scopeSpans": [{"scope": {"name": "foratask.proxy"}, "spans": otlp_spans}],
+    }]}
+
+def write_trace_lines(path: str, lines: list):
+    if os.path.exists(path) and os.path.getsize(path) > PROXY_TRACE_FILE_MAX_BYTES:
+        os.replace(path, path + ".1")
+    with open(path, "a") as f:
+        f.writelines(lines)
+
+async def export_spans(client, spans):
+    try:
+        if PROXY_TRACE_FILE:
+            lines = [json.dumps(span, separators=(",", ":")) + "\n" for span in spans]
+            await anyio.to_thread.run_sync(write_trace_lines, PROXY_TRACE_FILE, lines)
+        if PROXY_TRACE_OTLP_URL:
+            resp = await client.post(PROXY_TRACE_OTLP_URL, json=otlp_payload(spans), timeout=5.0)
+            resp.raise_for_status()
+        trace_stats["exported"] += len(spans)
+    except (OSError, httpx.HTTPError):
+        trace_stats["export_errors"] += 1
+
+async def trace_exporter():
+    """Batches spans off the request path; a full queue drops spans rather than slowing requests"""
+    async with httpx.AsyncClient() as client:
+        while True:
+            spans = [await trace_queue.get()]
+            deadline = time.monotonic() + 1.0
+            while len(spans) < PROXY_TRACE_BATCH_SIZE and time.monotonic() < deadline:
+                try:
+                    spans.append(await asyncio.wait_for(trace_queue.get(), deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+            await export_spans(client, spans)
+
+async def start_trace_exporter():
+    global trace_queue, trace_exporter_task
+    if tracing_enabled():
+        trace_queue = asyncio.Queue(maxsize=PROXY_TRACE_QUEUE_SIZE)
+        trace_exporter_task = asyncio.create_task(trace_exporter())
+
+async def stop_trace_exporter():
+    if trace_exporter_task is None:
+        return
+    trace_exporter_task.cancel()
+    spans = []
+    while not trace_queue.empty():
+        spans.append(trace_queue.get_nowait())
+    if spans:
+        async with httpx.AsyncClient() as client:
+            await export_spans(client, spans)
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware for /api requests: request ID / traceparent, per-route metrics
+    and phase timing, without building per-request Request/Response objects"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        trace = start_trace(scope)
+        scope.setdefault("state", {})["trace"] = trace
+        phases = trace["phases"]
+        info = {"status": 500, "bytes_in": 0, "bytes_out": 0}
+
+        async def counting_receive():
+            started = time.perf_counter()
+            message = await receive()
+            if message["type"] == "http.request":
+                phases["client_body_read"] += time.perf_counter() - started
+                info["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                info["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", trace["request_id"].encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                info["bytes_out"] += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                info["bytes_out"] += message.get("count", 0)
+            started = time.perf_counter()
+            await send(message)
+            if message["type"] != "http.response.start":
+                phases["client_write"] += time.perf_counter() - started
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            seconds = time.perf_counter() - start
+            method, route = scope["method"], route_template(scope["path"][len("/api/"):])
+            record_request(
+                method, route, info["status"], seconds,
+                scope["state"].get("upstream_seconds"), info["bytes_in"], info["bytes_out"],
+            )
+            if trace["sampled"]:
+                finish_trace(trace, method, route, info["status"], seconds, info["bytes_in"], info["bytes_out"])
+
+def routed_in_app(scope):
+    # /api paths with their own FastAPI routes
+    if scope["path"].startswith("/api/uploads/"):
+        return scope["method"] in ("GET", "HEAD")
+    if scope["path"] == "/api/notifications/stream" or scope["path"].startswith("/api/sync/"):
+        return scope["method"] == "GET"
+    return scope["path"] == "/api/batch" and scope["method"] == "POST"
+
+class ApiFastPathMiddleware:
+    """Serves /api/* by calling proxy() straight from the ASGI layer, skipping FastAPI's route
+    matching, dependency solving and endpoint wrapping; the api_route below stays as the fallback"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (not PROXY_FAST_PATH or scope["type"] != "http" or not scope["path"].startswith("/api/")
+                or routed_in_app(scope)):
+            await self.app(scope, receive, send)
+            return
+        response = await proxy(scope["path"][len("/api/"):], Request(scope, receive))
+        await response(scope, receive, send)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    start_node_backend()
-    await asyncio.sleep(2)
+    global upstream_client, follower_task, shared_cache_epochs
+    started = time.monotonic()
+    os.makedirs(NODE_SOCKET_DIR, mode=0o700, exist_ok=True)
+    shared_cache_epochs = True
+    upstream_client = create_upstream_client()
+    if not AUTH_JWT_SECRET:
+        print("JWT_SECRET not set: tokens are verified by Node only and per-tenant admission control is off")
+    # uvicorn only starts accepting connections once this returns
+    if acquire_supervisor_lock():
+        await start_supervising(read_node_state())
+        print(f"Node.js backend ready in {time.monotonic() - started:.2f}s ({NODE_LAUNCH_MODE} mode)")
+    else:
+        ready = await wait_for_node_state()
+        print(f"Proxy process {os.getpid()} following the Node.js supervisor ({'ready' if ready else 'not ready'})")
+        follower_task = asyncio.create_task(follow_node_supervisor())
+    await start_trace_exporter()
     yield
-    stop_node_backend()
+    if follower_task is not None:
+        follower_task.cancel()
+    if notify_poller_task is not None:
+        notify_poller_task.cancel()
+    await stop_supervising()
+    await stop_trace_exporter()
+    await upstream_client.aclose()
+    upstream_client = None
 
 app = FastAPI(lifespan=lifespan)
+# Added first so it runs inside the instrumentation middleware
+app.add_middleware(ApiFastPathMiddleware)
+app.add_middleware(InstrumentationMiddleware)
+compile_route_templates()
 
-@app.api_route("/api/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE","OPTIONS","HEAD"])
-async def proxy(path: str, request: Request):
-    url = f"{NODE_BACKEND_URL}/{path}"
-    headers = dict(request.headers)
-    headers.pop("host", None)
-    params = dict(request.query_params)
-    body = await request.body()
+def retire_upload_file(path: str):
+    entry = upload_files.pop(path)
+    entry["retired"] = True
+    if entry["users"] == 0:
+        entry["file"].close()
+
+def release_upload_file(entry):
+    entry["users"] -= 1
+    if entry["retired"] and entry["users"] == 0:
+        entry["file"].close()
+
+def open_upload_file(path: str):
+    """Open file objects are cached (LRU) and revalidated against stat() on every request;
+    entries still being sent are only closed once their last response finishes"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        if path in upload_files:
+            retire_upload_file(path)
+        raise
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(path)
+    ident = (st.st_ino, st.st_size, st.st_mtime_ns)
+    entry = upload_files.get(path)
+    if entry is not None and entry["ident"] == ident:
+        upload_files.move_to_end(path)
+        upload_stats["fd_hits"] += 1
+    else:
+        if entry is not None:
+            retire_upload_file(path)
+        entry = {"file": open(path, "rb", buffering=0), "ident": ident, "users": 0, "retired": False}
+        upload_files[path] = entry
+        upload_stats["fd_opens"] += 1
+        while len(upload_files) > UPLOADS_FD_CACHE_SIZE:
+            retire_upload_file(next(iter(upload_files)))
+    entry["users"] += 1
+    return entry, st
+
+def parse_range(header: str, size: int):
+    """Single byte range -> (start, end) inclusive; None to ignore the header, False if unsatisfiable"""
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix <= 0:
+                return False
+            start, end = max(0, size - suffix), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return False
+    return start, end
+
+class UploadFileResponse(Response):
+    """Sends [offset, offset + count) of a cached upload file, zero-copy when the server supports it"""
+
+    def __init__(self, entry, offset: int, count: int, status_code: int, headers: dict, send_body: bool):
+        super().__init__(status_code=status_code, headers=headers)
+        self.entry = entry
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.count == 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            upload_stats["bytes"] += self.count
+            file = self.entry["file"]
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                upload_stats["zero_copy"] += 1
+                await send({"type": "http.response.zerocopysend", "file": file, "offset": self.offset, "count": self.count})
+                return
+            # pread doesn't move a shared file position, so concurrent responses can share one fd
+            offset, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, file.fileno(), min(UPLOADS_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            release_upload_file(self.entry)
+
+def not_modified_since(if_modified_since: str, mtime: float):
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def spend_retry_budget():
+    global retry_budget
+    if retry_budget < 1:
+        resilience_stats["budget_exhausted"] += 1
+        return False
+    retry_budget -= 1
+    return True
+
+def hedge_delay(request: Request, path: str):
+    """p95 upstream latency of this route (from the metrics histogram), once there are enough samples"""
+    if request.method != "GET" or len(node_workers) < 2:
+        return None
+    if not path.startswith(PROXY_HEDGE_ROUTES) or path.startswith(RETRY_EXCLUDED):
+        return None
+    labels = (("method", "GET"), ("route", route_template(path)))
+    histogram = metric_histograms.get(("foratask_proxy_upstream_duration_seconds", labels))
+    if histogram is None or histogram[2] < HEDGE_MIN_SAMPLES:
+        return None
+    counts, _, samples, buckets = histogram
+    seen = 0
+    for bound, bucket_count in zip(buckets, counts):
+        seen += bucket_count
+        if seen >= 0.95 * samples:
+            return max(bound, HEDGE_MIN_DELAY)
+    return None
+
+async def send_to_worker(worker, upstream_request):
+    upstream_stats["requests"] += 1
+    upstream_stats["in_flight"] += 1
+    upstream_stats["peak_in_flight"] = max(upstream_stats["peak_in_flight"], upstream_stats["in_flight"])
+    worker["outstanding"] += 1
+    try:
+        resp = await upstream_client.send(upstream_request, stream=True)
+    except httpx.PoolTimeout:
+        upstream_stats["pool_timeouts"] += 1
+        worker["breaker_probing"] = False
+        raise
+    except httpx.TransportError as exc:
+        if isinstance(exc, httpx.ConnectError):
+            worker["healthy"] = False
+        record_upstream_failure(worker)
+        raise
+    except asyncio.CancelledError:
+        worker["breaker_probing"] = False
+        raise
+    finally:
+        upstream_stats["in_flight"] -= 1
+        worker["outstanding"] -= 1
+    if resp.status_code in BREAKER_STATUSES:
+        record_upstream_failure(worker)
+    else:
+        close_breaker(worker)
+    return resp
+
+async def hedged_send(build, worker, delay: float):
+    """Sends to `worker`; if no response within `delay`, races a backup request on another worker"""
+    primary = asyncio.create_task(send_to_worker(worker, build(worker)))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    backup_worker = None if done else pick_worker(exclude=worker)
+    if backup_worker is None or not spend_retry_budget():
+        if backup_worker is not None:
+            backup_worker["breaker_probing"] = False
+        return worker, await primary
+    resilience_stats["hedged"] += 1
+    tasks = {primary: worker, asyncio.create_task(send_to_worker(backup_worker, build(backup_worker))): backup_worker}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [t for t in done if not t.cancelled() and t.exception() is None]
+            if winners:
+                for loser in winners[1:]:
+                    await loser.result().aclose()
+                if winners[0] is not primary:
+                    resilience_stats["hedge_wins"] += 1
+                return tasks[winners[0]], winners[0].result()
+        raise primary.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def send_upstream(request: Request, path: str, build, worker):
+    """(worker, streamed response): idempotent requests are retried on another worker after a
+    connection-level failure, within the retry budget; hedged per PROXY_HEDGE_ROUTES"""
+    global retry_budget
+    retry_budget = min(RETRY_BUDGET_MAX, retry_budget + RETRY_BUDGET_RATIO)
+    delay = hedge_delay(request, path)
+    attempt = 0
+    while True:
+        try:
+            if delay is not None:
+                return await hedged_send(build, worker, delay)
+            return worker, await send_to_worker(worker, build(worker))
+        except RETRYABLE_ERRORS:
+            if request.method not in IDEMPOTENT_METHODS or path.startswith(RETRY_EXCLUDED) or attempt >= UPSTREAM_RETRIES:
+                raise
+            if not spend_retry_budget():
+                raise
+            retry_worker = pick_worker(exclude=worker) if len(node_workers) > 1 else pick_worker()
+            if retry_worker is None:
+                retry_budget += 1
+                raise
+            attempt += 1
+            resilience_stats["retries"] += 1
+            worker = retry_worker
+
+async def fetch_upstream(request: Request, path: str):
+    """Returns (status, headers, body) for buffered responses, or a ready Response when streaming/failing"""
+    socketio = path.startswith("socket.io")
+    sid = request.query_params.get("sid") if socketio else None
+    headers = []
+    for k, v in request.scope["headers"]:
+        if k == b"if-none-match":
+            # Streamed compressed responses carry Express's ETag with our encoding suffix
+            v = identity_etags(v.decode("latin-1")).encode("latin-1")
+        if k not in UPSTREAM_DROPPED_HEADERS:
+            headers.append((k, v))
+    claims = getattr(request.state, "claims", None)
+    if claims is not None:
+        headers.extend(identity_headers(claims).items())
+    query = request.scope["query_string"]
     content_type = request.headers.get("content-type", "")
+    trace = request.scope.get("state", {}).get("trace")
+    extensions = {}
+    if trace:
+        headers.extend(upstream_trace_headers(trace).items())
+        if trace["sampled"]:
+            extensions["trace"] = upstream_trace_hook(trace)
+    content = await request_content(request)
+    timeout = timeout_for(path, content_type)
+    # Claimed only now: a half-open worker's probe slot must not be held while the request body is read
+    worker = pick_worker(sid)
+    if worker is None:
+        return breaker_open_response()
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.request(
+    def build(target):
+        return upstream_client.build_request(
             method=request.method,
-            url=url,
+            url=httpx.URL(f"{target['url']}/{path}", query=query),
             headers=headers,
-            params=params,
-            content=body,
+            content=content,
+            timeout=timeout,
+            extensions=extensions,
+        )
+
+    upstream_start = time.perf_counter()
+    try:
+        worker, resp = await send_upstream(request, path, build, worker)
+    except httpx.PoolTimeout:
+        return JSONResponse({"message": "Upstream connection pool exhausted"}, status_code=503)
+    except httpx.TimeoutException:
+        return JSONResponse({"message": "Backend timed out"}, status_code=504)
+    except httpx.TransportError:
+        return JSONResponse({"message": "Backend unavailable"}, status_code=502)
+    resp_headers = MutableHeaders(raw=[
+        (k.lower(), v) for k, v in resp.headers.raw if k.lower() not in RAW_EXCLUDED_RESPONSE_HEADERS
+    ])
+    if request.method not in BODYLESS_METHODS:
+        invalidate_cache(path)
+
+    size = content_length(resp.headers)
+    if size is not None and size <= PROXY_BUFFER_THRESHOLD:
+        try:
+            body = await resp.aread()
+        finally:
+            await resp.aclose()
+        request.state.upstream_seconds = time.perf_counter() - upstream_start
+        if socketio and sid is None:
+            remember_socketio_session(worker, body)
+        return resp.status_code, resp_headers, body
+
+    # Large or unsized bodies: each chunk is sent before the next is read from Node
+    request.state.upstream_seconds = time.perf_counter() - upstream_start
+    upstream_stats["streamed_responses"] += 1
+    chunks = tracked_stream(worker, resp.aiter_bytes(PROXY_STREAM_CHUNK_SIZE))
+    encoding = pick_encoding(request, resp_headers.get("content-type", ""), size)
+    if encoding and resp.status_code == 200 and request.method != "HEAD":
+        compression_stats["responses"] += 1
+        chunks = compress_stream(chunks, encoding)
+        resp_headers = encode_headers(resp_headers, encoding)
+    return StreamingResponse(
+        chunks,
+        status_code=resp.status_code,
+        headers=resp_headers,
+        background=BackgroundTask(resp.aclose),
+    )
+
+async def tracked_stream(worker, chunks):
+    # Counted so a rolling restart doesn't stop a worker halfway through a download
+    worker["streams"] += 1
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        worker["streams"] -= 1
+
+def coalescable(request: Request, path: str):
+    return not path.startswith(COALESCE_EXCLUDED) and not any(h in request.headers for h in COALESCE_UNSHARED_HEADERS)
+
+async def coalesced_fetch(key, request: Request, path: str):
+    """Single-flight: concurrent identical GETs from the same token share one upstream call; a GET that
+    arrives after an invalidation of its resource doesn't join a fetch that started before it"""
+    flight = (key, cache_generation(path))
+    leader = inflight_requests.get(flight)
+    if leader is not None:
+        coalesce_stats["coalesced"] += 1
+        # shield so a waiter that disconnects doesn't cancel the shared result
+        result = await asyncio.shield(leader)
+        if result is not None:
+            return result
+        return await fetch_upstream(request, path)
+
+    future = asyncio.get_running_loop().create_future()
+    inflight_requests[flight] = future
+    coalesce_stats["leaders"] += 1
+    result = None
+    try:
+        result = await fetch_upstream(request, path)
+        return result
+    finally:
+        del inflight_requests[flight]
+        # Streamed or failed responses can't be shared; waiters then go upstream themselves
+        future.set_result(result if isinstance(result, tuple) else None)
+
+@app.api_route("/api/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_upload(file_path: str, request: Request):
+    # os.path/os.stat raise ValueError rather than OSError on an embedded NUL
+    if "\0" in file_path:
+        return JSONResponse({"message": "File not found"}, status_code=404)
+    path = os.path.realpath(os.path.join(UPLOADS_DIR, file_path))
+    if os.path.commonpath([path, UPLOADS_DIR]) != UPLOADS_DIR:
+        return JSONResponse({"message": "File not found"}, status_code=404)
+    try:
+        entry, st = open_upload_file(path)
+    except OSError:
+        return JSONResponse({"message": "File not found"}, status_code=404)
+
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {
+        "content-type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+        "etag": etag,
+        "last-modified": formatdate(st.st_mtime, usegmt=True),
+        "cache-control": UPLOADS_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag_matches(if_none_match, etag) or (
+        not if_none_match and not_modified_since(request.headers.get("if-modified-since"), st.st_mtime)
+    ):
+        release_upload_file(entry)
+        upload_stats["not_modified"] += 1
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k in NOT_MODIFIED_HEADERS})
+
+    size = st.st_size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if "range" in request.headers and (if_range is None or if_range == etag):
+        byte_range = parse_range(request.headers["range"], size)
+    if byte_range is False:
+        release_upload_file(entry)
+        return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+
+    upload_stats["served"] += 1
+    send_body = request.method != "HEAD"
+    if byte_range:
+        start, end = byte_range
+        upload_stats["partial"] += 1
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        return UploadFileResponse(entry, start, end - start + 1, 206, headers, send_body)
+    headers["content-length"] = str(size)
+    return UploadFileResponse(entry, 0, size, 200, headers, send_body)
+
+def batch_item_request(request: Request, item: dict):
+    """(path, Request) for one batch item: the batch's headers and auth, the item's path and query"""
+    path, _, query = item["path"].lstrip("/").removeprefix("api/").partition("?")
+    headers = [(k, v) for k, v in request.scope["headers"] if k not in BATCH_DROPPED_HEADERS]
+    for name, value in (item.get("headers") or {}).items():
+        if name.lower() in BATCH_ITEM_REQUEST_HEADERS:
+            headers.append((name.lower().encode("latin-1"), str(value).encode("latin-1")))
+    scope = {
+        **request.scope,
+        "method": "GET",
+        "path": f"/api/{path}",
+        "raw_path": f"/api/{path}".encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": {"trace": request.scope.get("state", {}).get("trace")},
+    }
+    return path, Request(scope)
+
+async def response_body(response: Response):
+    if not isinstance(response, StreamingResponse):
+        return response.body
+    chunks = [chunk async for chunk in response.body_iterator]
+    if response.background is not None:
+        await response.background()
+    return b"".join(chunks)
+
+async def run_batch_item(request: Request, item):
+    if not isinstance(item, dict) or not isinstance(item.get("path"), str) or item.get("method", "GET") != "GET":
+        return {"status": 400, "body": {"message": "Batch items must be GET requests with a path"}}
+    headers = item.get("headers") or {}
+    if not isinstance(headers, dict) or not all(
+        isinstance(value, str) and value.isascii() and "\n" not in value and "\r" not in value
+        for value in headers.values()
+    ):
+        return {"status": 400, "body": {"message": "Batch item headers must be an object of ASCII strings"}}
+    path, sub_request = batch_item_request(request, item)
+    if path.startswith(BATCH_EXCLUDED):
+        return {"status": 400, "body": {"message": f"/{path} can't be batched"}}
+    response = await proxy(path, sub_request)
+    body = await response_body(response)
+    headers = {k: response.headers[k] for k in BATCH_ITEM_RESPONSE_HEADERS if k in response.headers}
+    result = {"status": response.status_code, "headers": headers, "body": None}
+    if body:
+        try:
+            result["body"] = json.loads(body) if "json" in headers.get("content-type", "") else body.decode()
+        except ValueError:
+            result["body"] = body.decode("utf-8", "replace")
+    return result
+
+@app.post("/api/batch")
+async def batch(request: Request):
+    """{"requests": [{"path": "/stats/tasks-summary"}, ...]} -> {"responses": [{"status", "headers", "body"}, ...]}
+    in request order. Items run concurrently with the batch's Authorization, so auth, cache, coalescing
+    and admission control all apply per item"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    items = payload.get("requests") if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        batch_stats["rejected"] += 1
+        return JSONResponse({"message": 'Expected {"requests": [{"path": ...}, ...]}'}, status_code=400)
+    if len(items) > PROXY_BATCH_MAX_ITEMS:
+        batch_stats["rejected"] += 1
+        return JSONResponse({"message": f"At most {PROXY_BATCH_MAX_ITEMS} requests per batch"}, status_code=413)
+    rejected = authenticate(request, "batch")
+    if rejected is not None:
+        return rejected
+    batch_stats["batches"] += 1
+    batch_stats["items"] += len(items)
+    responses = await asyncio.gather(*(run_batch_item(request, item) for item in items))
+    body = json.dumps({"responses": responses}, separators=(",", ":")).encode()
+    return await buffered_response(request, 200, {"content-type": "application/json; charset=utf-8"}, body)
+
+async def fetch_notification_feed(cursor):
+    worker = pick_worker()
+    if worker is None:
+        return None
+    upstream_request = upstream_client.build_request(
+        "GET",
+        f"{worker['url']}/internal/notifications/feed",
+        params=cursor,
+        headers={INTERNAL_SECRET_HEADER: PROXY_IDENTITY_SECRET},
+        timeout=TIMEOUT_CLASSES["default"],
+    )
+    resp = await send_to_worker(worker, upstream_request)
+    try:
+        body = await resp.aread()
+    finally:
+        await resp.aclose()
+    return json.loads(body) if resp.status_code == 200 else None
+
+def publish_notification(note):
+    """Fans a new notification out to the user's streams and keeps it for Last-Event-ID resume"""
+    user = str(note.get("userId", ""))
+    if user not in notify_subscribers and user not in notify_replay:
+        return
+    event = (str(note["_id"]), json.dumps(note, separators=(",", ":")))
+    replay = notify_replay.get(user)
+    if replay is None:
+        replay = notify_replay[user] = deque(maxlen=NOTIFY_REPLAY_SIZE)
+    notify_replay.move_to_end(user)
+    replay.append(event)
+    while len(notify_replay) > NOTIFY_REPLAY_USERS:
+        notify_replay.popitem(last=False)
+    for subscriber in notify_subscribers.get(user, ()):
+        subscriber.put_nowait(event)
+    notify_stats["events"] += 1
+
+async def poll_notifications():
+    """One feed poll per interval for the whole process. Exits once no stream has been open for
+    NOTIFY_IDLE_TIMEOUT and drops the replay buffers, since events after that point are never seen"""
+    global notify_poller_task
+    cursor = {"since": int((time.time() - NOTIFY_OVERLAP) * 1000)}
+    idle_since = None
+    try:
+        while True:
+            if notify_subscribers:
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > NOTIFY_IDLE_TIMEOUT:
+                return
+            notify_stats["polls"] += 1
+            try:
+                feed = await fetch_notification_feed(cursor)
+            except (httpx.HTTPError, ValueError):
+                feed = None
+            if feed is None:
+                notify_stats["poll_errors"] += 1
+                await asyncio.sleep(NOTIFY_POLL_INTERVAL)
+                continue
+            now = time.monotonic()
+            for note in feed["notifications"]:
+                if str(note["_id"]) not in notify_seen:
+                    notify_seen[str(note["_id"])] = now
+                    publish_notification(note)
+            for note_id, seen_at in list(notify_seen.items()):
+                if now - seen_at > NOTIFY_OVERLAP * 2 + NOTIFY_POLL_INTERVAL:
+                    del notify_seen[note_id]
+            if feed["next"]:
+                # Full page: carry on from its last row straight away
+                cursor = feed["next"]
+                continue
+            # Node's clock, so the overlap isn't eaten by skew between the two
+            cursor = {"since": feed["now"] - int(NOTIFY_OVERLAP * 1000)}
+            await asyncio.sleep(NOTIFY_POLL_INTERVAL)
+    finally:
+        notify_poller_task = None
+        notify_replay.clear()
+        notify_seen.clear()
+
+def ensure_notification_poller():
+    global notify_poller_task
+    if notify_poller_task is None:
+        notify_poller_task = asyncio.create_task(poll_notifications())
+
+def sse_event(event: str, data: str, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {data}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+async def notification_events(user: str, backlog, unread: bytes):
+    # Subscribed here rather than in the endpoint so the finally below always runs for it
+    subscriber = asyncio.Queue()
+    notify_subscribers.setdefault(user, set()).add(subscriber)
+    if user not in notify_replay:
+        notify_replay[user] = deque(maxlen=NOTIFY_REPLAY_SIZE)
+    notify_stats["streams"] += 1
+    notify_stats["connections"] += 1
+    ensure_notification_poller()
+    try:
+        yield f"retry: {NOTIFY_RETRY_MS}\n\n".encode()
+        for chunk in backlog:
+            yield chunk
+        yield sse_event("unread", unread.decode())
+        while True:
+            try:
+                event_id, data = await asyncio.wait_for(subscriber.get(), NOTIFY_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            yield sse_event("notification", data, event_id)
+    finally:
+        subscribers = notify_subscribers[user]
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del notify_subscribers[user]
+        notify_stats["streams"] -= 1
+
+@app.get("/api/notifications/stream")
+async def notification_stream(request: Request):
+    """text/event-stream of `notification` events (id = notification _id) for the caller, followed by an
+    `unread` {"count"} event. A reconnect with Last-Event-ID first gets what it missed, or a `resync` event
+    when that is no longer known here and getAllNotifications should be refetched"""
+    rejected = authenticate(request, "notifications/stream")
+    if rejected is not None:
+        return rejected
+    # Also how Node authenticates the caller when the proxy can't verify tokens itself
+    path, count_request = batch_item_request(request, {"path": "notifications/unreadCount"})
+    response = await proxy(path, count_request)
+    unread = await response_body(response)
+    if response.status_code != 200:
+        headers = {k: response.headers[k] for k in ("content-type", "retry-after") if k in response.headers}
+        return Response(unread, status_code=response.status_code, headers=headers)
+    claims = getattr(request.state, "claims", None)
+    if claims is None:
+        # Node has just accepted this token
+        claims = jwt.decode(bearer_token(request.headers), options={"verify_signature": False})
+    user = str(claims.get("id", ""))
+    if len(notify_subscribers.get(user, ())) >= NOTIFY_MAX_STREAMS_PER_USER:
+        return throttled(request_tenant(request), "notifications", "streams", NOTIFY_RETRY_MS / 1000)
+
+    backlog = []
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        replay = list(notify_replay.get(user, ()))
+        ids = [event_id for event_id, _ in replay]
+        if last_event_id in ids:
+            notify_stats["resumed"] += 1
+            backlog = [sse_event("notification", data, event_id) for event_id, data in replay[ids.index(last_event_id) + 1:]]
+        else:
+            notify_stats["resyncs"] += 1
+            backlog = [sse_event("resync", "{}")]
+    return StreamingResponse(
+        notification_events(user, backlog, unread),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+def json_pointer(path: str, token):
+    return f"{path}/{str(token).replace('~', '~0').replace('/', '~1')}"
+
+def keyed_by_id(items):
+    ids = [item.get("_id") if isinstance(item, dict) else None for item in items]
+    return None not in ids and len(set(map(str, ids))) == len(ids)
+
+def diff_list(old: list, new: list, path: str, ops: list):
+    if not (keyed_by_id(old) and keyed_by_id(new)):
+        for index, (a, b) in enumerate(zip(old, new)):
+            json_diff(a, b, json_pointer(path, index), ops)
+        for index in range(len(old) - 1, len(new) - 1, -1):
+            ops.append({"op": "remove", "path": json_pointer(path, index)})
+        for index in range(len(old), len(new)):
+            ops.append({"op": "add", "path": json_pointer(path, index), "value": new[index]})
+        return
+    # Mongo documents: match rows by _id so an insert at the top is one op, not a replace of every row
+    wanted = {str(item["_id"]) for item in new}
+    current = list(old)
+    for index in range(len(current) - 1, -1, -1):
+        if str(current[index]["_id"]) not in wanted:
+            ops.append({"op": "remove", "path": json_pointer(path, index)})
+            del current[index]
+    kept = {str(item["_id"]) for item in current}
+    for index, item in enumerate(new):
+        item_id = str(item["_id"])
+        if index < len(current) and str(current[index]["_id"]) == item_id:
+            json_diff(current[index], item, json_pointer(path, index), ops)
+            continue
+        if item_id in kept:
+            source = next(i for i in range(index, len(current)) if str(current[i]["_id"]) == item_id)
+            ops.append({"op": "move", "from": json_pointer(path, source), "path": json_pointer(path, index)})
+            current.insert(index, current.pop(source))
+            json_diff(current[index], item, json_pointer(path, index), ops)
+        else:
+            ops.append({"op": "add", "path": json_pointer(path, index), "value": item})
+            current.insert(index, item)
+
+def json_diff(old, new, path: str = "", ops=None):
+    """RFC 6902 operations that turn `old` into `new`"""
+    if ops is None:
+        ops = []
+    if type(old) is not type(new):
+        ops.append({"op": "replace", "path": path, "value": new})
+    elif isinstance(old, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": json_pointer(path, key)})
+        for key, value in new.items():
+            if key in old:
+                json_diff(old[key], value, json_pointer(path, key), ops)
+            else:
+                ops.append({"op": "add", "path": json_pointer(path, key), "value": value})
+    elif isinstance(old, list):
+        diff_list(old, new, path, ops)
+    elif old != new:
+        ops.append({"op": "replace", "path": path, "value": new})
+    return ops
+
+def sync_version(body: bytes):
+    return hashlib.sha256(body).hexdigest()[:20]
+
+def sync_snapshot(key, version: str):
+    """Raw JSON body of a held version; kept as bytes since the parsed tree is several times larger"""
+    versions = sync_snapshots.get(key)
+    if versions is None:
+        return None
+    sync_snapshots.move_to_end(key)
+    return next((body for v, body in versions if v == version), None)
+
+def sync_remember(key, version: str, body: bytes):
+    global sync_bytes
+    versions = sync_snapshots.get(key)
+    if versions is None:
+        versions = sync_snapshots[key] = deque()
+    sync_snapshots.move_to_end(key)
+    if any(v == version for v, _ in versions):
+        return
+    versions.append((version, body))
+    sync_bytes += len(body)
+    if len(versions) > SYNC_VERSIONS_PER_KEY:
+        sync_bytes -= len(versions.popleft()[1])
+    while sync_bytes > SYNC_MAX_BYTES and sync_snapshots:
+        _, evicted = sync_snapshots.popitem(last=False)
+        sync_bytes -= sum(len(body) for _, body in evicted)
+        sync_stats["evictions"] += 1
+
+@app.get("/api/sync/{path:path}")
+async def sync(path: str, request: Request):
+    """The JSON of GET /api/<path>, as {"version", "full": true, "data"} or, when the client sends back a
+    version still held here in X-Sync-Version, as {"version", "base", "patch"} with an RFC 6902 patch.
+    The version is a hash of the response, so it means the same thing in every proxy process"""
+    if not path.startswith(SYNC_ROUTES):
+        return JSONResponse({"message": f"/{path} can't be synced"}, status_code=404)
+    rejected = authenticate(request, path)
+    if rejected is not None:
+        return rejected
+    query = request.url.query
+    upstream_path, sub_request = batch_item_request(request, {"path": f"{path}?{query}" if query else path})
+    response = await proxy(upstream_path, sub_request)
+    body = await response_body(response)
+    document = None
+    if response.status_code == 200 and "json" in response.headers.get("content-type", ""):
+        try:
+            document = json.loads(body)
+        except ValueError:
+            pass
+    if document is None:
+        headers = {k: v for k, v in response.headers.items() if k not in EXCLUDED_RESPONSE_HEADERS}
+        return Response(body, status_code=response.status_code, headers=headers)
+    version = sync_version(body)
+    key = cache_key(sub_request, upstream_path)
+    base = request.headers.get(SYNC_VERSION_HEADER)
+    previous = sync_snapshot(key, base) if base else None
+    sync_remember(key, version, body)
+
+    encoded = None
+    if base == version:
+        sync_stats["unchanged"] += 1
+        encoded = json.dumps({"version": version, "base": base, "patch": []}, separators=(",", ":")).encode()
+    elif previous is not None:
+        patch = {"version": version, "base": base, "patch": json_diff(json.loads(previous), document)}
+        encoded = json.dumps(patch, separators=(",", ":")).encode()
+        # A patch that rewrites most of the list is no cheaper to send or apply than the list itself
+        if len(encoded) < len(body):
+            sync_stats["deltas"] += 1
+        else:
+            encoded = None
+    elif base:
+        sync_stats["misses"] += 1
+    if encoded is None:
+        sync_stats["full"] += 1
+        # The upstream bytes are spliced in rather than re-serialized
+        encoded = b'{"version":"' + version.encode() + b'","full":true,"data":' + body + b"}"
+    sync_stats["bytes_full"] += len(body)
+    sync_stats["bytes_sent"] += len(encoded)
+    headers = {"content-type": "application/json; charset=utf-8", "cache-control": "no-store", SYNC_VERSION_HEADER: version}
+    return await buffered_response(request, 200, headers, encoded)
+
+@app.api_route("/api/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE","OPTIONS","HEAD"])
+async def proxy(path: str, request: Request):
+    rejected = authenticate(request, path)
+    if rejected is not None:
+        return rejected
+    ttl = cache_ttl(path) if request.method == "GET" else None
+    key = cache_key(request, path) if request.method == "GET" else None
+    generation = cache_generation(path) if ttl is not None else None
+    entry = cache_get(key) if ttl is not None else None
+    if entry is not None:
+        now = time.monotonic()
+        if now <= entry["expires"]:
+            return await cached_response(request, entry, "HIT")
+        if now <= entry["stale_until"]:
+            cache_stats["stale_served"] += 1
+            revalidate(key, request, path, ttl, generation)
+            return await cached_response(request, entry, "STALE")
+
+    bucket, rejected = await admit(request, path)
+    if rejected is not None:
+        return rejected
+    try:
+        if key is not None and coalescable(request, path):
+            result = await coalesced_fetch(key, request, path)
+        else:
+            result = await fetch_upstream(request, path)
+    finally:
+        release(bucket)
+    if entry is not None and upstream_failed(result) and time.monotonic() <= entry["error_until"]:
+        cache_stats["stale_if_error"] += 1
+        if not isinstance(result, tuple) and result.background is not None:
+            await result.background()
+        return await cached_response(request, entry, "STALE")
+    if not isinstance(result, tuple):
+        return result
+
+    status_code, resp_headers, body = result
+    resp_headers = store_response(request, key, path, ttl, generation, status_code, resp_headers, body)
+    if request.method == "GET" and status_code == 200:
+        if etag_matches(request.headers.get("if-none-match", ""), resp_headers["etag"]):
+            return not_modified(request, resp_headers, len(body))
+    return await buffered_response(request, status_code, resp_headers, body)
+
+def store_response(
+    request: Request, key, path: str, ttl, generation: int, status_code: int, resp_headers, body: bytes,
+):
+    resp_headers = copy_headers(resp_headers)
+    if request.method == "GET" and status_code == 200:
+        resp_headers["etag"] = etag_for(body)
+    if ttl is not None and cacheable(status_code, resp_headers) and generation == cache_generation(path):
+        cache_put(key, path, ttl, status_code, resp_headers, body)
+        resp_headers["x-proxy-cache"] = "MISS"
+    return resp_headers
+
+async def cached_response(request: Request, entry, state: str):
+    headers = {**entry["headers"], "x-proxy-cache": state}
+    if etag_matches(request.headers.get("if-none-match", ""), entry["etag"]):
+        return not_modified(request, headers, len(entry["body"]))
+    return await buffered_response(request, entry["status_code"], headers, entry["body"])
+
+def upstream_failed(result):
+    status_code = result[0] if isinstance(result, tuple) else result.status_code
+    return status_code >= 500
+
+def revalidate(key, request: Request, path: str, ttl: float, generation: int):
+    """Refreshes a stale entry in the background; concurrent misses coalesce onto the same fetch"""
+    if (key, generation) in inflight_requests:
+        return
+
+    async def refresh():
+        if coalescable(request, path):
+            result = await coalesced_fetch(key, request, path)
+        else:
+            result = await fetch_upstream(request, path)
+        if isinstance(result, tuple) and not upstream_failed(result):
+            store_response(request, key, path, ttl, generation, *result)
+        elif result is not None and not isinstance(result, tuple) and result.background is not None:
+            await result.background()
+
+    cache_stats["revalidations"] += 1
+    task = asyncio.create_task(refresh())
+    revalidation_tasks.add(task)
+    task.add_done_callback(revalidation_tasks.discard)
+
+async def relay_websocket(websocket: WebSocket, upstream):
+    last_activity = time.monotonic()
+
+    async def client_to_upstream():
+        nonlocal last_activity
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                data = message.get("text")
+                if data is None:
+                    data = message.get("bytes") or b""
+                if len(data) > WS_MAX_MESSAGE_SIZE:
+                    ws_stats["oversized_closed"] += 1
+                    return 1009
+                last_activity = time.monotonic()
+                ws_stats["messages_up"] += 1
+                await upstream.send(data)
+        except (WebSocketDisconnect, websockets.ConnectionClosed):
+            return
+
+    async def upstream_to_client():
+        nonlocal last_activity
+        try:
+            async for data in upstream:
+                last_activity = time.monotonic()
+                ws_stats["messages_down"] += 1
+                if isinstance(data, str):
+                    await websocket.send_text(data)
+                else:
+                    await websocket.send_bytes(data)
+        except (WebSocketDisconnect, websockets.ConnectionClosed):
+            return
+
+    async def idle_watchdog():
+        while True:
+            remaining = last_activity + WS_IDLE_TIMEOUT - time.monotonic()
+            if remaining <= 0:
+                ws_stats["idle_closed"] += 1
+                return 1001
+            await asyncio.sleep(remaining)
+
+    tasks = [asyncio.create_task(c()) for c in (client_to_upstream, upstream_to_client, idle_watchdog)]
+    # Whichever side finishes first (disconnect, upstream close, idle) tears down the pair
+    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return next(iter(done)).result() or 1000
+
+@app.websocket("/api/socket.io/")
+async def socketio_relay(websocket: WebSocket):
+    if ws_stats["active"] >= WS_MAX_CONNECTIONS:
+        ws_stats["rejected"] += 1
+        await websocket.close(code=1013)
+        return
+    worker = pick_worker(websocket.query_params.get("sid"))
+    if worker is None:
+        resilience_stats["fast_failed"] += 1
+        await websocket.close(code=1013)
+        return
+    url = f"{worker['ws_url']}/socket.io/?{websocket.url.query}"
+    headers = [(k, v) for k, v in websocket.headers.items() if k in WS_FORWARDED_HEADERS]
+    try:
+        transport = {"unix": True, "path": node_socket_path(worker["port"])} if NODE_TRANSPORT == "uds" else {}
+        upstream = await websockets_connect(
+            url,
+            **transport,
+            additional_headers=headers,
+            max_size=WS_MAX_MESSAGE_SIZE,
+            max_queue=WS_MAX_QUEUE,
+            ping_interval=WS_PING_INTERVAL,
+            ping_timeout=WS_PING_INTERVAL,
+            open_timeout=5,
+            compression=None,
+            proxy=None,
         )
-    excluded = {"content-encoding", "content-length", "transfer-encoding"}
-    resp_headers = {k: v for k, v in resp.headers.items() if k.lower() not in excluded}
-    return Response(content=resp.content, status_code=resp.status_code, headers=resp_headers)
+    except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake):
+        ws_stats["upstream_failures"] += 1
+        record_upstream_failure(worker)
+        await websocket.close(code=1011)
+        return
+    close_breaker(worker)
+
+    await websocket.accept()
+    ws_stats["total"] += 1
+    ws_stats["active"] += 1
+    ws_stats["peak_active"] = max(ws_stats["peak_active"], ws_stats["active"])
+    close_code = 1000
+    try:
+        close_code = await relay_websocket(websocket, upstream)
+    finally:
+        ws_stats["active"] -= 1
+        await upstream.close()
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close(code=close_code)
 
 @app.get("/api")
 async def api_root():
@@ -67,3 +2780,57 @@ async def api_root():
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.post("/proxy/rolling-restart")
+async def proxy_rolling_restart(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not PROXY_ADMIN_TOKEN or not hmac.compare_digest(token, PROXY_ADMIN_TOKEN):
+        return JSONResponse({"message": "Forbidden"}, status_code=403)
+    if not is_supervisor() and (state := read_node_state()):
+        # Another proxy process owns the Node children; SIGHUP is its rolling-restart trigger
+        os.kill(state["leader_pid"], signal.SIGHUP)
+        return JSONResponse({"message": "Rolling restart requested", "generation": state["generation"] + 1}, status_code=202)
+    if not start_rolling_restart():
+        return JSONResponse({"message": "Rolling restart already in progress"}, status_code=409)
+    return JSONResponse({"message": "Rolling restart started", "generation": node_generation + 1}, status_code=202)
+
+@app.get("/proxy/stats")
+async def proxy_stats():
+    workers = [
+        {k: w[k] for k in ("index", "port", "healthy", "outstanding", "streams", "restarts", "startup_seconds", "breaker")}
+        for w in node_workers
+    ]
+    return {
+        "upstream_pool": pool_stats(),
+        "websockets": dict(ws_stats),
+        "node_workers": workers,
+        "node_generation": node_generation,
+        "supervisor": {
+            **supervisor_stats,
+            "role": "supervisor" if is_supervisor() else "follower",
+            "followers": len(live_followers()) if is_supervisor() else None,
+        },
+        "rolling_restart": {**restart_stats, "in_progress": rolling_restart_lock.locked()},
+        "node_logs": dict(log_stats),
+        "socketio_sessions": len(socketio_sessions),
+        "response_cache": {**cache_stats, "entries": len(response_cache)},
+        "etags": dict(etag_stats),
+        "coalescing": {**coalesce_stats, "in_flight": len(inflight_requests)},
+        "batch": dict(batch_stats),
+        "sync": {**sync_stats, "snapshots": len(sync_snapshots), "snapshot_bytes": sync_bytes},
+        "notifications": {**notify_stats, "users": len(notify_subscribers), "polling": notify_poller_task is not None},
+        "compression": {**compression_stats, "encodings": list(compressors())},
+        "uploads": {**upload_stats, "open_files": len(upload_files)},
+        "tracing": {**trace_stats, "enabled": tracing_enabled()},
+        "auth": {**auth_stats, "enabled": bool(AUTH_JWT_SECRET), "cached": len(auth_cache)},
+        "resilience": {**resilience_stats, "retry_budget": round(retry_budget, 2)},
+        "admission": {
+            **admission_stats,
+            "in_flight": sum(b["in_flight"] for b in admission_buckets.values()),
+            "waiting": sum(b["waiting"] for b in admission_buckets.values()),
+        },
+    }
@@ -0,0 +1,1667 @@
+"""
+ForaTask API proxy tests - exercise backend/server.py against a stubbed Node upstream
+- Pooled upstream client and timeout classes
+- Streaming request/response bodies
+- socket.io WebSocket relay
+- Node worker pool balancing, stickiness and restarts
+- Launch modes and readiness probing
+- Tenant-aware response cache
+- Synthesized ETags and 304s
+- Response compression
+- Single-flight coalescing of concurrent GETs
+- /uploads served from disk
+- Per-route metrics and /metrics
+- Request IDs, trace context propagation and span export
+- Proxy-side JWT verification and forwarded identity
+- Per-tenant rate limits and admission control
+- Circuit breakers, retry budget and hedged reads
+- Stale-while-revalidate and stale-if-error
+- Rolling restarts with drain
+- Node log pump
+- /api/batch fan-out
+- Raw ASGI fast path and multi-valued headers
+- Unix domain socket transport to Node
+- Node supervisor election across proxy processes
+- Server-Sent Events notification stream
+- /api/sync JSON Patch deltas
+"""
+import asyncio
+import gzip
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    """Stub Node backend; tests append handlers to `routes` keyed by path"""
+    calls = []
+    routes = {}
+
+    def handler(request):
+        calls.append(request)
+        route = routes.get(request.url.path)
+        if route:
+            return route(request)
+        return httpx.Response(200, json={"path": request.url.path})
+
+    # Never pick up the state file of a proxy actually running on this machine
+    monkeypatch.setattr(server, "NODE_STATE_FILE", str(tmp_path / "workers.json"))
+    server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    server.node_workers[:] = [server.make_node_worker(0)]
+    yield {"calls": calls, "routes": routes}
+    server.upstream_client = None
+    server.node_workers.clear()
+    server.socketio_sessions.clear()
+    server.response_cache.clear()
+    server.cache_stats["bytes"] = 0
+    server.auth_cache.clear()
+    server.admission_buckets.clear()
+
+
+@pytest.fixture
+def client(upstream):
+    """Proxy client without lifespan, so no Node process is spawned"""
+    return TestClient(server.app)
+
+
+class TestUpstreamPool:
+    """Shared upstream client and pool metrics"""
+
+    def test_proxy_reuses_shared_client(self, client, upstream):
+        shared = server.upstream_client
+        for _ in range(3):
+            resp = client.get("/api/task/getTaskList")
+            assert resp.status_code == 200
+        assert server.upstream_client is shared
+        assert len(upstream["calls"]) == 3
+
+    def test_timeout_classes(self):
+        assert server.timeout_for("reports/admin-report-summary", "") is server.TIMEOUT_CLASSES["report"]
+        assert server.timeout_for("chat/rooms/1/messages", "multipart/form-data; boundary=x") is server.TIMEOUT_CLASSES["upload"]
+        assert server.timeout_for("task/getTaskList", "") is server.TIMEOUT_CLASSES["default"]
+
+    def test_pool_stats_endpoint(self, client):
+        client.get("/api/me/usersList")
+        stats = client.get("/proxy/stats").json()["upstream_pool"]
+        assert stats["in_flight"] == 0
+        assert stats["requests"] >= 1
+        assert stats["max_connections"] == server.UPSTREAM_MAX_CONNECTIONS
+
+
+class TestStreaming:
+    """Large bodies are streamed, small JSON takes the buffered path"""
+
+    def test_small_json_is_buffered(self, client):
+        before = server.upstream_stats["streamed_responses"]
+        resp = client.get("/api/organization-settings")
+        assert resp.json() == {"path": "/organization-settings"}
+        assert server.upstream_stats["streamed_responses"] == before
+
+    def test_large_download_is_streamed(self, client, upstream):
+        payload = b"x" * (server.PROXY_BUFFER_THRESHOLD + 1)
+        upstream["routes"]["/master-admin/companies"] = lambda r: httpx.Response(
+            200, content=payload, headers={"content-type": "application/octet-stream"})
+        before = server.upstream_stats["streamed_responses"]
+        resp = client.get("/api/master-admin/companies")
+        assert resp.content == payload
+        assert server.upstream_stats["streamed_responses"] == before + 1
+
+    def test_large_upload_is_streamed(self, client, upstream):
+        payload = b"y" * (server.PROXY_BUFFER_THRESHOLD + 1)
+        upstream["routes"]["/task/add-task"] = lambda r: httpx.Response(201, json={"size": len(r.read())})
+        before = server.upstream_stats["streamed_requests"]
+        resp = client.post("/api/task/add-task", content=payload,
+                           headers={"content-type": "multipart/form-data; boundary=b"})
+        assert resp.status_code == 201
+        assert resp.json() == {"size": len(payload)}
+        assert server.upstream_stats["streamed_requests"] == before + 1
+
+
+class FakeUpstreamSocket:
+    """Stands in for the Node socket.io connection: echoes every frame back"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.sent = []
+        self.closed = False
+
+    async def send(self, data):
+        self.sent.append(data)
+        await self.queue.put(data)
+
+    async def close(self):
+        self.closed = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+class TestWebSocketRelay:
+    """socket.io WebSocket pass-through"""
+
+    @pytest.fixture
+    def fake_upstream(self, monkeypatch):
+        sockets = []
+
+        async def connect(url, **kwargs):
+            sock = FakeUpstreamSocket()
+            sock.url = url
+            sockets.append(sock)
+            return sock
+
+        monkeypatch.setattr(server, "websockets_connect", connect)
+        return sockets
+
+    def test_frames_are_relayed_both_ways(self, client, fake_upstream):
+        with client.websocket_connect("/api/socket.io/?EIO=4&transport=websocket") as ws:
+            ws.send_text('42["joinChatRoom","room1"]')
+            assert ws.receive_text() == '42["joinChatRoom","room1"]'
+            assert server.ws_stats["active"] == 1
+        assert fake_upstream[0].url.endswith("/socket.io/?EIO=4&transport=websocket")
+        assert fake_upstream[0].closed
+        assert server.ws_stats["active"] == 0
+
+    def test_oversized_frame_closes_connection(self, client, fake_upstream, monkeypatch):
+        monkeypatch.setattr(server, "WS_MAX_MESSAGE_SIZE", 8)
+        with client.websocket_connect("/api/socket.io/?EIO=4&transport=websocket") as ws:
+            ws.send_text("x" * 64)
+            message = ws.receive()
+        assert message["type"] == "websocket.close"
+        assert message["code"] == 1009
+        assert fake_upstream[0].sent == []
+
+    def test_connection_cap(self, client, fake_upstream, monkeypatch):
+        monkeypatch.setattr(server, "WS_MAX_CONNECTIONS", 0)
+        before = server.ws_stats["rejected"]
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect("/api/socket.io/?EIO=4&transport=websocket"):
+                pass
+        assert server.ws_stats["rejected"] == before + 1
+        assert fake_upstream == []
+
+
+class FakeProcess:
+    def __init__(self, returncode=None):
+        self.pid = 424242
+        self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+
+class TestNodeWorkerPool:
+    """Least-outstanding balancing, socket.io stickiness and crash restarts"""
+
+    def test_least_outstanding_worker_is_picked(self):
+        workers = [server.make_node_worker(i) for i in range(3)]
+        workers[0]["outstanding"] = 4
+        workers[1]["outstanding"] = 1
+        workers[2]["outstanding"] = 2
+        server.node_workers[:] = workers
+        try:
+            assert server.pick_worker() is workers[1]
+            workers[1]["healthy"] = False
+            workers[2]["healthy"] = True
+            assert server.pick_worker() is workers[2]
+        finally:
+            server.node_workers.clear()
+
+    def test_worker_count_auto(self, monkeypatch):
+        monkeypatch.setattr(server, "NODE_WORKERS", "auto")
+        assert server.worker_count() == (os.cpu_count() or 1)
+        monkeypatch.setattr(server, "NODE_WORKERS", "3")
+        assert server.worker_count() == 3
+
+    def test_socketio_handshake_is_sticky(self, client, upstream):
+        second = server.make_node_worker(1)
+        server.node_workers.append(second)
+        server.node_workers[0]["outstanding"] = 10
+        upstream["routes"]["/socket.io/"] = lambda r: httpx.Response(
+            200, content=b'0{"sid":"abc123","pingInterval":25000}', headers={"content-type": "text/plain"})
+        client.get("/api/socket.io/?EIO=4&transport=polling")
+        assert upstream["calls"][-1].url.port == second["port"]
+        assert server.socketio_sessions["abc123"][0] == 1
+        server.node_workers[0]["outstanding"] = 0
+        client.get("/api/socket.io/?EIO=4&transport=polling&sid=abc123")
+        assert upstream["calls"][-1].url.port == second["port"]
+
+    def test_exited_worker_is_restarted(self, monkeypatch):
+        worker = server.make_node_worker(0)
+        worker["process"] = FakeProcess(returncode=1)
+        spawned = []
+        monkeypatch.setattr(server, "kill_node_worker", lambda w: w.update(process=None))
+        monkeypatch.setattr(server, "spawn_node_worker", spawned.append)
+        asyncio.run(server.check_node_worker(worker))
+        assert spawned == [worker]
+        assert worker["restarts"] == 1
+
+    def test_crons_restarted_after_a_reload_without_them(self, upstream):
+        worker = server.node_workers[0]
+        worker.update(process=FakeProcess(), crons=True)
+        upstream["routes"]["/health"] = lambda r: httpx.Response(200, json={"status": "ok", "cronsRunning": False})
+        asyncio.run(server.check_node_worker(worker))
+        start = upstream["calls"][-1]
+        assert (start.method, start.url.path) == ("POST", "/internal/crons/start")
+        assert worker["crons_running"]
+        upstream["routes"]["/health"] = lambda r: httpx.Response(200, json={"status": "ok", "cronsRunning": True})
+        asyncio.run(server.check_node_worker(worker))
+        assert upstream["calls"][-1].url.path == "/health"
+
+
+class TestLaunchMode:
+    """Production launch without nodemon, gated on /health"""
+
+    def test_node_command_per_mode(self, monkeypatch):
+        monkeypatch.setattr(server, "NODE_LAUNCH_MODE", "production")
+        assert server.node_command() == ["node", "server.js"]
+        monkeypatch.setattr(server, "NODE_LAUNCH_MODE", "dev")
+        assert server.node_command()[:2] == ["npx", "nodemon"]
+
+    def test_wait_until_ready_polls_health(self, upstream):
+        probes = []
+
+        def health(request):
+            probes.append(request)
+            return httpx.Response(200 if len(probes) >= 3 else 503, json={"status": "ok"})
+
+        upstream["routes"]["/health"] = health
+        worker = server.node_workers[0]
+        worker["process"] = FakeProcess()
+        worker["started_at"] = server.time.monotonic()
+        assert asyncio.run(server.wait_until_ready(worker)) is True
+        assert len(probes) == 3
+        assert worker["healthy"] and worker["startup_seconds"] is not None
+
+    def test_wait_until_ready_gives_up_when_process_exits(self, upstream):
+        worker = server.node_workers[0]
+        worker["process"] = FakeProcess(returncode=1)
+        worker["started_at"] = server.time.monotonic()
+        assert asyncio.run(server.wait_until_ready(worker)) is False
+        assert not worker["healthy"]
+
+
+def make_token(user_id, company, secret="test-secret-for-foratask-proxy-tests"):
+    import jwt
+    return jwt.encode({"id": user_id, "company": company, "role": "admin"}, secret, algorithm="HS256")
+
+
+class TestResponseCache:
+    """TTL/LRU cache for hot dashboard GETs"""
+
+    def test_repeat_get_is_served_from_cache(self, client, upstream):
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        first = client.get("/api/stats/tasks-summary", headers=headers)
+        second = client.get("/api/stats/tasks-summary", headers=headers)
+        assert first.headers["x-proxy-cache"] == "MISS"
+        assert second.headers["x-proxy-cache"] == "HIT"
+        assert second.json() == first.json()
+        assert len(upstream["calls"]) == 1
+
+    def test_cache_is_keyed_per_identity(self, client, upstream):
+        client.get("/api/stats/tasks-summary", headers={"Authorization": f"Bearer {make_token('u1', 'c1')}"})
+        client.get("/api/stats/tasks-summary", headers={"Authorization": f"Bearer {make_token('u2', 'c1')}"})
+        forged = make_token("u1", "c1", secret="forged-secret-for-foratask-proxy-tests")
+        client.get("/api/stats/tasks-summary", headers={"Authorization": f"Bearer {forged}"})
+        assert len(upstream["calls"]) == 3
+
+    def test_uncached_routes_always_hit_upstream(self, client, upstream):
+        client.get("/api/task/getTaskList")
+        client.get("/api/task/getTaskList")
+        assert len(upstream["calls"]) == 2
+
+    def test_mutation_invalidates_dependent_resources(self, client, upstream):
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        client.get("/api/stats/tasks-summary", headers=headers)
+        client.post("/api/task/add-task", json={"taskName": "x"}, headers=headers)
+        resp = client.get("/api/stats/tasks-summary", headers=headers)
+        assert resp.headers["x-proxy-cache"] == "MISS"
+        assert len(upstream["calls"]) == 3
+
+    def test_get_racing_a_mutation_is_not_cached(self, upstream):
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+
+        async def handler(request):
+            if request.method == "GET":
+                await asyncio.sleep(0.1)
+            return httpx.Response(200, json={"path": request.url.path})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as ac:
+                read = asyncio.create_task(ac.get("/api/stats/tasks-summary", headers=headers))
+                await asyncio.sleep(0.02)
+                await ac.post("/api/task/add-task", json={"taskName": "x"}, headers=headers)
+                return await read
+
+        resp = asyncio.run(run())
+        assert resp.status_code == 200
+        assert "x-proxy-cache" not in resp.headers
+        assert server.response_cache == {}
+
+    def test_invalidation_by_another_process_is_seen(self, client, upstream, tmp_path, monkeypatch):
+        monkeypatch.setattr(server, "NODE_SOCKET_DIR", str(tmp_path))
+        monkeypatch.setattr(server, "shared_cache_epochs", True)
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        client.get("/api/stats/tasks-summary", headers=headers)
+        assert client.get("/api/stats/tasks-summary", headers=headers).headers["x-proxy-cache"] == "HIT"
+        # What another proxy process's invalidate_cache("task/add-task") leaves behind
+        server.publish_cache_epoch("stats")
+        assert client.get("/api/stats/tasks-summary", headers=headers).headers["x-proxy-cache"] == "MISS"
+        assert len(upstream["calls"]) == 2
+
+    def test_notification_writes_invalidate_stats(self, client, upstream):
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        client.get("/api/stats/tasks-summary", headers=headers)
+        client.patch("/api/notifications/markAllRead", headers=headers)
+        assert client.get("/api/stats/tasks-summary", headers=headers).headers["x-proxy-cache"] == "MISS"
+
+    def test_byte_bound_evicts_least_recently_used(self, monkeypatch):
+        monkeypatch.setattr(server, "PROXY_CACHE_MAX_BYTES", 250)
+        server.cache_put("a", "stats/a", 60, 200, {}, b"a" * 100)
+        server.cache_put("b", "stats/b", 60, 200, {}, b"b" * 100)
+        assert server.cache_get("a") is not None
+        server.cache_put("c", "stats/c", 60, 200, {}, b"c" * 100)
+        assert list(server.response_cache) == ["a", "c"]
+        assert server.cache_stats["bytes"] == 200
+
+
+class TestConditionalGet:
+    """Strong ETags computed by the proxy"""
+
+    def test_matching_if_none_match_gets_304(self, client, upstream):
+        first = client.get("/api/task/getTaskList")
+        etag = first.headers["etag"]
+        assert etag.startswith('"')
+        second = client.get("/api/task/getTaskList", headers={"If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.content == b""
+        assert second.headers["etag"] == etag
+
+    def test_changed_body_gets_full_response(self, client, upstream):
+        etag = client.get("/api/chat/rooms").headers["etag"]
+        upstream["routes"]["/chat/rooms"] = lambda r: httpx.Response(200, json={"rooms": [1]})
+        resp = client.get("/api/chat/rooms", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.json() == {"rooms": [1]}
+        assert resp.headers["etag"] != etag
+
+    def test_cached_entry_answers_304_without_upstream(self, client, upstream):
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        etag = client.get("/api/stats/todaysTasks", headers=headers).headers["etag"]
+        resp = client.get("/api/stats/todaysTasks", headers={**headers, "If-None-Match": f'W/{etag}'})
+        assert resp.status_code == 304
+        assert resp.headers["x-proxy-cache"] == "HIT"
+        assert len(upstream["calls"]) == 1
+
+
+class TestCompression:
+    """Accept-Encoding negotiation"""
+
+    @pytest.fixture
+    def big_json(self, upstream):
+        payload = {"tasks": [{"id": i, "taskName": f"Task {i}"} for i in range(200)]}
+        upstream["routes"]["/task/getTaskList"] = lambda r: httpx.Response(200, json=payload)
+        return payload
+
+    def test_gzip_when_accepted(self, client, big_json):
+        resp = client.get("/api/task/getTaskList", headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["vary"]
+        assert resp.json() == big_json
+        assert resp.headers["etag"].endswith('-gzip"')
+
+    def test_identity_when_not_accepted(self, client, big_json):
+        resp = client.get("/api/task/getTaskList", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in resp.headers
+
+    def test_small_and_binary_bodies_are_not_compressed(self, client, upstream):
+        upstream["routes"]["/me/avatar"] = lambda r: httpx.Response(
+            200, content=b"\x89PNG" + b"0" * 4096, headers={"content-type": "image/png"})
+        assert "content-encoding" not in client.get("/api/me/avatar").headers
+        assert "content-encoding" not in client.get("/api/me/userinfo").headers
+
+    def test_encoded_etag_revalidates(self, client, big_json):
+        etag = client.get("/api/task/getTaskList", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+        resp = client.get("/api/task/getTaskList", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.headers["etag"] == etag
+
+    def test_streamed_json_is_compressed_in_chunks(self, client, upstream):
+        rows = b"[" + b",".join(b'{"id":%d}' % i for i in range(60000)) + b"]"
+        assert len(rows) > server.PROXY_BUFFER_THRESHOLD
+        upstream["routes"]["/salary/payroll"] = lambda r: httpx.Response(
+            200, content=rows, headers={"content-type": "application/json"})
+        before = server.compression_stats["offloaded"]
+        with client.stream("GET", "/api/salary/payroll", headers={"Accept-Encoding": "gzip"}) as resp:
+            raw = b"".join(resp.iter_raw())
+        assert resp.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(raw) == rows
+        assert len(raw) < len(rows)
+        assert server.compression_stats["offloaded"] > before
+
+    @staticmethod
+    def decode(encoding, raw):
+        if encoding == "br":
+            return server.brotli.decompress(raw)
+        return server.zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+
+    @pytest.mark.parametrize("encoding", ["br", "zstd"])
+    def test_buffered_round_trip(self, client, big_json, encoding):
+        with client.stream("GET", "/api/task/getTaskList", headers={"Accept-Encoding": encoding}) as resp:
+            raw = b"".join(resp.iter_raw())
+        assert resp.headers["content-encoding"] == encoding
+        assert json.loads(self.decode(encoding, raw)) == big_json
+
+    @pytest.mark.parametrize("encoding", ["br", "zstd"])
+    def test_streamed_round_trip(self, client, upstream, encoding):
+        rows = b"[" + b",".join(b'{"id":%d}' % i for i in range(60000)) + b"]"
+        upstream["routes"]["/salary/payroll"] = lambda r: httpx.Response(
+            200, content=rows, headers={"content-type": "application/json"})
+        with client.stream("GET", "/api/salary/payroll", headers={"Accept-Encoding": encoding}) as resp:
+            raw = b"".join(resp.iter_raw())
+        assert resp.headers["content-encoding"] == encoding
+        assert self.decode(encoding, raw) == rows
+        assert len(raw) < len(rows)
+
+    def test_streamed_etag_revalidates_at_node(self, client, upstream):
+        rows = b"[" + b",".join(b'{"id":%d}' % i for i in range(60000)) + b"]"
+
+        def payroll(request):
+            if request.headers.get("if-none-match") == 'W/"abc"':
+                return httpx.Response(304, headers={"etag": 'W/"abc"'})
+            return httpx.Response(200, content=rows, headers={"content-type": "application/json", "etag": 'W/"abc"'})
+
+        upstream["routes"]["/salary/payroll"] = payroll
+        headers = {"Accept-Encoding": "gzip"}
+        with client.stream("GET", "/api/salary/payroll", headers=headers) as resp:
+            etag = resp.headers["etag"]
+        assert etag == 'W/"abc-gzip"'
+        resp = client.get("/api/salary/payroll", headers={**headers, "If-None-Match": etag})
+        assert resp.status_code == 304
+        assert upstream["calls"][-1].headers["if-none-match"] == 'W/"abc"'
+
+
+class TestCoalescing:
+    """Concurrent identical GETs share one upstream call"""
+
+    @pytest.fixture
+    def slow_upstream(self, upstream):
+        calls = []
+
+        async def handler(request):
+            calls.append(request.url.path)
+            call = len(calls)
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"path": request.url.path, "call": call})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return calls
+
+    def run_concurrently(self, requests):
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as ac:
+                return await asyncio.gather(*(ac.get(url, headers=headers) for url, headers in requests))
+        return asyncio.run(run())
+
+    def test_identical_gets_share_one_call(self, slow_upstream):
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        before = server.coalesce_stats["coalesced"]
+        responses = self.run_concurrently([("/api/attendance/daily", headers)] * 5)
+        assert slow_upstream == ["/attendance/daily"]
+        assert all(r.json() == responses[0].json() for r in responses)
+        assert server.coalesce_stats["coalesced"] == before + 4
+        assert server.inflight_requests == {}
+
+    def test_different_identities_are_not_shared(self, slow_upstream):
+        responses = self.run_concurrently([
+            ("/api/attendance/daily", {"Authorization": f"Bearer {make_token('u1', 'c1')}"}),
+            ("/api/attendance/daily", {"Authorization": f"Bearer {make_token('u2', 'c1')}"}),
+        ])
+        assert len(slow_upstream) == 2
+        assert {r.json()["call"] for r in responses} == {1, 2}
+
+    def test_conditional_and_range_gets_are_not_shared(self, slow_upstream):
+        auth = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        responses = self.run_concurrently([
+            ("/api/attendance/daily", auth),
+            ("/api/attendance/daily", {**auth, "Range": "bytes=0-9"}),
+            ("/api/attendance/daily", {**auth, "If-None-Match": '"abc"'}),
+        ])
+        assert len(slow_upstream) == 3
+        assert {r.json()["call"] for r in responses} == {1, 2, 3}
+
+
+class TestUploads:
+    """Static uploads served by the proxy with ranges and validators"""
+
+    @pytest.fixture
+    def uploads(self, tmp_path, monkeypatch, upstream):
+        (tmp_path / "avatars").mkdir()
+        data = bytes(range(256)) * 16
+        (tmp_path / "avatars" / "rajvi-1700000000000.png").write_bytes(data)
+        monkeypatch.setattr(server, "UPLOADS_DIR", str(tmp_path.resolve()))
+        yield data
+        for path in list(server.upload_files):
+            server.retire_upload_file(path)
+
+    def test_file_is_served_without_upstream(self, client, upstream, uploads):
+        resp = client.get("/api/uploads/avatars/rajvi-1700000000000.png")
+        assert resp.status_code == 200
+        assert resp.content == uploads
+        assert resp.headers["content-type"] == "image/png"
+        assert "immutable" in resp.headers["cache-control"]
+        assert upstream["calls"] == []
+
+    def test_range_request(self, client, uploads):
+        resp = client.get("/api/uploads/avatars/rajvi-1700000000000.png", headers={"Range": "bytes=10-19"})
+        assert resp.status_code == 206
+        assert resp.content == uploads[10:20]
+        assert resp.headers["content-range"] == f"bytes 10-19/{len(uploads)}"
+        suffix = client.get("/api/uploads/avatars/rajvi-1700000000000.png", headers={"Range": "bytes=-5"})
+        assert suffix.content == uploads[-5:]
+        bad = client.get("/api/uploads/avatars/rajvi-1700000000000.png", headers={"Range": "bytes=99999-"})
+        assert bad.status_code == 416
+
+    def test_conditional_request_and_fd_reuse(self, client, uploads):
+        etag = client.get("/api/uploads/avatars/rajvi-1700000000000.png").headers["etag"]
+        resp = client.get("/api/uploads/avatars/rajvi-1700000000000.png", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        hits = server.upload_stats["fd_hits"]
+        client.get("/api/uploads/avatars/rajvi-1700000000000.png")
+        assert server.upload_stats["fd_hits"] == hits + 1
+        assert all(entry["users"] == 0 for entry in server.upload_files.values())
+
+    def test_missing_and_escaping_paths_are_404(self, client, uploads):
+        assert client.get("/api/uploads/avatars/missing.png").status_code == 404
+        assert client.get("/api/uploads/..%2F..%2Fetc%2Fpasswd").status_code == 404
+        assert client.get("/api/uploads/a%00b.png").status_code == 404
+
+    def test_deleted_file_releases_cached_fd(self, client, uploads, tmp_path):
+        client.get("/api/uploads/avatars/rajvi-1700000000000.png")
+        (tmp_path / "avatars" / "rajvi-1700000000000.png").unlink()
+        assert client.get("/api/uploads/avatars/rajvi-1700000000000.png").status_code == 404
+        assert server.upload_files == {}
+
+
+class TestMetrics:
+    """Route templates, histograms and the Prometheus endpoint"""
+
+    def test_route_templates(self):
+        assert server.route_template("task/64f1c2a9e4b0a1b2c3d4e5f6") == "/task/:id"
+        assert server.route_template("task/search") == "/task/search"
+        assert server.route_template("salary/records/64f1c2a9e4b0a1b2c3d4e5f6") == "/salary/records/:userId"
+        assert server.route_template("salary/records/r1/pay") == "/salary/records/:recordId/pay"
+        assert server.route_template("uploads/avatars/a-1.png") == "/uploads/*"
+
+    def test_unknown_routes_share_one_label(self, client, upstream):
+        for path in ("scan1", "scan2/x", 'a"b/x'):
+            assert server.route_template(path) == "/other"
+        client.get("/api/scan3/x")
+        assert 'route="/other"' in client.get("/metrics").text
+
+    def test_label_values_are_escaped(self):
+        labels = (("company", 'a"b\\c\nd'),)
+        assert server.format_labels(labels) == '{company="a\\"b\\\\c\\nd"}'
+
+    def test_metrics_endpoint_reports_route_histograms(self, client, upstream):
+        client.get("/api/task/64f1c2a9e4b0a1b2c3d4e5f6")
+        resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain")
+        text = resp.text
+        assert 'foratask_proxy_requests_total{method="GET",route="/task/:id",status="200"}' in text
+        assert 'foratask_proxy_upstream_duration_seconds_count{method="GET",route="/task/:id"}' in text
+        assert 'foratask_proxy_response_bytes_bucket{method="GET",route="/task/:id",le="+Inf"}' in text
+        assert "foratask_proxy_upstream_requests" in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        labels = (("method", "GET"), ("route", "/test/histogram"))
+        for value in (0.002, 0.02, 3.0):
+            server.observe("foratask_proxy_request_duration_seconds", labels, value, server.SECONDS_BUCKETS)
+        text = server.render_metrics()
+        assert 'foratask_proxy_request_duration_seconds_bucket{method="GET",route="/test/histogram",le="0.0025"} 1' in text
+        assert 'foratask_proxy_request_duration_seconds_bucket{method="GET",route="/test/histogram",le="0.025"} 2' in text
+        assert 'foratask_proxy_request_duration_seconds_bucket{method="GET",route="/test/histogram",le="+Inf"} 3' in text
+
+
+class TestTracing:
+    """Request IDs, traceparent propagation and the span exporter"""
+
+    def test_request_id_generated_and_forwarded(self, client, upstream):
+        resp = client.get("/api/task/getTaskList")
+        request_id = resp.headers["x-request-id"]
+        assert request_id
+        sent = upstream["calls"][-1].headers
+        assert sent["x-request-id"] == request_id
+        assert server.parse_traceparent(sent["traceparent"])
+
+    def test_incoming_trace_context_is_continued(self, client, upstream):
+        trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        resp = client.get(
+            "/api/task/getTaskList",
+            headers={"x-request-id": "req-123", "traceparent": f"00-{trace_id}-{parent_id}-00"},
+        )
+        assert resp.headers["x-request-id"] == "req-123"
+        forwarded_trace, span_id, sampled = server.parse_traceparent(upstream["calls"][-1].headers["traceparent"])
+        assert forwarded_trace == trace_id
+        assert span_id != parent_id
+        assert not sampled
+
+    def test_malformed_traceparent_is_ignored(self):
+        assert server.parse_traceparent("00-xyz-00f067aa0ba902b7-01") is None
+        assert server.parse_traceparent("00-" + "0" * 32 + "-00f067aa0ba902b7-01") is None
+
+    def test_sampled_span_written_to_file(self, upstream, tmp_path, monkeypatch):
+        trace_file = tmp_path / "spans.jsonl"
+        monkeypatch.setattr(server, "PROXY_TRACE_FILE", str(trace_file))
+
+        async def run():
+            await server.start_trace_exporter()
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as proxy:
+                await proxy.post("/api/task/create", json={"title": "x"})
+            await server.stop_trace_exporter()
+
+        try:
+            asyncio.run(run())
+        finally:
+            server.trace_queue = server.trace_exporter_task = None
+        span = json.loads(trace_file.read_text().splitlines()[-1])
+        assert span["name"] == "POST " + server.route_template("task/create")
+        assert span["status"] == 200
+        assert span["bytes_in"] > 0
+        assert set(span["phases_ms"]) == {
+            "client_body_read", "upstream_connect", "upstream_ttfb", "upstream_body", "client_write",
+        }
+        assert server.parse_traceparent(upstream["calls"][-1].headers["traceparent"])[2]
+
+    def test_unix_socket_connect_is_reported(self, monkeypatch):
+        monkeypatch.setattr(server, "trace_queue", asyncio.Queue())
+        trace = server.start_trace({"headers": []})
+        trace["marks"].update({"connection.connect_unix_socket.started": 1.0, "connection.connect_unix_socket.complete": 1.25})
+        server.finish_trace(trace, "GET", "/task", 200, 0.5, 0, 0)
+        assert server.trace_queue.get_nowait()["phases_ms"]["upstream_connect"] == 250.0
+
+    def test_otlp_payload_shape(self):
+        span = {
+            "trace_id": "4bf92f3577b34da6a3ce929d0e0e4736", "span_id": "00f067aa0ba902b7", "parent_span_id": None,
+            "request_id": "r", "name": "GET /task/:id", "method": "GET", "route": "/task/:id", "status": 200,
+            "start_unix_nano": 1, "duration_ms": 2.0, "bytes_in": 0, "bytes_out": 10, "phases_ms": {"upstream_ttfb": 1.5},
+        }
+        otlp = server.otlp_payload([span])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        assert otlp["traceId"] == span["trace_id"]
+        assert otlp["endTimeUnixNano"] == str(1 + 2_000_000)
+
+
+class TestAuth:
+    """JWTs are verified at the proxy; Node receives the trusted claims"""
+
+    @pytest.fixture(autouse=True)
+    def jwt_secret(self, monkeypatch):
+        monkeypatch.setattr(server, "AUTH_JWT_SECRET", "test-secret-for-foratask-proxy-tests")
+
+    def test_invalid_token_rejected_without_upstream_call(self, client, upstream):
+        forged = make_token("u1", "c1", secret="forged-secret-for-foratask-proxy-tests")
+        resp = client.get("/api/task/getTaskList", headers={"Authorization": f"Bearer {forged}"})
+        assert resp.status_code == 401
+        assert resp.json() == {"message": "Invalid token"}
+        resp = client.get("/api/me")
+        assert resp.json() == {"message": "No token, authorization denied"}
+        assert upstream["calls"] == []
+
+    def test_expired_token_rejected(self, client, upstream):
+        import jwt
+        expired = jwt.encode({"id": "u1", "exp": 1}, server.AUTH_JWT_SECRET, algorithm="HS256")
+        resp = client.get("/api/me", headers={"Authorization": f"Bearer {expired}"})
+        assert resp.status_code == 401
+
+    def test_public_routes_skip_verification(self, client, upstream):
+        resp = client.post("/api/auth/login", json={"email": "a@b.c"})
+        assert resp.status_code == 200
+        assert len(upstream["calls"]) == 1
+
+    def test_cors_preflight_reaches_node(self, client, upstream):
+        resp = client.options("/api/task/getTaskList", headers={
+            "Origin": "https://admin.example.com", "Access-Control-Request-Method": "GET",
+        })
+        assert resp.status_code == 200
+        assert upstream["calls"][-1].method == "OPTIONS"
+
+    def test_claims_forwarded_and_cached(self, client, upstream):
+        import base64
+        headers = {
+            "Authorization": f"Bearer {make_token('u1', 'c1')}",
+            "x-forwarded-claims": "spoofed",
+            "x-proxy-identity": "spoofed",
+        }
+        client.get("/api/task/getTaskList", headers=headers)
+        client.get("/api/me", headers=headers)
+        sent = upstream["calls"][-1].headers
+        assert sent["x-proxy-identity"] == server.PROXY_IDENTITY_SECRET
+        claims = json.loads(base64.urlsafe_b64decode(sent["x-forwarded-claims"]))
+        assert claims == {"id": "u1", "company": "c1", "role": "admin"}
+        assert server.auth_stats["cache_hits"] >= 1
+        assert len(server.auth_cache) == 1
+
+
+class TestAdmission:
+    """Token buckets and in-flight caps per company and route class"""
+
+    @pytest.fixture(autouse=True)
+    def verified_tenants(self, monkeypatch):
+        monkeypatch.setattr(server, "AUTH_JWT_SECRET", "test-secret-for-foratask-proxy-tests")
+
+    def run_posts(self, requests):
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as ac:
+                return await asyncio.gather(*(ac.post(url, headers=headers) for url, headers in requests))
+        return asyncio.run(run())
+
+    @pytest.fixture
+    def slow_upstream(self, upstream):
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"path": request.url.path})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_no_admission_without_verified_tenants(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(server, "AUTH_JWT_SECRET", "")
+        monkeypatch.setitem(server.ADMISSION_LIMITS, "report", [0.1, 1, 10])
+        headers = {"Authorization": "Bearer unverified"}
+        statuses = [client.post("/api/salary/generate/u1", headers=headers).status_code for _ in range(3)]
+        assert statuses == [200, 200, 200]
+        assert server.admission_buckets == {}
+
+    def test_public_routes_are_not_admitted_per_address(self, client, upstream, monkeypatch):
+        monkeypatch.setitem(server.ADMISSION_LIMITS, "default", [0.1, 1, 10])
+        statuses = [client.post("/api/auth/login", json={}).status_code for _ in range(3)]
+        assert statuses == [200, 200, 200]
+        assert server.admission_buckets == {}
+
+    def test_companyless_tokens_get_a_bounded_label(self, client, upstream, monkeypatch):
+        monkeypatch.setitem(server.ADMISSION_LIMITS, "report", [0.1, 1, 10])
+        monkeypatch.setattr(server, "ADMISSION_MAX_WAIT", 0.01)
+        headers = {"Authorization": f"Bearer {make_token('u1', None)}"}
+        statuses = [client.post("/api/salary/generate/u1", headers=headers).status_code for _ in range(2)]
+        assert statuses == [200, 429]
+        metrics = server.render_metrics()
+        assert 'foratask_proxy_throttled_total{company="anonymous",class="report",reason="rate"}' in metrics
+        assert "ip:" not in metrics
+
+    def test_rate_limit_returns_429_with_retry_after(self, client, upstream, monkeypatch):
+        monkeypatch.setitem(server.ADMISSION_LIMITS, "report", [0.1, 2, 10])
+        monkeypatch.setattr(server, "ADMISSION_MAX_WAIT", 0.1)
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        statuses = [client.post("/api/salary/generate/u1", headers=headers).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        resp = client.post("/api/salary/generate/u1", headers=headers)
+        assert int(resp.headers["retry-after"]) >= 1
+        assert len(upstream["calls"]) == 2
+        assert 'foratask_proxy_throttled_total{company="c1",class="report",reason="rate"}' in server.render_metrics()
+
+    def test_tenants_have_separate_buckets(self, client, upstream, monkeypatch):
+        monkeypatch.setitem(server.ADMISSION_LIMITS, "report", [0.1, 1, 10])
+        monkeypatch.setattr(server, "ADMISSION_MAX_WAIT", 0.1)
+        noisy = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        quiet = {"Authorization": f"Bearer {make_token('u2', 'c2')}"}
+        assert client.post("/api/salary/generate/u1", headers=noisy).status_code == 200
+        assert client.post("/api/salary/generate/u1", headers=noisy).status_code == 429
+        assert client.post("/api/salary/generate/u2", headers=quiet).status_code == 200
+
+    def test_in_flight_cap_queues_then_rejects(self, slow_upstream, monkeypatch):
+        monkeypatch.setitem(server.ADMISSION_LIMITS, "report", [100, 100, 1])
+        headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+        monkeypatch.setattr(server, "ADMISSION_MAX_WAIT", 1.0)
+        responses = self.run_posts([("/api/salary/generate/u1", headers)] * 3)
+        assert [r.status_code for r in responses] == [200, 200, 200]
+        monkeypatch.setattr(server, "ADMISSION_MAX_WAIT", 0.01)
+        responses = self.run_posts([("/api/salary/generate/u1", headers)] * 2)
+        assert sorted(r.status_code for r in responses) == [200, 429]
+        assert all(b["in_flight"] == 0 for b in server.admission_buckets.values())
+
+
+class TestResilience:
+    """Per-worker circuit breakers, budgeted retries and hedged GETs"""
+
+    @pytest.fixture(autouse=True)
+    def full_budget(self, monkeypatch):
+        monkeypatch.setattr(server, "retry_budget", server.RETRY_BUDGET_MAX)
+
+    def test_breaker_opens_and_fails_fast(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(server, "BREAKER_FAILURES", 2)
+        upstream["routes"]["/task/getTaskList"] = lambda r: httpx.Response(503, json={})
+        for _ in range(2):
+            client.post("/api/task/getTaskList")
+        assert server.node_workers[0]["breaker"] == "open"
+        calls = len(upstream["calls"])
+        resp = client.post("/api/task/getTaskList")
+        assert resp.status_code == 503
+        assert int(resp.headers["retry-after"]) >= 1
+        assert len(upstream["calls"]) == calls
+
+    def test_half_open_probe_closes_breaker(self, client, upstream, monkeypatch):
+        worker = server.node_workers[0]
+        worker.update(breaker="open", breaker_opened_at=time.monotonic() - server.BREAKER_COOLDOWN)
+        assert client.get("/api/me").status_code == 200
+        assert worker["breaker"] == "closed"
+
+    def test_get_retried_on_another_worker(self, client, upstream):
+        second = server.make_node_worker(1)
+        server.node_workers.append(second)
+        failing_port = server.node_workers[0]["port"]
+
+        def handler(request):
+            if request.url.port == failing_port:
+                raise httpx.ConnectError("connection refused")
+            return httpx.Response(200, json={"port": request.url.port})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        resp = client.get("/api/me")
+        assert resp.json() == {"port": second["port"]}
+        assert server.resilience_stats["retries"] >= 1
+
+    def test_mutations_are_not_retried(self, client, upstream):
+        server.node_workers.append(server.make_node_worker(1))
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            raise httpx.ConnectError("connection refused")
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        assert client.post("/api/task/add-task", json={}).status_code == 502
+        assert len(attempts) == 1
+
+    def test_socketio_polls_are_not_retried_off_their_worker(self, client, upstream, monkeypatch):
+        server.node_workers.append(server.make_node_worker(1))
+        monkeypatch.setitem(server.socketio_sessions, "abc", (0, time.monotonic()))
+        attempts = []
+
+        def handler(request):
+            attempts.append(request.url.port)
+            raise httpx.ConnectError("connection refused")
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        assert client.get("/api/socket.io/?EIO=4&transport=polling&sid=abc").status_code == 502
+        assert attempts == [server.node_workers[0]["port"]]
+
+    def test_retry_budget_exhaustion_stops_retries(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(server, "retry_budget", 0.0)
+        monkeypatch.setattr(server, "RETRY_BUDGET_RATIO", 0.0)
+        server.node_workers.append(server.make_node_worker(1))
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            raise httpx.ConnectError("connection refused")
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        assert client.get("/api/me").status_code == 502
+        assert len(attempts) == 1
+
+    def test_exhausted_budget_does_not_strand_a_half_open_probe(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(server, "retry_budget", 0.0)
+        monkeypatch.setattr(server, "RETRY_BUDGET_RATIO", 0.0)
+        first = server.node_workers[0]
+        second = server.make_node_worker(1)
+        first["healthy"] = True
+        second.update(breaker="open", breaker_opened_at=time.monotonic() - server.BREAKER_COOLDOWN, outstanding=5, healthy=True)
+        server.node_workers.append(second)
+
+        def handler(request):
+            if request.url.port == first["port"]:
+                raise httpx.ConnectError("connection refused")
+            return httpx.Response(200, json={"port": request.url.port})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        assert client.get("/api/me").status_code == 502
+        assert not second["breaker_probing"]
+        assert client.get("/api/me").json() == {"port": second["port"]}
+        assert second["breaker"] == "closed"
+
+    def test_slow_get_is_hedged_to_another_worker(self, upstream, monkeypatch):
+        monkeypatch.setattr(server, "metric_histograms", {})
+        second = server.make_node_worker(1)
+        server.node_workers.append(second)
+        first_port = server.node_workers[0]["port"]
+        labels = (("method", "GET"), ("route", server.route_template("me")))
+        for _ in range(server.HEDGE_MIN_SAMPLES):
+            server.observe("foratask_proxy_upstream_duration_seconds", labels, 0.01, server.SECONDS_BUCKETS)
+
+        async def handler(request):
+            if request.url.port == first_port:
+                await asyncio.sleep(1)
+            return httpx.Response(200, json={"port": request.url.port})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as ac:
+                return await ac.get("/api/me")
+
+        started = time.monotonic()
+        resp = asyncio.run(run())
+        assert resp.json() == {"port": second["port"]}
+        assert time.monotonic() - started < 0.5
+        assert server.resilience_stats["hedge_wins"] >= 1
+
+
+class TestStaleServing:
+    """Expired cache entries keep Node restarts and slowdowns invisible to clients"""
+
+    headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+
+    def expire(self, **offsets):
+        (entry,) = server.response_cache.values()
+        now = time.monotonic()
+        entry["expires"] = now - 1
+        for field, offset in offsets.items():
+            entry[field] = now + offset
+
+    def test_stale_entry_served_while_refreshing(self, client, upstream):
+        versions = iter(range(1, 10))
+        upstream["routes"]["/organization-settings/"] = lambda r: httpx.Response(200, json={"v": next(versions)})
+        client.get("/api/organization-settings/", headers=self.headers)
+        self.expire()
+        resp = client.get("/api/organization-settings/", headers=self.headers)
+        assert resp.headers["x-proxy-cache"] == "STALE"
+        assert resp.json() == {"v": 1}
+        resp = client.get("/api/organization-settings/", headers=self.headers)
+        assert resp.headers["x-proxy-cache"] == "HIT"
+        assert resp.json() == {"v": 2}
+        assert server.cache_stats["revalidations"] >= 1
+
+    def test_stale_if_error_when_node_is_down(self, client, upstream):
+        client.get("/api/stats/tasks-summary", headers=self.headers)
+        self.expire(stale_until=-1)
+
+        def down(request):
+            raise httpx.ConnectError("connection refused")
+
+        upstream["routes"]["/stats/tasks-summary"] = down
+        resp = client.get("/api/stats/tasks-summary", headers=self.headers)
+        assert resp.status_code == 200
+        assert resp.headers["x-proxy-cache"] == "STALE"
+        assert resp.json() == {"path": "/stats/tasks-summary"}
+
+    def test_staleness_is_bounded(self, client, upstream):
+        client.get("/api/stats/tasks-summary", headers=self.headers)
+        self.expire(stale_until=-1, error_until=-1)
+        upstream["routes"]["/stats/tasks-summary"] = lambda r: httpx.Response(503, json={})
+        assert client.get("/api/stats/tasks-summary", headers=self.headers).status_code == 503
+
+    def test_routes_without_window_are_never_stale(self, client, upstream):
+        client.get("/api/reports/admin-report-summary", headers=self.headers)
+        (entry,) = server.response_cache.values()
+        assert entry["retain_until"] == entry["expires"]
+
+
+class TestRollingRestart:
+    """New Node generation, atomic switch, drain of the old one"""
+
+    @pytest.fixture
+    def fake_processes(self, upstream, monkeypatch):
+        killed = []
+        ready = {"ok": True}
+
+        async def wait_until_ready(worker):
+            worker["healthy"] = ready["ok"]
+            return ready["ok"]
+
+        monkeypatch.setattr(server, "spawn_node_worker", lambda w: w.update(process=FakeProcess()))
+        monkeypatch.setattr(server, "kill_node_worker", lambda w: killed.append(w) or w.update(process=None))
+        monkeypatch.setattr(server, "wait_until_ready", wait_until_ready)
+        monkeypatch.setattr(server, "node_generation", 0)
+        return {"killed": killed, "ready": ready}
+
+    def test_traffic_switches_to_new_generation(self, client, upstream, fake_processes):
+        old = server.node_workers[0]
+        server.socketio_sessions["abc"] = (0, time.monotonic())
+        assert asyncio.run(server.rolling_restart())
+        (fresh,) = server.node_workers
+        assert fresh["generation"] == 1
+        assert fresh["port"] == old["port"] + server.NODE_PORT_STRIDE
+        assert fake_processes["killed"] == [old]
+        assert old["retired"]
+        assert server.socketio_sessions == {}
+        client.get("/api/me")
+        assert upstream["calls"][-1].url.port == fresh["port"]
+
+    def test_in_flight_requests_are_drained(self, upstream, fake_processes, monkeypatch):
+        monkeypatch.setattr(server, "NODE_DRAIN_TIMEOUT", 1.0)
+        old = server.node_workers[0]
+        old["outstanding"] = 1
+
+        async def run():
+            restart = asyncio.create_task(server.rolling_restart())
+            await asyncio.sleep(0.1)
+            assert fake_processes["killed"] == []
+            old["outstanding"] = 0
+            return await restart
+
+        assert asyncio.run(run())
+        assert fake_processes["killed"] == [old]
+
+    def test_drain_deadline_counts_dropped_requests(self, upstream, fake_processes, monkeypatch):
+        monkeypatch.setattr(server, "NODE_DRAIN_TIMEOUT", 0.05)
+        server.node_workers[0]["streams"] = 2
+        before = server.restart_stats["dropped_requests"]
+        assert asyncio.run(server.rolling_restart())
+        assert server.restart_stats["dropped_requests"] == before + 2
+
+    def test_crons_move_to_the_new_generation_after_the_old_one_exits(self, upstream, fake_processes, monkeypatch):
+        monkeypatch.setattr(server, "spawn_node_worker", lambda w: w.update(process=FakeProcess(), crons=False))
+        old = server.node_workers[0]
+        old.update(process=FakeProcess(returncode=0), crons=True)
+        assert asyncio.run(server.rolling_restart())
+        (fresh,) = server.node_workers
+        start = upstream["calls"][-1]
+        assert (start.method, start.url.path, start.url.port) == ("POST", "/internal/crons/start", fresh["port"])
+        assert start.headers[server.INTERNAL_SECRET_HEADER] == server.PROXY_IDENTITY_SECRET
+        assert fresh["crons"]
+
+    def test_new_worker_skips_crons_while_another_runs_them(self, upstream, monkeypatch):
+        envs = []
+
+        class Popen:
+            def __init__(self, command, env, **kwargs):
+                envs.append(env)
+                self.pid, self.stdout = 424242, None
+
+        async def no_pump(worker, pipe):
+            pass
+
+        monkeypatch.setattr(server.subprocess, "Popen", Popen)
+        monkeypatch.setattr(server, "pump_node_logs", no_pump)
+        server.node_workers[0].update(process=FakeProcess(), crons=True)
+
+        async def run():
+            server.spawn_node_worker(server.make_node_worker(0, generation=1))
+            server.node_workers[0]["process"] = None
+            server.spawn_node_worker(server.make_node_worker(0, generation=1))
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        assert [env["RUN_CRONS"] for env in envs] == ["false", "true"]
+
+    def test_unready_generation_is_discarded(self, upstream, fake_processes):
+        old = server.node_workers[0]
+        fake_processes["ready"]["ok"] = False
+        assert not asyncio.run(server.rolling_restart())
+        assert server.node_workers == [old]
+        assert fake_processes["killed"][0]["generation"] == 1
+        assert server.transitional_workers == []
+
+    def test_admin_endpoint_requires_token(self, client, upstream, monkeypatch):
+        started = []
+        monkeypatch.setattr(server, "start_rolling_restart", lambda: started.append(1) or True)
+        assert client.post("/proxy/rolling-restart").status_code == 403
+        monkeypatch.setattr(server, "PROXY_ADMIN_TOKEN", "admin-token")
+        assert client.post("/proxy/rolling-restart", headers={"x-admin-token": "wrong"}).status_code == 403
+        assert client.post("/proxy/rolling-restart", headers={"x-admin-token": "admin-token"}).status_code == 202
+        assert started == [1]
+
+
+class TestNodeLogPump:
+    """Node output is drained continuously into a rotating, rate-limited log"""
+
+    def run_child(self, script):
+        async def run():
+            proc = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            worker = server.make_node_worker(0)
+            await asyncio.wait_for(server.pump_node_logs(worker, proc.stdout), timeout=10)
+            return proc.wait(timeout=5)
+        return asyncio.run(run())
+
+    @pytest.fixture
+    def log_file(self, tmp_path, monkeypatch):
+        path = tmp_path / "node.log"
+        monkeypatch.setattr(server, "NODE_LOG_FILE", str(path))
+        server.start_node_logging()
+        yield path
+        server.stop_node_logging()
+
+    def test_output_larger_than_pipe_buffer_is_drained(self, log_file, monkeypatch):
+        monkeypatch.setattr(server, "NODE_LOG_BURST", 100000)
+        assert self.run_child("for i in range(20000): print('socket connected', i)") == 0
+        server.stop_node_logging()
+        lines = log_file.read_text().splitlines()
+        assert lines[0].endswith("node[0.0] socket connected 0")
+        assert len(lines) == 20000
+
+    def test_rate_limit_suppresses_and_reports(self, log_file, monkeypatch):
+        monkeypatch.setattr(server, "NODE_LOG_RATE", 0.001)
+        monkeypatch.setattr(server, "NODE_LOG_BURST", 5)
+        before = server.log_stats["suppressed"]
+        assert self.run_child("for i in range(1000): print('registered', i)") == 0
+        server.stop_node_logging()
+        assert len(log_file.read_text().splitlines()) == 5
+        assert server.log_stats["suppressed"] == before + 995
+
+    def test_overlong_lines_are_dropped(self, log_file, monkeypatch):
+        monkeypatch.setattr(server, "NODE_LOG_LINE_LIMIT", 1024)
+        before = server.log_stats["truncated"]
+        assert self.run_child("print('x' * 5000); print('after')") == 0
+        server.stop_node_logging()
+        assert log_file.read_text().splitlines()[-1].endswith("after")
+        assert server.log_stats["truncated"] == before + 1
+
+
+class TestBatch:
+    """Dashboard fan-out in one request"""
+
+    headers = {"Authorization": f"Bearer {make_token('u1', 'c1')}"}
+
+    def test_malformed_item_headers_fail_only_that_item(self, client, upstream):
+        resp = client.post("/api/batch", headers=self.headers, json={"requests": [
+            {"path": "/stats/tasks-summary", "headers": ["if-none-match"]},
+            {"path": "/stats/tasks-summary", "headers": {"if-none-match": '"caf\u00e9\u2603"'}},
+            {"path": "/attendance/today"},
+        ]})
+        assert resp.status_code == 200
+        assert [r["status"] for r in resp.json()["responses"]] == [400, 400, 200]
+
+    def test_chunked_batch_request(self, client, upstream):
+        body = json.dumps({"requests": [{"path": "/stats/tasks-summary"}]}).encode()
+        resp = client.post("/api/batch", headers=self.headers, content=iter([body[:10], body[10:]]))
+        assert resp.status_code == 200
+        assert resp.json()["responses"][0]["status"] == 200
+        assert "transfer-encoding" not in upstream["calls"][-1].headers
+
+    def test_items_are_answered_in_order(self, client, upstream):
+        upstream["routes"]["/notifications/unreadCount"] = lambda r: httpx.Response(404, json={"message": "nope"})
+        resp = client.post("/api/batch", headers=self.headers, json={"requests": [
+            {"path": "/stats/tasks-summary"},
+            {"path": "/notifications/unreadCount?since=1"},
+            {"path": "/attendance/today"},
+        ]})
+        assert resp.status_code == 200
+        items = resp.json()["responses"]
+        assert [i["status"] for i in items] == [200, 404, 200]
+        assert items[0]["body"] == {"path": "/stats/tasks-summary"}
+        assert items[0]["headers"]["x-proxy-cache"] == "MISS"
+        assert items[1]["body"] == {"message": "nope"}
+        sent = {c.url.path: c for c in upstream["calls"]}
+        assert sent["/notifications/unreadCount"].url.query == b"since=1"
+        assert sent["/attendance/today"].headers["authorization"] == self.headers["Authorization"]
+
+    def test_items_run_concurrently(self, upstream):
+        async def handler(request):
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json={"path": request.url.path})
+
+        server.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as ac:
+                return await ac.post("/api/batch", headers=self.headers, json={"requests": [
+                    {"path": f"/stats/{name}"} for name in ("tasks-summary", "todaysTasks", "statisticsGraph")
+                ]})
+
+        started = time.monotonic()
+        resp = asyncio.run(run())
+        assert [i["status"] for i in resp.json()["responses"]] == [200, 200, 200]
+        assert time.monotonic() - started < 0.5
+
+    def test_batch_size_is_capped(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(server, "PROXY_BATCH_MAX_ITEMS", 2)
+        resp = client.post("/api/batch", headers=self.headers, json={"requests": [{"path": "/me/userinfo"}] * 3})
+        assert resp.status_code == 413
+        assert upstream["calls"] == []
+
+    def test_invalid_items_fail_individually(self, client, upstream):
+        resp = client.post("/api/batch", headers=self.headers, json={"requests": [
+            {"path": "/task/add-task", "method": "POST"},
+            {"path": "/batch"},
+            {"path": "/me/userinfo"},
+        ]})
+        assert [i["status"] for i in resp.json()["responses"]] == [400, 400, 200]
+        assert client.post("/api/batch", json=[1, 2]).status_code == 400
+
+    def test_auth_is_checked_once_before_fan_out(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(server, "AUTH_JWT_SECRET", "test-secret-for-foratask-proxy-tests")
+        resp = client.post("/api/batch", json={"requests": [{"path": "/me/userinfo"}]})
+        assert resp.status_code == 401
+        assert upstream["calls"] == []
+        resp = client.post("/api/batch", headers=self.headers, json={"requests": [{"path": "/me/userinfo"}]})
+        assert resp.json()["responses"][0]["status"] == 200
+
+
+class TestFastPath:
+    """/api served from the ASGI layer with raw header lists and query strings"""
+
+    @pytest.fixture(params=[True, False], ids=["fast_path", "api_route"])
+    def fast_path(self, request, monkeypatch):
+        monkeypatch.setattr(server, "PROXY_FAST_PATH", request.param)
+        return request.param
+
+    def test_repeated_set_cookie_headers_survive(self, client, upstream, fast_path):
+        upstream["routes"]["/auth/login"] = lambda r: httpx.Response(
+            200,
+            headers=[("set-cookie", "token=abc; HttpOnly"), ("set-cookie", "theme=dark"), ("content-type", "application/json")],
+            content=b'{"ok":true}' * 200,
+        )
+        resp = client.post("/api/auth/login", json={}, headers={"accept-encoding": "gzip"})
+        assert resp.headers.get_list("set-cookie") == ["token=abc; HttpOnly", "theme=dark"]
+        assert resp.headers["content-encoding"] == "gzip"
+
+    def test_raw_query_and_repeated_headers_are_forwarded(self, client, upstream, fast_path):
+        client.get("/api/task/getTaskList?status=open&status=done&q=a%20b", headers=[("x-tag", "1"), ("x-tag", "2")])
+        sent = upstream["calls"][-1]
+        assert sent.url.query == b"status=open&status=done&q=a%20b"
+        assert sent.headers.get_list("x-tag") == ["1", "2"]
+
+    def test_upstream_client_keeps_no_cookies(self):
+        client = server.create_upstream_client()
+        client.cookies.extract_cookies(httpx.Response(
+            200, headers={"set-cookie": "token=abc; Path=/"}, request=httpx.Request("GET", "http://127.0.0.1:3333/auth/login"),
+        ))
+        assert list(client.cookies.jar) == []
+
+    def test_routed_paths_fall_through_to_fastapi(self):
+        assert server.routed_in_app({"path": "/api/uploads/a.png", "method": "GET"})
+        assert server.routed_in_app({"path": "/api/batch", "method": "POST"})
+        assert not server.routed_in_app({"path": "/api/uploads/a.png", "method": "POST"})
+        assert not server.routed_in_app({"path": "/api/task/getTaskList", "method": "GET"})
+
+
+class TestUnixSocketTransport:
+    """Node on a Unix socket, reached through per-port mounts on the upstream client"""
+
+    @pytest.fixture
+    def uds_mode(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(server, "NODE_TRANSPORT", "uds")
+        monkeypatch.setattr(server, "NODE_SOCKET_DIR", str(tmp_path))
+
+    def test_worker_urls_are_routed_to_their_socket(self, uds_mode):
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\ncontent-length: 12\r\n\r\n{\"uds\":true}")
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            unix_server = await asyncio.start_unix_server(handle, server.node_socket_path(server.NODE_BACKEND_PORT))
+            async with unix_server, server.create_upstream_client() as client:
+                return await client.get(f"{server.make_node_worker(0)['url']}/health")
+
+        resp = asyncio.run(run())
+        assert resp.json() == {"uds": True}
+
+    def test_every_generation_port_has_a_mount(self, uds_mode, monkeypatch):
+        monkeypatch.setattr(server, "NODE_WORKERS", "2")
+        ports = server.node_ports()
+        assert server.make_node_worker(1, generation=1)["port"] in ports
+        assert len(ports) == 4
+
+    def test_spawn_passes_socket_path(self, uds_mode, monkeypatch):
+        envs = []
+
+        class Popen:
+            def __init__(self, command, env, **kwargs):
+                envs.append(env)
+                self.pid, self.stdout = 424242, None
+
+        async def no_pump(worker, pipe):
+            pass
+
+        monkeypatch.setattr(server.subprocess, "Popen", Popen)
+        monkeypatch.setattr(server, "pump_node_logs", no_pump)
+
+        async def run():
+            server.spawn_node_worker(server.make_node_worker(0))
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        assert envs[0]["SOCKET_PATH"] == server.node_socket_path(server.NODE_BACKEND_PORT)
+
+    def test_tcp_mode_has_no_mounts(self, monkeypatch):
+        monkeypatch.setattr(server, "NODE_TRANSPORT", "tcp")
+        assert server.create_upstream_client()._mounts == {}
+
+
+class TestSupervisorElection:
+    """One proxy process owns the Node children; the others follow its state file"""
+
+    @pytest.fixture
+    def socket_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(server, "NODE_SOCKET_DIR", str(tmp_path))
+        monkeypatch.setattr(server, "NODE_SUPERVISOR_LOCK", str(tmp_path / "supervisor.lock"))
+        monkeypatch.setattr(server, "NODE_STATE_FILE", str(tmp_path / "workers.json"))
+        yield tmp_path
+        server.release_supervisor_lock()
+
+    def test_only_one_process_holds_the_lock(self, socket_dir):
+        script = (
+            "import fcntl, os, sys; fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT); "
+            "fcntl.flock(fd, fcntl.LOCK_EX); print('locked', flush=True); sys.stdin.read()"
+        )
+        other = subprocess.Popen(
+            [sys.executable, "-c", script, server.NODE_SUPERVISOR_LOCK],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        try:
+            assert other.stdout.readline() == b"locked\n"
+            assert not server.acquire_supervisor_lock()
+        finally:
+            other.stdin.close()
+            other.wait()
+        assert server.acquire_supervisor_lock()
+        assert server.is_supervisor()
+
+    def test_state_file_round_trip(self, upstream, socket_dir, monkeypatch):
+        monkeypatch.setattr(server, "node_generation", 1)
+        server.node_workers[:] = [server.make_node_worker(0, generation=1)]
+        server.node_workers[0].update(process=FakeProcess(), healthy=True)
+        server.write_node_state()
+        assert server.read_node_state() is None  # only the lock holder publishes
+        assert server.acquire_supervisor_lock()
+        server.write_node_state()
+        state = server.read_node_state()
+        assert state["leader_pid"] == os.getpid()
+        assert state["workers"] == [
+            {"index": 0, "generation": 1, "pid": FakeProcess().pid, "healthy": True, "crons": False},
+        ]
+        assert state["identity_secret"] == server.PROXY_IDENTITY_SECRET
+        assert os.stat(server.NODE_STATE_FILE).st_mode & 0o077 == 0
+
+    def test_follower_forwards_the_supervisors_identity_secret(self, upstream, monkeypatch):
+        monkeypatch.setattr(server, "PROXY_IDENTITY_SECRET", "mine")
+        server.sync_node_workers({"identity_secret": "supervisor", "workers": []})
+        assert server.identity_headers({"id": "u1"})[server.IDENTITY_SECRET_HEADER] == "supervisor"
+
+    def test_follower_syncs_workers(self, upstream):
+        kept = server.node_workers[0]
+        kept["outstanding"] = 3
+        server.sync_node_workers({"workers": [
+            {"index": 0, "generation": 0, "pid": 1, "healthy": True},
+            {"index": 1, "generation": 0, "pid": 2, "healthy": False},
+        ]})
+        assert server.node_workers[0] is kept and kept["outstanding"] == 3 and kept["healthy"]
+        assert not server.node_workers[1]["healthy"]
+        server.sync_node_workers({"workers": [{"index": 0, "generation": 1, "pid": 3, "healthy": True}]})
+        (fresh,) = server.node_workers
+        assert fresh["generation"] == 1
+        assert kept["retired"]
+
+    def test_adopts_only_running_children(self, upstream, monkeypatch):
+        monkeypatch.setattr(server, "node_generation", 0)
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        assert not server.adopt_node_workers({"generation": 2, "workers": [
+            {"index": 0, "generation": 2, "pid": dead.pid, "healthy": True},
+        ]})
+        assert server.adopt_node_workers({"generation": 2, "workers": [
+            {"index": 0, "generation": 2, "pid": os.getpid(), "healthy": True},
+        ]})
+        (worker,) = server.node_workers
+        assert worker["process"].pid == os.getpid() and worker["process"].poll() is None
+        assert server.node_generation == 2
+
+    def test_follower_forwards_rolling_restart_to_supervisor(self, client, upstream, socket_dir, monkeypatch):
+        signals = []
+        monkeypatch.setattr(server, "PROXY_ADMIN_TOKEN", "admin-token")
+        monkeypatch.setattr(server.os, "kill", lambda pid, sig: signals.append((pid, sig)))
+        with open(server.NODE_STATE_FILE, "w") as f:
+            json.dump({"leader_pid": 4242, "generation": 3, "workers": []}, f)
+        resp = client.post("/proxy/rolling-restart", headers={"x-admin-token": "admin-token"})
+        assert resp.status_code == 202
+        assert resp.json()["generation"] == 4
+        assert signals == [(4242, server.signal.SIGHUP)]
+
+    def test_heartbeats_identify_live_followers(self, socket_dir, monkeypatch):
+        (socket_dir / "proxy-111.alive").touch()
+        stale = socket_dir / "proxy-222.alive"
+        stale.touch()
+        os.utime(stale, (time.time() - 60, time.time() - 60))
+        (socket_dir / f"proxy-{os.getpid()}.alive").touch()
+        assert server.live_followers() == [111]
+        assert not stale.exists()
+
+    def test_follower_reports_requests_open_on_retired_workers(self, upstream, socket_dir, monkeypatch):
+        monkeypatch.setattr(server, "transitional_workers", [])
+        kept = server.node_workers[0]
+        kept["outstanding"] = 2
+        server.sync_node_workers({"generation": 1, "workers": [{"index": 0, "generation": 1, "pid": 3, "healthy": True}]})
+        server.write_heartbeat()
+        assert server.read_heartbeat(os.getpid()) == {"generation": 1, "inflight": [[0, 0, 2]]}
+        kept["outstanding"] = 0
+        server.write_heartbeat()
+        assert server.read_heartbeat(os.getpid()) == {"generation": 1, "inflight": []}
+        assert server.transitional_workers == []
+
+    def test_rolling_restart_waits_for_followers(self, socket_dir, monkeypatch):
+        monkeypatch.setattr(server, "node_generation", 1)
+        monkeypatch.setattr(server, "NODE_STATE_INTERVAL", 0.04)
+        old = server.make_node_worker(0, generation=0)
+        beat = socket_dir / "proxy-111.alive"
+        beat.write_text(json.dumps({"generation": 0, "inflight": []}))
+        started = time.monotonic()
+        asyncio.run(server.drain_followers([old], started + 0.05))
+        assert time.monotonic() - started >= 0.05  # not switched yet
+        beat.write_text(json.dumps({"generation": 1, "inflight": [[0, 0, 3]]}))
+        assert asyncio.run(server.drain_followers([old], time.monotonic() + 0.05)) == 3
+
+        async def run():
+            drain = asyncio.create_task(server.drain_followers([old], time.monotonic() + 5))
+            await asyncio.sleep(0.05)
+            assert not drain.done()
+            beat.write_text(json.dumps({"generation": 1, "inflight": []}))
+            return await drain
+
+        assert asyncio.run(run()) == 0
+
+
+class TestNotificationStream:
+    """SSE stream per user, fed by one shared poll of Node's notification feed"""
+
+    @pytest.fixture
+    def stream(self, upstream, monkeypatch):
+        monkeypatch.setattr(server, "ensure_notification_poller", lambda: None)
+        upstream["routes"]["/notifications/unreadCount"] = lambda request: httpx.Response(200, json={"count": 2})
+        yield upstream
+        server.notify_subscribers.clear()
+        server.notify_replay.clear()
+
+    @staticmethod
+    async def open_stream(user="u1", last_event_id=None):
+        headers = [(b"authorization", f"Bearer {make_token(user, 'c1')}".encode())]
+        if last_event_id:
+            headers.append((b"last-event-id", last_event_id.encode()))
+        scope = {
+            "type": "http", "method": "GET", "path": "/api/notifications/stream", "query_string": b"",
+            "headers": headers, "client": ("10.0.0.1", 50000), "state": {},
+        }
+        return await server.notification_stream(server.Request(scope))
+
+    @staticmethod
+    async def read_events(response, count):
+        events = []
+        async for chunk in response.body_iterator:
+            events.append(chunk.decode())
+            if len(events) == count:
+                break
+        await response.body_iterator.aclose()
+        return events
+
+    def test_unread_count_then_published_notifications(self, stream):
+        async def run():
+            response = await self.open_stream()
+            assert response.media_type == "text/event-stream"
+            events = response.body_iterator
+            assert (await events.__anext__()).startswith(b"retry: ")
+            assert await events.__anext__() == b'event: unread\ndata: {"count":2}\n\n'
+            assert len(server.notify_subscribers["u1"]) == 1
+            server.publish_notification({"_id": "n1", "userId": "u1", "message": "Task is Overdue!"})
+            server.publish_notification({"_id": "n2", "userId": "u2", "message": "not for u1"})
+            chunk = await events.__anext__()
+            await events.aclose()
+            return chunk
+
+        chunk = asyncio.run(run())
+        assert chunk.startswith(b"event: notification\nid: n1\ndata: ")
+        assert json.loads(chunk.split(b"data: ")[1])["message"] == "Task is Overdue!"
+        assert server.notify_subscribers == {}
+
+    def test_last_event_id_replays_missed_events(self, stream):
+        async def run():
+            await self.read_events(await self.open_stream(), 2)
+            for note_id in ("n1", "n2", "n3"):
+                server.publish_notification({"_id": note_id, "userId": "u1", "message": note_id})
+            resumed = await self.read_events(await self.open_stream(last_event_id="n1"), 3)
+            unknown = await self.read_events(await self.open_stream(last_event_id="gone"), 3)
+            return resumed, unknown
+
+        resumed, unknown = asyncio.run(run())
+        assert [e.split("\n")[1] for e in resumed[1:]] == ["id: n2", "id: n3"]
+        assert unknown[1].startswith("event: resync")
+        assert unknown[2].startswith("event: unread")
+
+    def test_upstream_rejection_is_returned(self, stream):
+        stream["routes"]["/notifications/unreadCount"] = lambda request: httpx.Response(
+            401, json={"message": "Invalid token"},
+        )
+        response = asyncio.run(self.open_stream())
+        assert response.status_code == 401
+        assert server.notify_subscribers == {}
+
+    def test_poller_dedupes_overlapping_feed_pages(self, stream, monkeypatch):
+        monkeypatch.setattr(server, "NOTIFY_POLL_INTERVAL", 0.01)
+        monkeypatch.setattr(server, "NOTIFY_IDLE_TIMEOUT", 0.05)
+        polls = []
+
+        def feed(request):
+            assert request.headers[server.INTERNAL_SECRET_HEADER] == server.PROXY_IDENTITY_SECRET
+            polls.append(dict(request.url.params))
+            note = {"_id": "n1", "userId": "u1", "message": "due soon"}
+            return httpx.Response(200, json={"notifications": [note], "now": 1_000_000, "next": None})
+
+        stream["routes"]["/internal/notifications/feed"] = feed
+        server.notify_replay["u1"] = server.deque(maxlen=server.NOTIFY_REPLAY_SIZE)
+        asyncio.run(server.poll_notifications())
+        assert len(polls) > 1
+        assert polls[1] == {"since": str(1_000_000 - int(server.NOTIFY_OVERLAP * 1000))}
+        assert server.notify_stats["events"] >= 1
+        assert server.notify_poller_task is None and server.notify_replay == {}
+
+    def test_internal_header_is_never_forwarded(self, client, upstream):
+        client.get("/api/internal/notifications/feed", headers={server.INTERNAL_SECRET_HEADER: "guess"})
+        assert server.INTERNAL_SECRET_HEADER not in upstream["calls"][-1].headers
+
+
+def apply_patch(document, patch):
+    """Minimal RFC 6902 applier for the ops the proxy emits"""
+    document = json.loads(json.dumps(document))
+
+    def locate(pointer):
+        tokens = [t.replace("~1", "/").replace("~0", "~") for t in pointer.split("/")[1:]]
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token) if isinstance(parent, list) else token]
+        last = tokens[-1]
+        return parent, int(last) if isinstance(parent, list) else last
+
+    for op in patch:
+        if op["path"] == "":
+            document = op["value"]
+            continue
+        if op["op"] == "move":
+            parent, key = locate(op["from"])
+            value = parent.pop(key)
+            op = {"op": "add", "path": op["path"], "value": value}
+        parent, key = locate(op["path"])
+        if op["op"] == "remove":
+            parent.pop(key)
+        elif op["op"] == "add" and isinstance(parent, list):
+            parent.insert(key, op["value"])
+        else:
+            parent[key] = op["value"]
+    return document
+
+
+class TestSync:
+    """Per-user snapshots and JSON Patch deltas against a client-held version"""
+
+    @pytest.fixture
+    def tasks(self, upstream):
+        state = {"tasks": [{"_id": str(i), "title": f"task {i}", "status": "Pending"} for i in range(30)]}
+        upstream["routes"]["/task/getTaskList"] = lambda request: httpx.Response(200, json=state)
+        yield state
+        server.sync_snapshots.clear()
+        server.sync_bytes = 0
+
+    def test_delta_against_previous_version(self, client, upstream, tasks):
+        first = client.get("/api/sync/task/getTaskList?page=1")
+        assert first.json()["full"] is True
+        assert first.headers[server.SYNC_VERSION_HEADER] == first.json()["version"]
+        previous = first.json()["data"]
+
+        tasks["tasks"].insert(0, {"_id": "new", "title": "fresh", "status": "Pending"})
+        tasks["tasks"][5]["status"] = "Completed"
+        del tasks["tasks"][10]
+        tasks["tasks"].insert(20, tasks["tasks"].pop(2))
+        resp = client.get("/api/sync/task/getTaskList?page=1", headers={"x-sync-version": first.json()["version"]})
+        delta = resp.json()
+        assert delta["base"] == first.json()["version"]
+        assert apply_patch(previous, delta["patch"]) == tasks
+        assert len(resp.content) < len(json.dumps(tasks))
+        assert upstream["calls"][-1].url.query == b"page=1"
+
+        again = client.get("/api/sync/task/getTaskList?page=1", headers={"x-sync-version": delta["version"]})
+        assert again.json()["patch"] == []
+
+    def test_unknown_version_falls_back_to_full(self, client, upstream, tasks):
+        before = server.sync_stats["misses"]
+        resp = client.get("/api/sync/task/getTaskList", headers={"x-sync-version": "evicted"})
+        assert resp.json()["data"] == tasks
+        assert server.sync_stats["misses"] == before + 1
+
+    def test_snapshots_are_per_user(self, client, upstream, tasks):
+        version = client.get("/api/sync/task/getTaskList", headers={"Authorization": "Bearer user-a"}).json()["version"]
+        tasks["tasks"].pop()
+        resp = client.get("/api/sync/task/getTaskList", headers={"Authorization": "Bearer user-b", "x-sync-version": version})
+        assert resp.json()["full"] is True
+
+    def test_snapshot_memory_is_bounded(self, client, upstream, tasks, monkeypatch):
+        monkeypatch.setattr(server, "SYNC_MAX_BYTES", len(json.dumps(tasks)) + 100)
+        client.get("/api/sync/task/getTaskList?page=1")
+        client.get("/api/sync/task/getTaskList?page=2")
+        assert len(server.sync_snapshots) == 1
+        assert server.sync_bytes <= server.SYNC_MAX_BYTES
+        ((_, body),) = next(iter(server.sync_snapshots.values()))
+        assert server.sync_bytes == len(body) and json.loads(body) == tasks
+
+    def test_only_configured_routes(self, client, upstream):
+        assert client.get("/api/sync/me/userinfo").status_code == 404
+        upstream["routes"]["/chat/rooms"] = lambda request: httpx.Response(403, json={"message": "Forbidden"})
+        assert client.get("/api/sync/chat/rooms").status_code == 403
+        assert upstream["calls"][-1].url.path == "/chat/rooms"
+
+    def test_json_diff(self):
+        old = {"a/b": [1, 2, 3], "gone": True, "n": {"x": 1}}
+        new = {"a/b": [1, 5], "n": {"x": 2, "y": [None]}, "kind": "list"}
+        patch = server.json_diff(old, new)
+        assert {"op": "remove", "path": "/a~1b/2"} in patch
+        assert apply_patch(old, patch) == new
+        assert server.json_diff([1], {"a": 1}) == [{"op": "replace", "path": "", "value": {"a": 1}}]
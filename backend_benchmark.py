@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+ForaTask API Load & Latency Benchmark
+Drives a realistic mixed workload (login, task list, multi-location task creation,
+attendance check-in, chat DM) with concurrent asyncio virtual users, reports
+p50/p95/p99 latency and throughput per endpoint, compares direct-to-Node against
+through-proxy, and stores results as JSON for run-to-run regression checks.
+
+Usage:
+    python backend_benchmark.py --concurrency 20 --duration 30 --output bench.json
+    python backend_benchmark.py --targets proxy --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import httpx
+
+PROXY_URL = os.environ.get("REACT_APP_BACKEND_URL", "http://localhost:8001").rstrip("/") + "/api"
+DIRECT_URL = os.environ.get("NODE_BACKEND_URL", "http://127.0.0.1:3333").rstrip("/")
+# The proxy starts Node on a Unix socket by default (NODE_TRANSPORT=uds); "direct" then goes through it
+DIRECT_UDS = os.environ.get("NODE_BACKEND_UDS", "/tmp/foratask-node/node-3333.sock")
+
+# Seeded credentials (same as backend/tests/test_foratask.py)
+SEEDED_USERS = [
+    {"email": "rajvi@varientworld.com", "password": "Rajvi@123"},
+    {"email": "shubh@varientworld.com", "password": "Shubh@123"},
+    {"email": "developers1@varientworld.com", "password": "Tushar@123"},
+]
+
+# Relative weight of each action in the mixed workload
+DEFAULT_MIX = {
+    "login": 1,
+    "task_list": 6,
+    "dashboard": 4,
+    "create_task": 1,
+    "attendance_check_in": 1,
+    "chat_dm": 2,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LatencyRecorder:
+    """Collects per-endpoint latencies and status codes"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.started = time.perf_counter()
+
+    def record(self, endpoint, seconds, status):
+        self.samples[endpoint].append(seconds)
+        self.statuses[endpoint][str(status)] += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        endpoints = {}
+        for endpoint, values in sorted(self.samples.items()):
+            values = sorted(values)
+            statuses = self.statuses[endpoint]
+            errors = sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500)
+            endpoints[endpoint] = {
+                "count": len(values),
+                "errors": errors,
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "statuses": dict(statuses),
+            }
+        total = sum(e["count"] for e in endpoints.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "endpoints": endpoints,
+        }
+
+
+class ForaTaskBenchmark:
+    def __init__(self, base_url, recorder, mix, seed=0, uds=None):
+        self.base_url = base_url
+        self.uds = uds
+        self.recorder = recorder
+        self.mix = mix
+        self.seed = seed
+
+    async def request(self, client, endpoint, method, path, token=None, json_body=None, params=None):
+        """Timed request; `endpoint` is the name results are grouped under"""
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, f"{self.base_url}/{path}", headers=headers,
+                                            json=json_body, params=params)
+            await response.aread()
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.recorder.record(endpoint, time.perf_counter() - start, status)
+        return response
+
+    async def login(self, client, credentials):
+        response = await self.request(client, "POST auth/login", "POST", "auth/login", json_body=credentials)
+        if response is not None and response.status_code == 200:
+            return response.json().get("token")
+        return None
+
+    async def task_list(self, client, state):
+        await self.request(client, "GET task/getTaskList", "GET", "task/getTaskList", state["token"],
+                           params={"isSelfTask": "false", "perPage": 15, "page": 0})
+
+    async def dashboard(self, client, state):
+        await asyncio.gather(
+            self.request(client, "GET stats/tasks-summary", "GET", "stats/tasks-summary", state["token"],
+                         params={"isSelfTask": "false"}),
+            self.request(client, "GET stats/todaysTasks", "GET", "stats/todaysTasks", state["token"]),
+            self.request(client, "GET notifications/unreadCount", "GET", "notifications/unreadCount", state["token"]),
+            self.request(client, "GET attendance/today", "GET", "attendance/today", state["token"]),
+        )
+
+    async def create_task(self, client, state):
+        user_ids = state["user_ids"]
+        if not user_ids:
+            return
+        payload = {
+            "title": "BENCH_MultiLocation_Task_" + datetime.now().strftime("%Y%m%d%H%M%S%f"),
+            "description": "Task created by backend_benchmark.py",
+            "priority": "Medium",
+            "taskType": "Single",
+            "dueDateTime": (datetime.now() + timedelta(days=5)).isoformat(),
+            "assignees": user_ids[:1],
+            "observers": user_ids[:2],
+            "isRemote": False,
+            "isMultiLocation": True,
+        }
+        response = await self.request(client, "POST task/add-task", "POST", "task/add-task", state["token"],
+                                      json_body=payload)
+        if response is None or response.status_code != 200:
+            return
+        data = response.json()
+        task_id = data.get("task", {}).get("_id") or data.get("taskId")
+        if task_id:
+            locations = {"locations": [{"name": f"Location {i}", "description": "Benchmark location"} for i in range(1, 4)]}
+            await self.request(client, "POST task-extended/:taskId/locations", "POST",
+                               f"task-extended/{task_id}/locations", state["token"], json_body=locations)
+
+    async def attendance_check_in(self, client, state):
+        payload = {
+            "coordinates": {"latitude": 23.0225, "longitude": 72.5714},
+            "address": "Benchmark Office",
+            "accuracy": 10,
+        }
+        await self.request(client, "POST attendance/check-in", "POST", "attendance/check-in", state["token"],
+                           json_body=payload)
+
+    async def chat_dm(self, client, state):
+        others = [uid for uid in state["user_ids"] if uid != state.get("user_id")]
+        if not others:
+            return
+        response = await self.request(client, "POST chat/dm", "POST", "chat/dm", state["token"],
+                                      json_body={"otherUserId": others[0]})
+        if response is None or response.status_code not in (200, 201):
+            return
+        room_id = response.json().get("room", {}).get("_id")
+        if room_id:
+            await self.request(client, "POST chat/rooms/:roomId/messages", "POST", f"chat/rooms/{room_id}/messages",
+                               state["token"], json_body={"content": "benchmark ping"})
+
+    async def virtual_user(self, client, index, deadline):
+        rng = random.Random(self.seed + index)
+        credentials = SEEDED_USERS[index % len(SEEDED_USERS)]
+        state = {"token": await self.login(client, credentials), "user_ids": []}
+        if not state["token"]:
+            return
+        response = await self.request(client, "GET me/usersList", "GET", "me/usersList", state["token"])
+        if response is not None and response.status_code == 200:
+            users = response.json() if isinstance(response.json(), list) else response.json().get("users", [])
+            state["user_ids"] = [u["_id"] for u in users if "_id" in u]
+
+        actions, weights = zip(*self.mix.items())
+        while time.perf_counter() < deadline:
+            action = rng.choices(actions, weights)[0]
+            if action == "login":
+                state["token"] = await self.login(client, credentials) or state["token"]
+            else:
+                await getattr(self, action)(client, state)
+
+    async def run(self, concurrency, duration, warmup):
+        limits = httpx.Limits(max_connections=concurrency * 4, max_keepalive_connections=concurrency * 4)
+        transport = httpx.AsyncHTTPTransport(uds=self.uds, limits=limits) if self.uds else None
+        async with httpx.AsyncClient(limits=limits, timeout=30.0, transport=transport) as client:
+            if warmup:
+                await asyncio.gather(*(self.virtual_user(client, i, time.perf_counter() + warmup)
+                                       for i in range(concurrency)))
+            self.recorder.reset()
+            deadline = time.perf_counter() + duration
+            await asyncio.gather(*(self.virtual_user(client, i, deadline) for i in range(concurrency)))
+        return self.recorder.summary()
+
+
+def proxy_overhead(results):
+    """Per-endpoint latency added by the proxy (proxy minus direct)"""
+    proxy, direct = results.get("proxy"), results.get("direct")
+    if not proxy or not direct:
+        return {}
+    overhead = {}
+    for endpoint, stats in proxy["endpoints"].items():
+        base = direct["endpoints"].get(endpoint)
+        if base:
+            overhead[endpoint] = {
+                f"{p}_ms": round(stats[f"{p}_ms"] - base[f"{p}_ms"], 2) for p in ("p50", "p95", "p99")
+            }
+    return overhead
+
+
+def compare_runs(current, baseline, threshold):
+    """Endpoints whose p95 got worse than `threshold` percent versus the baseline run"""
+    regressions = []
+    for target, summary in current["targets"].items():
+        previous = baseline.get("targets", {}).get(target)
+        if not previous:
+            continue
+        for endpoint, stats in summary["endpoints"].items():
+            before = previous["endpoints"].get(endpoint)
+            if not before or not before["p95_ms"]:
+                continue
+            change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            print(f"  {target:6} {endpoint:40} p95 {before['p95_ms']:8.2f} -> {stats['p95_ms']:8.2f} ms ({change:+.1f}%)")
+            if change > threshold:
+                regressions.append({"target": target, "endpoint": endpoint, "change_pct": round(change, 1)})
+    return regressions
+
+
+def print_summary(target, summary):
+    print(f"\n📊 {target}: {summary['requests']} requests in {summary['elapsed_s']}s "
+          f"({summary['throughput_rps']} req/s)")
+    print(f"  {'endpoint':40} {'count':>6} {'err':>4} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, s in summary["endpoints"].items():
+        print(f"  {endpoint:40} {s['count']:6} {s['errors']:4} {s['throughput_rps']:7} "
+              f"{s['p50_ms']:8} {s['p95_ms']:8} {s['p99_ms']:8}")
+
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, value.split(",")):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {name!r}")
+        mix[name] = float(weight)
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ForaTask API load and latency benchmark")
+    parser.add_argument("--proxy-url", default=PROXY_URL, help="API base through the FastAPI proxy")
+    parser.add_argument("--direct-url", default=DIRECT_URL, help="API base of a Node worker")
+    parser.add_argument("--direct-uds", default=DIRECT_UDS, help="Node worker socket; empty to use --direct-url over TCP")
+    parser.add_argument("--targets", default="direct,proxy", help="comma separated: direct, proxy")
+    parser.add_argument("--concurrency", type=int, default=10, help="virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per target")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before each run")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX), help="e.g. task_list=10,chat_dm=0")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to check for p95 regressions")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed p95 regression in percent")
+    args = parser.parse_args()
+
+    urls = {"proxy": args.proxy_url, "direct": args.direct_url}
+    print("🚀 Starting ForaTask API benchmark...")
+    print(f"Concurrency: {args.concurrency}, duration: {args.duration}s, mix: {args.mix}")
+
+    results = {}
+    for target in filter(None, args.targets.split(",")):
+        print(f"\n🔍 Benchmarking {target} ({urls[target]})...")
+        uds = args.direct_uds if target == "direct" and os.path.exists(args.direct_uds or "") else None
+        bench = ForaTaskBenchmark(urls[target], LatencyRecorder(), args.mix, args.seed, uds)
+        results[target] = asyncio.run(bench.run(args.concurrency, args.duration, args.warmup))
+        print_summary(target, results[target])
+
+    report = {
+        "started_at": datetime.now().isoformat(),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": args.mix,
+            "urls": {t: urls[t] for t in results},
+        },
+        "targets": results,
+        "proxy_overhead": proxy_overhead(results),
+    }
+    if report["proxy_overhead"]:
+        print("\n⏱️  Proxy overhead (proxy - direct):")
+        for endpoint, o in report["proxy_overhead"].items():
+            print(f"  {endpoint:40} p50 {o['p50_ms']:+8.2f} p95 {o['p95_ms']:+8.2f} p99 {o['p99_ms']:+8.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\n📈 Comparing against {args.compare}:")
+        regressions = compare_runs(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} endpoint(s) regressed more than {args.threshold}% at p95")
+            return 1
+        print("\n✅ No p95 regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
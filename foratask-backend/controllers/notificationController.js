@@ -136,6 +136,31 @@ const getAllNotifications = async (req, res) => {
   }
 };
 
+// Notifications of every company created since ?since= (ms), oldest first; polled by the proxy to feed
+// /api/notifications/stream. A full page comes with `next`, the (createdAt, _id) cursor to continue from.
+const NOTIFICATION_FEED_LIMIT = 500;
+const notificationFeed = async (req, res) => {
+  try {
+    const now = Date.now();
+    const since = new Date(Number(req.query.since) || now);
+    const filter = mongoose.isValidObjectId(req.query.after)
+      ? { $or: [{ createdAt: { $gt: since } }, { createdAt: since, _id: { $gt: req.query.after } }] }
+      : { createdAt: { $gte: since } };
+    const notifications = await Notification.find(filter)
+      .sort({ createdAt: 1, _id: 1 })
+      .limit(NOTIFICATION_FEED_LIMIT)
+      .lean();
+    const last = notifications[notifications.length - 1];
+    const next = notifications.length === NOTIFICATION_FEED_LIMIT
+      ? { since: last.createdAt.getTime(), after: last._id }
+      : null;
+    return res.status(200).json({ notifications, now, next });
+  }
+  catch (err) {
+    return res.status(500).json({ message: err.message });
+  }
+};
+
 const unreadCount = async (req, res) => {
   const count = await Notification.countDocuments({ userId: req.user.id, isRead: false, company: req.user.company });
   res.status(200).json({ count });
@@ -232,4 +257,4 @@ const handleTaskApproval = async (req, res) => {
   }
 };
 
-module.exports = { getAllNotifications, unreadCount, handleTaskApproval, sendPushNotification, sendBulkPushNotifications }
\ No newline at end of file
+module.exports = { getAllNotifications, unreadCount, notificationFeed, handleTaskApproval, sendPushNotification, sendBulkPushNotifications }
\ No newline at end of file
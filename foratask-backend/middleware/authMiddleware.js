@@ -1,8 +1,32 @@
+const crypto = require("crypto");
 const jwt = require("jsonwebtoken");
 const User = require("../models/user");
 
+// Set by the Python proxy when it spawns this process; it verifies the JWT and forwards the claims
+const PROXY_IDENTITY_SECRET = process.env.PROXY_IDENTITY_SECRET
+  ? Buffer.from(process.env.PROXY_IDENTITY_SECRET)
+  : null;
+
+const proxyVerifiedClaims = (req) => {
+  const secret = req.headers["x-proxy-identity"];
+  const claims = req.headers["x-forwarded-claims"];
+  if (!PROXY_IDENTITY_SECRET || !secret || !claims) return null;
+  const given = Buffer.from(secret);
+  if (given.length !== PROXY_IDENTITY_SECRET.length || !crypto.timingSafeEqual(given, PROXY_IDENTITY_SECRET)) {
+    return null;
+  }
+  return JSON.parse(Buffer.from(claims, "base64url").toString("utf8"));
+};
+
 const auth = (req, res, next) => {
   try {
+    // Already verified by the proxy
+    const trusted = proxyVerifiedClaims(req);
+    if (trusted) {
+      req.user = trusted;
+      return next();
+    }
+
     // Read from "Authorization" header
     const authHeader = req.headers["authorization"];
     if (!authHeader) {
@@ -24,4 +48,15 @@ const auth = (req, res, next) => {
   }
 };
 
+// Endpoints only the proxy itself may call; it strips this header from client requests
+const proxyOnly = (req, res, next) => {
+  const given = Buffer.from(req.headers["x-proxy-internal"] || "");
+  if (!PROXY_IDENTITY_SECRET || given.length !== PROXY_IDENTITY_SECRET.length
+      || !crypto.timingSafeEqual(given, PROXY_IDENTITY_SECRET)) {
+    return res.status(404).json({ message: "Not found" });
+  }
+  next();
+};
+
 module.exports = auth;
+module.exports.proxyOnly = proxyOnly;
@@ -19,4 +19,7 @@ const notificationSchema = new mongoose.Schema({
     company: { type: mongoose.Schema.Types.ObjectId, ref: "Company", required: true },
 });
 
+// Range scans by the proxy's notification feed
+notificationSchema.index({ createdAt: 1, _id: 1 });
+
 module.exports = mongoose.model("Notification", notificationSchema);
@@ -1,4 +1,5 @@
 const express = require("express");
+const fs = require("fs");
 const mongoose = require("mongoose");
 const authRoute = require("./routes/auth");
 const authMiddleware = require("./middleware/authMiddleware");
@@ -19,7 +20,7 @@ const salaryRoute = require('./routes/salary');
 const leaveRoute = require('./routes/leave');
 const taskExtendedRoute = require('./routes/taskExtended');
 
-const { sendBulkPushNotifications } = require('./controllers/notificationController');
+const { sendBulkPushNotifications, notificationFeed } = require('./controllers/notificationController');
 const { seedMasterAdmin } = require('./controllers/masterAdminController');
 const Task = require('./models/task');
 const User = require('./models/user');
@@ -52,6 +53,8 @@ app.use(cookie());
 app.use(express.json());
 app.use(express.urlencoded({ extended: true }));
 const PORT = process.env.PORT || 3000;
+// Set by the Python proxy to listen on a Unix domain socket instead of a TCP port
+const SOCKET_PATH = process.env.SOCKET_PATH;
 const MONGO_URI = process.env.MONGO_URI;
 
 // Routes
@@ -62,6 +65,11 @@ app.use('/task-extended', authMiddleware, taskExtendedRoute);
 app.use('/uploads', express.static('uploads'));
 app.use('/stats', authMiddleware, statsRoute);
 app.use('/notifications/', authMiddleware, notificationRoute);
+app.get('/internal/notifications/feed', authMiddleware.proxyOnly, notificationFeed);
+app.post('/internal/crons/start', authMiddleware.proxyOnly, (req, res) => {
+  startCrons();
+  res.status(200).json({ running: true });
+});
 app.use('/reports', authMiddleware, reportRoute);
 app.use('/payment', paymentRoute);
 app.use('/master-admin', masterAdminRoute);
@@ -71,6 +79,7 @@ app.use('/attendance', attendanceRoute);
 app.use('/organization-settings', organizationSettingsRoute);
 app.use('/salary', salaryRoute);
 app.use('/leave', leaveRoute);
+app.get('/health', (req, res) => res.json({ status: 'ok', pid: process.pid, cronsRunning }));
 app.use('/', authMiddleware, adminRoute);
 
 // Global references for socket.io
@@ -139,6 +148,22 @@ io.on("connection", (socket) => {
 global.io = io;
 global.connectedUsers = connectedUsers;
 
+// When the proxy runs several Node workers, only one of them runs the crons. A new generation started by a
+// rolling restart gets RUN_CRONS=false and is told to start them once the old cron worker has exited,
+// so no job runs twice.
+let cronsRunning = process.env.RUN_CRONS !== "false";
+const cronJobs = [];
+const scheduleCron = (expression, job) => {
+  cronJobs.push([expression, job]);
+  if (cronsRunning) cron.schedule(expression, job);
+};
+function startCrons() {
+  if (cronsRunning) return;
+  cronsRunning = true;
+  cronJobs.forEach(([expression, job]) => cron.schedule(expression, job));
+  console.log("Cron jobs started");
+}
+
 function getRemainingTime(now, due) {
   let diffMs = due - now;
   if (diffMs < 0) diffMs = 0;
@@ -152,7 +177,7 @@ function getRemainingTime(now, due) {
   return `${minutes} minute${minutes > 1 ? "s" : ""}`;
 }
 
-cron.schedule("* * * * *", async () => {
+scheduleCron("* * * * *", async () => {
   try {
     const now = new Date();
     const overdueTasks = await Task.find({
@@ -241,7 +266,7 @@ cron.schedule("* * * * *", async () => {
     console.error("Cron job error:", err);
   }
 });
-cron.schedule("* * * * *", async () => {
+scheduleCron("* * * * *", async () => {
   try {
     console.log("🔔 Bulk Notification Cron Started...");
 
@@ -330,7 +355,7 @@ cron.schedule("* * * * *", async () => {
   }
 });
 
-cron.schedule("0 0 * * *", async () => {
+scheduleCron("0 0 * * *", async () => {
   try {
     await Notification.deleteMany({ expiresAt: { $lt: new Date() } });
     
@@ -422,7 +447,7 @@ cron.schedule("0 0 * * *", async () => {
 });
 
 // Subscription expiry notification cron - runs every hour
-cron.schedule("0 * * * *", async () => {
+scheduleCron("0 * * * *", async () => {
   try {
     console.log("📅 Checking subscription expiry notifications...");
     const now = new Date();
@@ -517,8 +542,13 @@ mongoose.connect(MONGO_URI).then(async () => {
   // Seed master admin on startup
   await seedMasterAdmin();
   
-  server.listen(PORT, () => {
-    console.log('Server running on 3000');
+  if (SOCKET_PATH) {
+    // A socket file left behind by a crashed process would make listen() fail with EADDRINUSE
+    fs.rmSync(SOCKET_PATH, { force: true });
+  }
+  server.listen(SOCKET_PATH || PORT, () => {
+    if (SOCKET_PATH) fs.chmodSync(SOCKET_PATH, 0o600);
+    console.log(`Server running on ${SOCKET_PATH || PORT}`);
   })
 }).catch((err) => {
   console.log(err);
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+ForaTask proxy -> Node transport benchmark
+Starts a minimal Node HTTP server listening on both a loopback TCP port and a Unix
+domain socket, then drives each with the proxy's upstream client settings (same
+httpx pool limits) at high concurrency and reports throughput and p50/p95/p99 latency.
+
+Usage:
+    python upstream_transport_benchmark.py --concurrency 256 --duration 10
+    python upstream_transport_benchmark.py --body-size 16384 --transports uds
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+import server  # noqa: E402
+
+NODE_STUB = """
+const http = require("http");
+const body = Buffer.from(JSON.stringify({ tasks: "x".repeat(Number(process.env.BODY_SIZE)) }));
+const handler = (req, res) => {
+  res.writeHead(200, { "content-type": "application/json", "content-length": body.length });
+  res.end(body);
+};
+http.createServer(handler).listen(Number(process.env.PORT));
+http.createServer(handler).listen(process.env.SOCKET_PATH, () => console.log("ready"));
+"""
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def upstream_limits():
+    return httpx.Limits(
+        max_connections=server.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=server.UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=server.UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+
+
+async def drive(client, url, concurrency, duration, warmup):
+    latencies, errors = [], 0
+    measuring = False
+
+    async def virtual_user(deadline):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                resp = await client.get(url)
+                resp.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if measuring:
+                latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(virtual_user(time.monotonic() + warmup) for _ in range(concurrency)))
+    measuring = True
+    started = time.monotonic()
+    await asyncio.gather(*(virtual_user(started + duration) for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(args, port, socket_path):
+    results = {}
+    for transport in filter(None, args.transports.split(",")):
+        if transport == "uds":
+            http_transport = httpx.AsyncHTTPTransport(uds=socket_path, limits=upstream_limits())
+        else:
+            http_transport = httpx.AsyncHTTPTransport(limits=upstream_limits())
+        async with httpx.AsyncClient(transport=http_transport, timeout=30) as client:
+            results[transport] = await drive(
+                client, f"http://127.0.0.1:{port}/task/getTaskList", args.concurrency, args.duration, args.warmup,
+            )
+        r = results[transport]
+        print(
+            f"  {transport:<4} {r['rps']:9.0f} req/s   p50 {r['p50_ms']:7.2f}ms   p95 {r['p95_ms']:7.2f}ms"
+            f"   p99 {r['p99_ms']:7.2f}ms   errors {r['errors']}"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback TCP vs Unix socket transport to Node")
+    parser.add_argument("--transports", default="tcp,uds", help="comma separated: tcp, uds")
+    parser.add_argument("--concurrency", type=int, default=256, help="concurrent requests in flight")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per transport")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each run")
+    parser.add_argument("--body-size", type=int, default=2048, help="response body bytes")
+    parser.add_argument("--port", type=int, default=3999)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        socket_path = os.path.join(socket_dir, "node.sock")
+        env = {**os.environ, "PORT": str(args.port), "SOCKET_PATH": socket_path, "BODY_SIZE": str(args.body_size)}
+        node = subprocess.Popen(["node", "-e", NODE_STUB], env=env, stdout=subprocess.PIPE)
+        try:
+            node.stdout.readline()
+            print(f"🚀 {args.concurrency} concurrent requests, {args.body_size}B responses, "
+                  f"pool max {server.UPSTREAM_MAX_CONNECTIONS} connections")
+            results = asyncio.run(run(args, args.port, socket_path))
+        finally:
+            node.terminate()
+            node.wait()
+    if "tcp" in results and "uds" in results:
+        gain = (results["uds"]["rps"] / results["tcp"]["rps"] - 1) * 100
+        print(f"✅ UDS throughput {gain:+.1f}% vs loopback TCP")
+
+
+if __name__ == "__main__":
+    main()